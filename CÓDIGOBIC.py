@@ -2,18 +2,41 @@ import psycopg2
 from psycopg2 import sql
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import pandas as pd
+import numpy as np
+import functools
+import io
+import multiprocessing
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
 import os
+import re
+import sys
+import time
 import matplotlib.pyplot as plt
 import seaborn as sns
+import analitica_clientes
+import catalogos
+import conexion
+import consultas_instantanea
+import metricas
+import perfil_calidad
+
+# pyarrow es opcional: solo se usa para exportar el histórico a Parquet
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+CHUNK_SIZE = 200000
+RUTA_CLASIFICACION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'macroactivos.json')
 
 
 def create_database(db_name):
-    conn = psycopg2.connect(
-        host="localhost",
-        user="postgres",
-        password="password",
-        port="5432"
-    )
+    # Conexión administrativa a la base de mantenimiento; credenciales desde conexion.py
+    conn = conexion.conectar(database="postgres")
     conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
     cursor = conn.cursor()
     try:
@@ -23,326 +46,1386 @@ def create_database(db_name):
         print(f"⚠️ La base de datos '{db_name}' ya existe")
     cursor.close()
     conn.close()
-    conn = psycopg2.connect(
-        host="localhost",
-        user="postgres",
-        password="password",
-        port="5432",
-        database=db_name
-    )
-    return conn
+    return conexion.obtener_conexion(db_name)
 
-def create_tables(conn):
+COLUMNAS_HISTORICO = """
+      id_sistema_cliente VARCHAR(255),
+      ingestion_year VARCHAR(255),
+      ingestion_month NUMERIC(255),
+      ingestion_day VARCHAR(255),
+      macroactivo VARCHAR(255),
+      cod_activo VARCHAR(255),
+      aba NUMERIC(20,2),
+      cod_perfil_riesgo VARCHAR(255),
+      cod_banca VARCHAR(255),
+      year VARCHAR(255),
+      month NUMERIC(255)
+"""
+
+# Esquema compacto: enteros pequeños para fechas, enum para macroactivo y un periodo DATE derivado
+COLUMNAS_HISTORICO_TIPADO = """
+      id_sistema_cliente VARCHAR(11),
+      ingestion_year SMALLINT,
+      ingestion_month SMALLINT,
+      ingestion_day SMALLINT,
+      macroactivo tipo_macroactivo,
+      cod_activo VARCHAR(16),
+      aba NUMERIC(20,2),
+      cod_perfil_riesgo VARCHAR(16),
+      cod_banca VARCHAR(16),
+      year SMALLINT,
+      month SMALLINT,
+      periodo DATE GENERATED ALWAYS AS (
+        CASE WHEN month BETWEEN 1 AND 12 THEN make_date(year, month, 1) END
+      ) STORED
+"""
+
+# Límites del esquema tipado: un valor que no cabe haría fallar el COPY del bloque entero, así que la fila va
+# a la tabla pendiente de su columna con el motivo '<columna>_largo' (o 'macroactivo_fuera_del_tipo')
+LARGO_MAXIMO_ENUM = 63  # bytes de una etiqueta de enum en PostgreSQL
+LARGOS_TIPADO = {
+    'id_sistema_cliente': ('pendientes_idCliente', 11),
+    'cod_activo': ('pendientes_codActivo', 16),
+    'cod_perfil_riesgo': ('pendientes_perfil_riesgo', 16),
+    'cod_banca': ('pendientes_codbanca', 16),
+}
+
+TABLAS_PENDIENTES = [
+    'pendientes_idCliente',
+    'pendientes_month',
+    'pendientes_codActivo',
+    'pendientes_aba',
+    'pendientes_perfil_riesgo',
+    'pendientes_codbanca',
+]
+
+# Filas con columnas corridas que no se pudieron realinear: todo como texto, con el motivo y la fila leída
+COLUMNAS_DESALINEADAS = """
+      id_sistema_cliente VARCHAR(255),
+      ingestion_year VARCHAR(255),
+      ingestion_month VARCHAR(255),
+      ingestion_day VARCHAR(255),
+      macroactivo VARCHAR(255),
+      cod_activo VARCHAR(255),
+      aba VARCHAR(255),
+      cod_perfil_riesgo VARCHAR(255),
+      cod_banca VARCHAR(255),
+      year VARCHAR(255),
+      month VARCHAR(255),
+      motivo VARCHAR(64),
+      fila_original TEXT
+"""
+
+# Columnas agregadas a tablas que ya existían en instalaciones anteriores
+COLUMNAS_AGREGADAS = {
+    # Macroactivo por código, que prevalece sobre macroactivos.json
+    'catalogo_activos': ['macroactivo VARCHAR(255)'],
+    # Montos que no se pudieron leer: el motivo y el texto original (aba queda nulo)
+    'pendientes_aba': ['motivo VARCHAR(64)', 'aba_original VARCHAR(255)'],
+    # Regla que apartó la fila (p. ej. cod_activo_nulo o cod_activo_largo)
+    'pendientes_idCliente': ['motivo VARCHAR(64)'],
+    'pendientes_codActivo': ['motivo VARCHAR(64)'],
+    'pendientes_perfil_riesgo': ['motivo VARCHAR(64)'],
+    'pendientes_codbanca': ['motivo VARCHAR(64)'],
+}
+
+def _agregar_columnas(cursor):
+    # Una base creada antes de agregar estas columnas las recibe aquí (las cargas incrementales no reinician)
+    for tabla, columnas in COLUMNAS_AGREGADAS.items():
+        cursor.execute(f"ALTER TABLE {tabla} {', '.join(f'ADD COLUMN IF NOT EXISTS {c}' for c in columnas)}")
+
+def valores_macroactivo(mapa):
+    # Macroactivos de la clasificación que caben como etiqueta del enum; los demás van a pendientes
+    return [m for m in dict.fromkeys(mapa.values()) if m and len(m.encode('utf-8')) <= LARGO_MAXIMO_ENUM]
+
+def asegurar_tipo_macroactivo(conn, mapa):
+    # El enum sigue a la clasificación efectiva (macroactivos.json y catalogo_activos). Si no existe se crea en
+    # la transacción en curso; si existe, los valores nuevos se agregan y confirman desde otra conexión, porque
+    # un valor agregado no se puede usar en la transacción que lo agrega y la carga en curso (p. ej. el
+    # borrado y recarga incremental) no debe partirse en dos
+    valores = valores_macroactivo(mapa)
     cursor = conn.cursor()
-    cursor.execute("""
-    DROP TABLE IF EXISTS pendientes_codbanca;
-    DROP TABLE IF EXISTS pendientes_perfil_riesgo;
-    DROP TABLE IF EXISTS pendientes_aba;
-    DROP TABLE IF EXISTS pendientes_idCliente;
-    DROP TABLE IF EXISTS pendientes_month;
-    DROP TABLE IF EXISTS pendientes_codActivo;
-    DROP TABLE IF EXISTS historico_aba_macroactivos;
-    DROP TABLE IF EXISTS cat_banca;
-    DROP TABLE IF EXISTS catalogo_activos;
-    DROP TABLE IF EXISTS cat_perfil_riesgo;
-
-    CREATE TABLE cat_perfil_riesgo (
+    cursor.execute("SELECT to_regtype('tipo_macroactivo') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        cursor.execute(sql.SQL("CREATE TYPE tipo_macroactivo AS ENUM ({})").format(
+            sql.SQL(', ').join(sql.Literal(m) for m in valores)))
+        cursor.close()
+        return valores
+    cursor.execute("SELECT UNNEST(enum_range(NULL::tipo_macroactivo))::TEXT")
+    existentes = {valor for (valor,) in cursor.fetchall()}
+    cursor.close()
+    nuevos = [m for m in valores if m not in existentes]
+    if nuevos:
+        otra = conexion.obtener_conexion(conn.info.dbname)
+        try:
+            cursor = otra.cursor()
+            for macroactivo in nuevos:
+                cursor.execute("ALTER TYPE tipo_macroactivo ADD VALUE IF NOT EXISTS %s", (macroactivo,))
+            otra.commit()
+            cursor.close()
+        finally:
+            conexion.liberar_conexion(otra)
+        print(f"🏷️ Macroactivo(s) agregados a tipo_macroactivo: {', '.join(nuevos)}")
+    return valores
+
+def create_tables(conn, tipado=False, particionado=False, reiniciar=True):
+    # El particionado por (year, month) requiere el esquema tipado
+    tipado = tipado or particionado
+    # Sin reiniciar solo se crean las tablas que falten (modo incremental)
+    crear = "CREATE TABLE" if reiniciar else "CREATE TABLE IF NOT EXISTS"
+    cursor = conn.cursor()
+    if reiniciar:
+        cursor.execute("""
+        DROP TABLE IF EXISTS pendientes_codbanca;
+        DROP TABLE IF EXISTS pendientes_perfil_riesgo;
+        DROP TABLE IF EXISTS pendientes_aba;
+        DROP TABLE IF EXISTS pendientes_idCliente;
+        DROP TABLE IF EXISTS pendientes_month;
+        DROP TABLE IF EXISTS pendientes_codActivo;
+        DROP TABLE IF EXISTS pendientes_desalineadas;
+        DROP TABLE IF EXISTS historico_aba_macroactivos;
+        DROP TABLE IF EXISTS cat_banca;
+        DROP TABLE IF EXISTS catalogo_activos;
+        DROP TABLE IF EXISTS cat_perfil_riesgo;
+        DROP TABLE IF EXISTS carga_manifiesto;
+        DROP TABLE IF EXISTS cubo_aba_mensual;
+        DROP TABLE IF EXISTS cubo_cliente_mensual;
+        DROP TABLE IF EXISTS ultimo_periodo_cargado;
+        DROP TABLE IF EXISTS analitica_clientes_mensual;
+        DROP TYPE IF EXISTS tipo_macroactivo;
+        """)
+
+    cursor.execute(f"""
+    {crear} cat_perfil_riesgo (
       cod_perfil_riesgo VARCHAR(255),
       perfil_riesgo VARCHAR(255)
     );
 
-    CREATE TABLE catalogo_activos (
+    {crear} catalogo_activos (
       cod_activo VARCHAR(255),
-      activo VARCHAR(255)
+      activo VARCHAR(255),
+      macroactivo VARCHAR(255)
     );
 
-    CREATE TABLE cat_banca (
+    {crear} cat_banca (
       cod_banca VARCHAR(255),
       banca VARCHAR(255)
     );
 
-    CREATE TABLE historico_aba_macroactivos (
-      id_sistema_cliente VARCHAR(255),
-      ingestion_year VARCHAR(255),
-      ingestion_month NUMERIC(255),
-      ingestion_day VARCHAR(255),
+    {crear} carga_manifiesto (
+      periodo VARCHAR(16) PRIMARY KEY,
+      huella VARCHAR(64),
+      filas INTEGER,
+      cargado_en TIMESTAMP DEFAULT now()
+    );
+
+    {crear} cubo_aba_mensual (
+      year SMALLINT,
+      month SMALLINT,
+      cod_banca VARCHAR(255),
+      cod_perfil_riesgo VARCHAR(255),
       macroactivo VARCHAR(255),
       cod_activo VARCHAR(255),
-      aba NUMERIC(20,2),
-      cod_perfil_riesgo VARCHAR(255),
+      aba_suma NUMERIC,
+      filas BIGINT
+    );
+
+    {crear} cubo_cliente_mensual (
+      year SMALLINT,
+      month SMALLINT,
+      id_sistema_cliente VARCHAR(255),
       cod_banca VARCHAR(255),
-      year VARCHAR(255),
-      month NUMERIC(255)
+      macroactivo VARCHAR(255),
+      cod_activo VARCHAR(255),
+      aba_suma NUMERIC,
+      filas BIGINT
+    );
+
+    -- Una sola fila con el periodo más reciente del cubo; la actualiza refrescar_cubo
+    {crear} ultimo_periodo_cargado (
+      year SMALLINT,
+      month SMALLINT,
+      actualizado_en TIMESTAMP DEFAULT now()
+    );
+
+    -- Historial de ejecuciones: no se borra al reiniciar
+    CREATE TABLE IF NOT EXISTS metricas_ejecucion (
+      id_ejecucion VARCHAR(32),
+      inicio TIMESTAMP,
+      etapa VARCHAR(255),
+      tabla VARCHAR(255),
+      llamadas INTEGER,
+      segundos FLOAT8,
+      cpu_segundos FLOAT8,
+      memoria_pico_mb FLOAT8,
+      filas_entrada BIGINT,
+      filas_salida BIGINT,
+      filas_rechazadas BIGINT
+    );
+
+    -- Perfil de calidad de cada ejecución (perfil_calidad.py): tampoco se borra al reiniciar
+    CREATE TABLE IF NOT EXISTS perfil_calidad (
+      id_ejecucion VARCHAR(32),
+      inicio TIMESTAMP,
+      tabla VARCHAR(255),
+      columna VARCHAR(255),
+      indicador VARCHAR(64),
+      valor FLOAT8,
+      detalle TEXT
     );
 
-    CREATE TABLE pendientes_idCliente AS SELECT * FROM historico_aba_macroactivos WHERE 1=0;
-    CREATE TABLE pendientes_month AS SELECT * FROM historico_aba_macroactivos WHERE 1=0;
-    CREATE TABLE pendientes_codActivo AS SELECT * FROM historico_aba_macroactivos WHERE 1=0;
-    CREATE TABLE pendientes_aba AS SELECT * FROM historico_aba_macroactivos WHERE 1=0;
-    CREATE TABLE pendientes_perfil_riesgo AS SELECT * FROM historico_aba_macroactivos WHERE 1=0;
-    CREATE TABLE pendientes_codbanca AS SELECT * FROM historico_aba_macroactivos WHERE 1=0;
+    CREATE INDEX IF NOT EXISTS idx_cubo_aba_periodo ON cubo_aba_mensual (year, month);
+    CREATE INDEX IF NOT EXISTS idx_cubo_cliente_periodo ON cubo_cliente_mensual (year, month);
+    """)
+
+    # Las tablas pendientes conservan el esquema de texto: guardan justamente lo que no se pudo tipar
+    for tabla in TABLAS_PENDIENTES:
+        cursor.execute(f"{crear} {tabla} ({COLUMNAS_HISTORICO})")
+    cursor.execute(f"{crear} pendientes_desalineadas ({COLUMNAS_DESALINEADAS})")
+    _agregar_columnas(cursor)
+
+    if tipado:
+        asegurar_tipo_macroactivo(conn, cargar_clasificacion_activos(conn)[0])
+    cursor.execute(f"""
+        {crear} historico_aba_macroactivos ({COLUMNAS_HISTORICO_TIPADO if tipado else COLUMNAS_HISTORICO})
+        {'PARTITION BY RANGE (year, month)' if particionado else ''}
     """)
+    if particionado:
+        # Filas sin periodo válido (año/mes nulos o fuera de rango) van a la partición por defecto
+        cursor.execute(f"{crear} historico_aba_macroactivos_default PARTITION OF historico_aba_macroactivos DEFAULT")
     conn.commit()
     cursor.close()
-    print("✅ Tablas creadas correctamente")
+    esquema = ' (esquema particionado)' if particionado else (' (esquema tipado)' if tipado else '')
+    print(f"✅ Tablas creadas correctamente{esquema}")
+
+def detectar_esquema(conn):
+    # Devuelve (tipado, particionado) de la tabla historico ya existente
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT data_type = 'smallint' FROM information_schema.columns
+        WHERE table_name = 'historico_aba_macroactivos' AND column_name = 'year'
+    """)
+    fila = cursor.fetchone()
+    cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM pg_partitioned_table
+                       WHERE partrelid = to_regclass('historico_aba_macroactivos'))
+    """)
+    particionado = cursor.fetchone()[0]
+    cursor.close()
+    return bool(fila and fila[0]), particionado
+
+@functools.lru_cache(maxsize=None)
+def _leer_clasificacion(ruta):
+    with open(ruta, encoding='utf-8') as f:
+        config = json.load(f)
+    mapa = {codigo: macroactivo
+            for macroactivo, codigos in config['macroactivos'].items()
+            for codigo in codigos}
+    return mapa, config.get('correcciones', {})
+
+def cargar_clasificacion_activos(conn=None, ruta=RUTA_CLASIFICACION):
+    mapa, correcciones = _leer_clasificacion(ruta)
+    mapa = dict(mapa)
+    if conn is not None:
+        # Los códigos con macroactivo en catalogo_activos prevalecen sobre el archivo
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT TRIM(cod_activo), macroactivo FROM catalogo_activos
+            WHERE cod_activo IS NOT NULL AND macroactivo IS NOT NULL
+        """)
+        mapa.update(cursor.fetchall())
+        cursor.close()
+    return mapa, correcciones
 
-def limpiar_columnas(df):
-    df['cod_activo'] = df['cod_activo'].replace('10007', '1007')
-    df['cod_activo'] = df['cod_activo'].replace('1015', '1115')
+def _mapear_categorias(serie, funcion):
+    # La función se evalúa una sola vez por código distinto y el resultado se
+    # expande a todas las filas con los códigos de la categoría (-1 = nulo)
+    categorica = serie.astype('category')
+    valores = np.array([funcion(c) for c in categorica.cat.categories] + [None], dtype=object)
+    return pd.Series(valores[categorica.cat.codes.to_numpy()], index=serie.index)
+
+def limpiar_columnas(df, correcciones=None):
+    if correcciones is None:
+        correcciones = cargar_clasificacion_activos()[1]
+    df['cod_activo'] = _mapear_categorias(df['cod_activo'], lambda c: correcciones.get(c, c))
     return df
 
-def asignar_macroactivo(df):
-    renta_fija = ['1000', '1001']
-    renta_variable = ['1002', '1003', '1004', '1005', '1011', '1012', '1014','1115', '1016', '1017']
-    fics = ['1009', '1010', '1007', '1008', '1018', '1019', '1020']
-
-    def clasificar(codigo):
-        if pd.isna(codigo):
-            return None
-        codigo = str(codigo).strip()
-        if codigo in renta_fija:
-            return 'Renta Fija'
-        elif codigo in renta_variable:
-            return 'Renta Variable'
-        elif codigo in fics:
-            return 'FICs'
-        return None
-
-    df['macroactivo'] = df['cod_activo'].apply(clasificar)
+def asignar_macroactivo(df, mapa=None):
+    if mapa is None:
+        mapa = cargar_clasificacion_activos()[0]
+    df['macroactivo'] = _mapear_categorias(df['cod_activo'], lambda c: mapa.get(str(c).strip()))
     return df
 
-def exportar_a_pendientes_aba(conn, df):
-    pendientes = df[df['aba'].isna()]
-    if pendientes.empty:
-        print("✅ No hay filas con 'aba' nulo para exportar")
-        return
+def _lotes_csv(df, tamano_lote):
+    # Cada lote se serializa a un buffer en memoria que COPY consume como un archivo
+    for inicio in range(0, len(df), tamano_lote):
+        buffer = io.StringIO()
+        df.iloc[inicio:inicio + tamano_lote].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        yield buffer
 
+def cargar_dataframe(conn, df, table_name, metodo='copy', tamano_lote=100000, acumulado=None):
+    columns = list(df.columns)
     cursor = conn.cursor()
-    columns = list(pendientes.columns)
-    placeholders = ', '.join(['%s'] * len(columns))
-    insert_stmt = f"INSERT INTO pendientes_aba ({', '.join(columns)}) VALUES ({placeholders})"
-    for _, row in pendientes.iterrows():
-        cursor.execute(insert_stmt, tuple(row))
-    conn.commit()
+    with metricas.etapa('carga', table_name) as m:
+        inicio = time.perf_counter()
+        if metodo == 'copy':
+            copy_stmt = f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+            for buffer in _lotes_csv(df, tamano_lote):
+                cursor.copy_expert(copy_stmt, buffer)
+        else:
+            placeholders = ', '.join(['%s'] * len(columns))
+            insert_stmt = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+            for _, row in df.where(pd.notna(df), None).iterrows():
+                cursor.execute(insert_stmt, tuple(row))
+        segundos = time.perf_counter() - inicio
+        m['filas_entrada'] = m['filas_salida'] = len(df)
     cursor.close()
-    print(f"📤 {len(pendientes)} fila(s) con 'aba' nulo exportadas a 'pendientes_aba'")
+    if acumulado is not None:
+        # En modo streaming se acumula por tabla y se reporta una sola vez al final
+        filas, total_segundos = acumulado.get(table_name, (0, 0.0))
+        acumulado[table_name] = (filas + len(df), total_segundos + segundos)
+    else:
+        _reportar_carga({table_name: (len(df), segundos)}, metodo)
+    return len(df)
 
-def ingest_csv_data(conn, csv_file, table_name):
-    try:
-        df = pd.read_csv(csv_file, sep=";", dtype=str)
-        df.columns = [col.strip() for col in df.columns]
+def _reportar_carga(acumulado, metodo):
+    for table_name, (filas, segundos) in acumulado.items():
+        filas_por_segundo = filas / segundos if segundos > 0 else float('inf')
+        print(f"⏱️ {filas} fila(s) cargadas en '{table_name}' ({filas_por_segundo:,.0f} filas/s, {metodo})")
 
-        if table_name == 'historico_aba_macroactivos':
-            df = limpiar_columnas(df)
-            df = asignar_macroactivo(df)
+# Reglas de calidad, en orden: cada fila va a la tabla
+# de la primera regla que cumple y no se evalúa contra las siguientes
+REGLAS_CALIDAD = [
+    ('aba_invalido', 'pendientes_aba',
+     lambda df: df['motivo'].notna()),
+    ('aba_nulo', 'pendientes_aba',
+     lambda df: df['aba'].isna()),
+    ('id_cliente_invalido', 'pendientes_idCliente',
+     lambda df: df['id_sistema_cliente'].isna() | (df['id_sistema_cliente'].str.len() != 11)),
+    ('perfil_riesgo_nulo', 'pendientes_perfil_riesgo',
+     lambda df: df['cod_perfil_riesgo'].isna()),
+    ('month_nulo', 'pendientes_month',
+     lambda df: df['ingestion_month'].isna()),
+    ('cod_activo_nulo', 'pendientes_codActivo',
+     lambda df: df['cod_activo'].isna()),
+    ('cod_banca_nulo', 'pendientes_codbanca',
+     lambda df: df['cod_banca'].isna()),
+    ('cod_activo_1022', 'pendientes_codActivo',
+     lambda df: df['cod_activo'] == '1022'),
+]
 
-            df['aba'] = (
-                df['aba']
-                .str.replace(",", ".", regex=False)
-                .str.replace(r"[^\d.]", "", regex=True)
-                .replace('', pd.NA)
-                .astype(float)
-            )
+def reglas_tipado(mapa):
+    # Se agregan a REGLAS_CALIDAD en el esquema tipado: códigos más largos que su columna y macroactivos
+    # que no caben en tipo_macroactivo
+    permitidos = set(valores_macroactivo(mapa))
+    reglas = [(f"{columna}_largo", tabla, lambda df, columna=columna, largo=largo: df[columna].str.len() > largo)
+              for columna, (tabla, largo) in LARGOS_TIPADO.items()]
+    reglas.append(('macroactivo_fuera_del_tipo', 'pendientes_codActivo',
+                   lambda df: df['macroactivo'].notna() & ~df['macroactivo'].isin(permitidos)))
+    return reglas
 
-            exportar_a_pendientes_aba(conn, df)
-            df = df[df['aba'].notna()]
+# Columnas auxiliares de preparar_historico; solo las conservan las tablas pendientes que las tienen
+COLUMNAS_AUXILIARES = ['motivo', 'aba_original']
+COLUMNAS_EXTRA_PENDIENTES = {
+    'pendientes_aba': ['motivo', 'aba_original'],
+    'pendientes_idCliente': ['motivo'],
+    'pendientes_codActivo': ['motivo'],
+    'pendientes_perfil_riesgo': ['motivo'],
+    'pendientes_codbanca': ['motivo'],
+}
 
-        df = df.where(pd.notna(df), None)
+def aplicar_reglas_calidad(df, reglas=REGLAS_CALIDAD):
+    libres = pd.Series(True, index=df.index)
+    mascaras = {}
+    conteos = {}
+    for nombre, tabla, condicion in reglas:
+        with metricas.etapa(f"regla:{nombre}", tabla) as m:
+            m['filas_entrada'] = int(libres.sum())
+            coincide = condicion(df).fillna(False).astype(bool) & libres
+            conteos[nombre] = int(coincide.sum())
+            mascaras[tabla] = mascaras.get(tabla, False) | coincide
+            libres &= ~coincide
+            if 'motivo' in COLUMNAS_EXTRA_PENDIENTES.get(tabla, []):
+                # El motivo del parser prevalece; si no hay, queda el nombre de la regla
+                df.loc[coincide & df['motivo'].isna(), 'motivo'] = nombre
+            m['filas_rechazadas'] = conteos[nombre]
+            m['filas_salida'] = m['filas_entrada'] - conteos[nombre]
 
-        cursor = conn.cursor()
-        columns = list(df.columns)
-        placeholders = ', '.join(['%s'] * len(columns))
-        insert_stmt = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-        for _, row in df.iterrows():
-            cursor.execute(insert_stmt, tuple(row))
+    auxiliares = [col for col in COLUMNAS_AUXILIARES if col in df.columns]
+    rechazos = {
+        tabla: df[mascara].drop(columns=[c for c in auxiliares if c not in COLUMNAS_EXTRA_PENDIENTES.get(tabla, [])])
+        for tabla, mascara in mascaras.items() if mascara.any()
+    }
+    df = df[libres].drop(columns=auxiliares)
+
+    # El año del periodo es el de ingesta y un mes 'NaN' se toma de la columna month
+    df['year'] = df['ingestion_year']
+    mes_nan = df['ingestion_month'].str.strip().str.lower() == 'nan'
+    df.loc[mes_nan, 'ingestion_month'] = df.loc[mes_nan, 'month']
+    return df, rechazos, conteos
+
+# Dominio de cada columna que puede quedar corrida cuando a una fila le sobra o le falta un campo
+DOMINIOS_COLUMNAS = {
+    'macroactivo': re.compile(r'[^\d]*'),
+    'cod_activo': re.compile(r'\d{3,6}'),
+    'aba': re.compile(r'[\s$+-]*[\d.,\s]*\d[\d.,\s]*'),
+    'cod_perfil_riesgo': re.compile(r'\d{3,6}'),
+    'cod_banca': re.compile(r'[A-Za-z]{1,4}'),
+    'year': re.compile(r'(19|20)\d{2}'),
+    'month': re.compile(r'(0?[1-9]|1[0-2])(\.0+)?'),
+}
+COLUMNAS_DESPLAZABLES = list(DOMINIOS_COLUMNAS)
+# Forma que cumple cualquier fila bien alineada: el último campo presente y year/month numéricos. Los
+# dominios, más estrictos, solo se miran en las filas que fallan esto, para no apartar códigos inusuales
+TIPOS_COLUMNAS = {
+    'year': re.compile(r'\d+'),
+    'month': re.compile(r'\d+(\.0+)?'),
+}
+# Columnas que, si quedan vacías al realinear, se toman de su equivalente de ingestión
+COLUMNAS_DERIVABLES = {'year': 'ingestion_year', 'month': 'ingestion_month'}
+
+def _vacio(valor):
+    return valor is None or (isinstance(valor, float) and np.isnan(valor)) or str(valor).strip() == ''
+
+def _en_dominio(columna, valor):
+    return _vacio(valor) or DOMINIOS_COLUMNAS[columna].fullmatch(str(valor).strip()) is not None
+
+def _tipo_valido(columna, valor):
+    return not _vacio(valor) and TIPOS_COLUMNAS[columna].fullmatch(str(valor).strip()) is not None
+
+def _candidatos_realineacion(valores):
+    # Corrimientos de un campo: a la izquierda quitando un campo vacío sobrante, o a la
+    # derecha insertando el campo faltante cuando el último quedó vacío
+    for k in range(len(valores)):
+        if _vacio(valores[k]):
+            yield valores[:k] + valores[k + 1:] + [None]
+        if _vacio(valores[-1]):
+            yield valores[:k] + [None] + valores[k:-1]
+
+def _realinear(fila):
+    valores = [None if _vacio(fila[col]) else fila[col] for col in COLUMNAS_DESPLAZABLES]
+    validos = []
+    for candidato in _candidatos_realineacion(valores):
+        candidato = dict(zip(COLUMNAS_DESPLAZABLES, candidato))
+        for columna, origen in COLUMNAS_DERIVABLES.items():
+            if candidato[columna] is None and _en_dominio(columna, fila[origen]) and not _vacio(fila[origen]):
+                candidato[columna] = fila[origen]
+        if all(_en_dominio(col, valor) for col, valor in candidato.items()):
+            faltantes = [col for col, valor in candidato.items() if valor is None and col != 'macroactivo']
+            validos.append((faltantes, candidato))
+    if not validos:
+        return None, 'dominio_invalido'
+    validos.sort(key=lambda v: len(v[0]))
+    faltantes, candidato = validos[0]
+    if len(validos) > 1 and len(validos[1][0]) == len(faltantes) and validos[1][1] != candidato:
+        return None, 'desplazamiento_ambiguo'
+    if faltantes:
+        return candidato, f"desplazada_falta_{faltantes[0]}"
+    return candidato, None
+
+def reparar_desalineadas(df):
+    # Una fila está corrida si le falta el último campo o year/month no son números, y además algún valor
+    # queda fuera de su dominio (cada valor distinto se evalúa una vez). Se realinea si el corrimiento es
+    # único y completo; si no, se aparta con el motivo
+    rota = pd.Series(False, index=df.index)
+    for columna in TIPOS_COLUMNAS:
+        rota |= _mapear_categorias(df[columna], functools.partial(_tipo_valido, columna)).ne(True)
+    fuera = pd.Series(False, index=df.index)
+    for columna in COLUMNAS_DESPLAZABLES:
+        if columna != 'aba':
+            fuera |= _mapear_categorias(df[columna], functools.partial(_en_dominio, columna)).eq(False)
+    fuera &= rota
+
+    cuarentena = []
+    realineadas = 0
+    for indice in df.index[fuera]:
+        fila = df.loc[indice]
+        candidato, motivo = _realinear(fila)
+        if motivo is None:
+            df.loc[indice, COLUMNAS_DESPLAZABLES] = [candidato[col] for col in COLUMNAS_DESPLAZABLES]
+            realineadas += 1
+            continue
+        apartada = fila.copy()
+        if candidato is not None:
+            # Se guardan los valores realineados para que el periodo de la fila sea el correcto
+            apartada[COLUMNAS_DESPLAZABLES] = [candidato[col] for col in COLUMNAS_DESPLAZABLES]
+        apartada['motivo'] = motivo
+        apartada['fila_original'] = ';'.join('' if _vacio(v) else str(v) for v in fila)
+        cuarentena.append(apartada)
+
+    cuarentena = pd.DataFrame(cuarentena, columns=list(df.columns) + ['motivo', 'fila_original'])
+    return df.drop(index=cuarentena.index), cuarentena, realineadas
+
+# Montos ABA: coma decimal (formato del archivo), punto de miles, signo y símbolo de moneda opcionales
+LARGO_MAXIMO_ABA = 40
+# Hasta 15 dígitos significativos un float64 conserva el decimal exacto: to_csv escribe la representación
+# más corta, que es el texto original, y COPY lo guarda sin redondeo en NUMERIC(20,2). Los montos más
+# largos van a pendientes_aba como aba_fuera_de_rango
+DIGITOS_MAXIMOS_ABA = 15
+POTENCIAS_10 = 10 ** np.arange(DIGITOS_MAXIMOS_ABA + 1, dtype=np.int64)
+
+def _ultima_posicion(mascara):
+    return np.where(mascara.any(0), len(mascara) - 1 - mascara[::-1].argmax(0), -1)
+
+def _desde_la_derecha(mascara):
+    # Cuántas posiciones marcadas hay desde cada carácter hasta el final del monto
+    return np.cumsum(mascara[::-1], 0, dtype=np.int8)[::-1]
+
+def parsear_aba(serie, decimal=','):
+    # El bloque se analiza como una matriz de caracteres (una columna por monto) con operaciones de numpy, sin
+    # pasadas de texto intermedias. Con ambos separadores el último es el decimal; con uno solo, el de miles
+    # se toma como decimal si aparece una vez y no le siguen tres dígitos ('1.5'), y el decimal como miles
+    # si aparece varias veces ('1,234,567'). Los dígitos se acumulan en un entero exacto y se dividen por
+    # la potencia de 10 de los decimales, así el float64 es el más cercano al decimal escrito (y, con hasta
+    # DIGITOS_MAXIMOS_ABA dígitos, vuelve al mismo texto al serializarlo).
+    # Devuelve el monto (nulo si está vacío o es inválido) y el motivo de cada monto inválido
+    miles = '.' if decimal == ',' else ','
+    motivos = pd.Series(None, index=serie.index, dtype=object)
+    if serie.empty:
+        return pd.Series(np.nan, index=serie.index), motivos
+    texto = serie.to_numpy(dtype=object, copy=True)
+    texto[pd.isna(texto)] = ''
+    largos = np.fromiter(map(len, texto), dtype=np.int64, count=len(texto)) > LARGO_MAXIMO_ABA
+    texto[largos] = ''
+    matriz = texto.astype('U')
+    # Traspuesta: cada posición de carácter es una fila contigua y las operaciones recorren todos los montos
+    c = np.ascontiguousarray(matriz.view(np.uint32).reshape(len(matriz), -1).T)
+    posiciones = np.arange(len(c))[:, None]
+
+    digito = (c >= 48) & (c <= 57)
+    es_decimal = c == ord(decimal)
+    es_miles = c == ord(miles)
+    espacio = (c == 32) | (c == 9) | (c == 0xA0) | (c == 0)
+    menos = c == 45
+    signo = menos | (c == 43)
+    moneda = c == 36
+
+    hay_digito = digito.any(0)
+    antes = posiciones < digito.argmax(0)
+    despues = posiciones > _ultima_posicion(digito)
+    separador = es_decimal | es_miles
+    validos = (hay_digito
+               & (antes | despues | digito | separador).all(0)
+               & (~antes | espacio | signo | moneda).all(0)
+               & (~despues | espacio | menos).all(0)
+               & (signo.sum(0) <= 1) & (moneda.sum(0) <= 1))
+
+    derecha = _desde_la_derecha(digito)
+    ultimo_separador = _ultima_posicion(separador)
+    montos = np.arange(c.shape[1])
+    posicion = np.maximum(ultimo_separador, 0)
+    ultimo_es_decimal = es_decimal[posicion, montos]
+    tras_ultimo = derecha[posicion, montos]
+    n_decimal, n_miles = es_decimal.sum(0), es_miles.sum(0)
+    ambos = (n_decimal > 0) & (n_miles > 0)
+    ultimo_unico = np.where(ultimo_es_decimal, n_decimal, n_miles) == 1
+    con_decimal = np.where(ambos, ultimo_unico,
+                           np.where(n_decimal > 0, n_decimal == 1, (n_miles == 1) & (tras_ultimo != 3)))
+    validos &= ~ambos | ultimo_unico
+    fraccion = np.where(con_decimal, tras_ultimo, 0)
+
+    # Separadores de miles: el k-ésimo desde la derecha debe tener 3k dígitos enteros a su derecha
+    de_miles = separador & ~(con_decimal & (posiciones == ultimo_separador))
+    validos &= (~de_miles | (derecha == 3 * _desde_la_derecha(de_miles) + fraccion)).all(0)
+    total_digitos = derecha[0]
+    grupos = de_miles.sum(0)
+    cabeza = total_digitos - fraccion - 3 * grupos
+    validos &= (grupos == 0) | ((cabeza >= 1) & (cabeza <= 3))
+
+    # Horner por posición: el entero de todos los dígitos, exacto hasta DIGITOS_MAXIMOS_ABA
+    entero = np.zeros(c.shape[1], dtype=np.int64)
+    for fila, es_digito in zip(c, digito):
+        entero = np.where(es_digito, entero * 10 + (fila.astype(np.int64) - 48), entero)
+    monto = entero / POTENCIAS_10[np.clip(fraccion, 0, DIGITOS_MAXIMOS_ABA)]
+    monto = np.where(menos.any(0), -monto, monto)
+
+    rango = validos & (total_digitos <= DIGITOS_MAXIMOS_ABA)
+    vacio = espacio.all(0) & ~largos
+    motivos[~vacio & (~validos | largos)] = 'aba_invalido'
+    motivos[validos & ~rango & ~largos] = 'aba_fuera_de_rango'
+    return pd.Series(np.where(rango & ~largos, monto, np.nan), index=serie.index), motivos
+
+def preparar_historico(df, clasificacion=None):
+    mapa, correcciones = clasificacion or cargar_clasificacion_activos()
+    tabla = 'historico_aba_macroactivos'
+    with metricas.etapa('limpiar_columnas', tabla) as m:
+        df = limpiar_columnas(df, correcciones)
+        m['filas_entrada'] = m['filas_salida'] = len(df)
+    with metricas.etapa('asignar_macroactivo', tabla) as m:
+        df = asignar_macroactivo(df, mapa)
+        m['filas_entrada'] = m['filas_salida'] = len(df)
+
+    with metricas.etapa('normalizar_aba', tabla) as m:
+        original = df['aba']
+        df['aba'], motivos = parsear_aba(original)
+        # Los montos que no se pudieron leer se conservan para pendientes_aba (regla aba_invalido)
+        df['motivo'] = motivos
+        df['aba_original'] = original.where(motivos.notna())
+        m['filas_entrada'] = m['filas_salida'] = len(df)
+    return df
+
+COLUMNAS_CATEGORICAS = ['id_sistema_cliente', 'macroactivo', 'cod_activo', 'cod_perfil_riesgo', 'cod_banca']
+COLUMNAS_ENTERAS = ['ingestion_year', 'ingestion_month', 'ingestion_day', 'year', 'month']
+
+def tipar_historico(df):
+    for col in COLUMNAS_ENTERAS:
+        numeros = pd.to_numeric(df[col], errors='coerce')
+        # Solo enteros que quepan en SMALLINT; el resto queda nulo
+        df[col] = numeros.where((numeros % 1 == 0) & (numeros.abs() < 2 ** 15)).astype('Int16')
+    for col in COLUMNAS_CATEGORICAS:
+        df[col] = df[col].astype('category')
+    return df
+
+def reportar_tamano_tablas(conn, tablas):
+    cursor = conn.cursor()
+    for tabla in tablas:
+        # pg_partition_tree incluye las particiones cuando la tabla está particionada
+        cursor.execute("""
+            SELECT pg_size_pretty(COALESCE(
+                (SELECT SUM(pg_total_relation_size(relid)) FROM pg_partition_tree(%s)),
+                pg_total_relation_size(%s)
+            )::BIGINT)
+        """, (tabla.lower(), tabla.lower()))
+        print(f"💾 Tamaño de '{tabla}': {cursor.fetchone()[0]}")
+    cursor.close()
+
+def asegurar_particiones(conn, periodos):
+    cursor = conn.cursor()
+    for year, month in periodos:
+        siguiente = (year + 1, 1) if month == 12 else (year, month + 1)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS historico_aba_macroactivos_{year}_{month:02d}
+            PARTITION OF historico_aba_macroactivos
+            FOR VALUES FROM ({year}, {month}) TO ({siguiente[0]}, {siguiente[1]})
+        """)
+    cursor.close()
+
+def _periodos_validos(df):
+    periodos = df[['year', 'month']].dropna().drop_duplicates()
+    periodos = periodos[periodos['month'].between(1, 12)]
+    return [(int(y), int(m)) for y, m in periodos.itertuples(index=False)]
+
+def etiquetas_periodo(df):
+    # Periodo de carga de cada fila cruda según ingestion_year/month: 'YYYY-MM' o 'sin_periodo'
+    year = pd.to_numeric(df['ingestion_year'], errors='coerce')
+    month = pd.to_numeric(df['month'], errors='coerce')
+    valido = (year % 1 == 0) & (month % 1 == 0)
+    etiquetas = (year.where(valido).astype('Int64').astype(str) + '-'
+                 + month.where(valido).astype('Int64').astype(str).str.zfill(2))
+    return etiquetas.where(valido, 'sin_periodo')
+
+def acumular_huellas(df, huellas):
+    # Huella por periodo independiente del orden de las filas: suma (mod 2**64) de sus hashes
+    hashes = pd.Series(pd.util.hash_pandas_object(df, index=False).to_numpy(), index=df.index)
+    por_periodo = hashes.groupby(etiquetas_periodo(df)).agg(['sum', 'count'])
+    for periodo, suma, filas in zip(por_periodo.index, por_periodo['sum'], por_periodo['count']):
+        suma_previa, filas_previas = huellas.get(periodo, (0, 0))
+        huellas[periodo] = ((suma_previa + int(suma)) % 2 ** 64, filas_previas + int(filas))
+    return huellas
+
+def leer_bloques(csv_file, table_name, chunk_size=None):
+    # read_csv por bloques, midiendo el tiempo de lectura de cada uno
+    lector = pd.read_csv(csv_file, sep=";", dtype=str, chunksize=chunk_size)
+    bloques = iter([lector] if chunk_size is None else lector)
+    while True:
+        inicio, inicio_cpu = time.perf_counter(), time.thread_time()
+        df = next(bloques, None)
+        if df is None:
+            return
+        metricas.registrar('read_csv', table_name, llamadas=1, segundos=time.perf_counter() - inicio,
+                           cpu_segundos=time.thread_time() - inicio_cpu, memoria_pico_mb=metricas.memoria_pico_mb(),
+                           filas_salida=len(df))
+        yield df
+
+def preparar_bloque(df, table_name, clasificacion=None, tipado=False, periodos=None, huellas=None,
+                    conteos_reglas=None, memoria=None):
+    # Limpieza de un bloque leído del CSV; no toca la base, así que puede correr en otro proceso
+    df.columns = [col.strip() for col in df.columns]
+    rechazos = {}
+    if table_name != 'historico_aba_macroactivos':
+        perfil_calidad.perfilar(table_name, df)
+    else:
+        with metricas.etapa('regla:fila_desalineada', 'pendientes_desalineadas') as m:
+            df, desalineadas, realineadas = reparar_desalineadas(df)
+            # El periodo se filtra ya realineado, y la etapa cuenta solo las filas que se cargan: es la
+            # primera regla y de ella sale el total de filas originales de la gráfica de eficiencia
+            if periodos is not None:
+                df = df[etiquetas_periodo(df).isin(periodos)]
+                desalineadas = desalineadas[etiquetas_periodo(desalineadas).isin(periodos)]
+            m['filas_entrada'] = len(df) + len(desalineadas)
+            m['filas_rechazadas'] = len(desalineadas)
+            m['filas_salida'] = len(df)
+        if huellas is not None:
+            acumular_huellas(df, huellas)
+            acumular_huellas(desalineadas, huellas)
+        clasificacion = clasificacion or cargar_clasificacion_activos()
+        df = preparar_historico(df, clasificacion)
+        # Nulos, códigos y montos del bloque con el ABA ya convertido, antes de repartirlo entre las reglas
+        perfil_calidad.perfilar(table_name, df)
+        reglas = REGLAS_CALIDAD + reglas_tipado(clasificacion[0]) if tipado else REGLAS_CALIDAD
+        df, rechazos, conteos = aplicar_reglas_calidad(df, reglas)
+        if len(desalineadas):
+            rechazos['pendientes_desalineadas'] = desalineadas
+        conteos['fila_desalineada'] = len(desalineadas)
+        conteos['realineada'] = realineadas
+        perfil_calidad.contar_reglas(table_name, conteos)
+        if conteos_reglas is not None:
+            for nombre, filas in conteos.items():
+                conteos_reglas[nombre] = conteos_reglas.get(nombre, 0) + filas
+        if tipado:
+            if memoria is not None:
+                memoria[0] += df.memory_usage(deep=True).sum()
+            with metricas.etapa('tipar', table_name) as m:
+                df = tipar_historico(df)
+                m['filas_entrada'] = m['filas_salida'] = len(df)
+            if memoria is not None:
+                memoria[1] += df.memory_usage(deep=True).sum()
+    return df, rechazos
+
+def _cargar_bloque(conn, df, rechazos, table_name, metodo, particionado, acumulado):
+    for tabla, pendientes in rechazos.items():
+        cargar_dataframe(conn, pendientes, tabla, metodo, acumulado=acumulado)
+    if particionado and table_name == 'historico_aba_macroactivos':
+        asegurar_particiones(conn, _periodos_validos(df))
+    cargar_dataframe(conn, df, table_name, metodo, acumulado=acumulado)
+
+def _reportar_ingesta(table_name, metodo, acumulado, conteos_reglas, memoria):
+    for nombre, filas in conteos_reglas.items():
+        if nombre == 'realineada':
+            print(f"🧩 {filas} fila(s) con columnas corridas realineadas")
+        else:
+            print(f"🔎 Regla '{nombre}': {filas} fila(s) enviadas a pendientes")
+    if memoria[0]:
+        print(f"🧮 Memoria del DataFrame: {memoria[0] / 2**20:,.1f} MB en texto → {memoria[1] / 2**20:,.1f} MB tipado")
+    _reportar_carga(acumulado, metodo)
+    print(f"📥 Datos insertados en '{table_name}'")
+
+def ingest_csv_data(conn, csv_file, table_name, metodo='copy', chunk_size=None, tipado=False, particionado=False,
+                    periodos=None, huellas=None):
+    try:
+        # Con chunk_size el archivo se procesa por bloques y la memoria no crece con su tamaño
+        bloques = leer_bloques(csv_file, table_name, chunk_size)
+        acumulado = {}
+        conteos_reglas = {}
+        memoria = [0, 0]
+        clasificacion = cargar_clasificacion_activos(conn) if table_name == 'historico_aba_macroactivos' else None
+        if clasificacion is not None and (tipado or particionado):
+            asegurar_tipo_macroactivo(conn, clasificacion[0])
+
+        for df in bloques:
+            df, rechazos = preparar_bloque(df, table_name, clasificacion, tipado or particionado, periodos, huellas,
+                                           conteos_reglas, memoria)
+            _cargar_bloque(conn, df, rechazos, table_name, metodo, particionado, acumulado)
 
         conn.commit()
-        print(f"📥 Datos insertados en '{table_name}'")
-        cursor.close()
+        _reportar_ingesta(table_name, metodo, acumulado, conteos_reglas, memoria)
         return True
     except Exception as e:
         conn.rollback()
         print(f"❌ Error al insertar en {table_name}: {e}")
         return False
 
-def mover_nulls(conn):
-    cursor = conn.cursor()
+INDICES_HISTORICO = {
+    'idx_historico_cliente': 'id_sistema_cliente',
+    'idx_historico_cod_activo': 'cod_activo',
+    'idx_historico_cod_banca': 'cod_banca',
+    'idx_historico_cod_perfil_riesgo': 'cod_perfil_riesgo',
+    'idx_historico_periodo': 'year, month',
+}
 
-    cursor.execute("""
-        INSERT INTO pendientes_idCliente
-        SELECT * FROM historico_aba_macroactivos
-        WHERE id_sistema_cliente IS NULL OR LENGTH(id_sistema_cliente) != 11
-    """)
-    cursor.execute("""
-        DELETE FROM historico_aba_macroactivos
-        WHERE id_sistema_cliente IS NULL OR LENGTH(id_sistema_cliente) != 11
-    """)
-    
-    cursor.execute("""
-        INSERT INTO pendientes_perfil_riesgo
-        SELECT * FROM historico_aba_macroactivos
-        WHERE cod_perfil_riesgo IS NULL
-    """)
-    cursor.execute("""
-        DELETE FROM historico_aba_macroactivos
-        WHERE cod_perfil_riesgo IS NULL
-    """)
+LLAVES_CATALOGOS = {
+    'cat_perfil_riesgo': 'cod_perfil_riesgo',
+    'catalogo_activos': 'cod_activo',
+    'cat_banca': 'cod_banca',
+}
 
-    cursor.execute("""
-        INSERT INTO pendientes_month
-        SELECT * FROM historico_aba_macroactivos
-        WHERE ingestion_month IS NULL
-    """)
-    cursor.execute("""
-        DELETE FROM historico_aba_macroactivos
-        WHERE ingestion_month IS NULL
-    """)
+def crear_indices(conn):
+    cursor = conn.cursor()
+    for indice, columnas in INDICES_HISTORICO.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {indice} ON historico_aba_macroactivos ({columnas})")
+    conn.commit()
+    print("📇 Índices de 'historico_aba_macroactivos' creados")
 
-    cursor.execute("""
-        INSERT INTO pendientes_codActivo
-        SELECT * FROM historico_aba_macroactivos
-        WHERE cod_activo IS NULL
-    """)
-    cursor.execute("""
-        DELETE FROM historico_aba_macroactivos
-        WHERE cod_activo IS NULL
-    """)
-    
-    cursor.execute("""
-        INSERT INTO pendientes_codbanca
-        SELECT * FROM historico_aba_macroactivos
-        WHERE cod_banca IS NULL
-    """)
-    cursor.execute("""
-        DELETE FROM historico_aba_macroactivos
-        WHERE cod_banca IS NULL
-    """)
+    for tabla, llave in LLAVES_CATALOGOS.items():
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')",
+                       (tabla,))
+        if cursor.fetchone()[0]:
+            continue
+        try:
+            cursor.execute(f"ALTER TABLE {tabla} ADD PRIMARY KEY ({llave})")
+            conn.commit()
+            print(f"🔑 Llave primaria creada en '{tabla}' ({llave})")
+        except (psycopg2.errors.UniqueViolation, psycopg2.errors.NotNullViolation) as e:
+            # El catálogo trae códigos repetidos o nulos
+            conn.rollback()
+            print(f"⚠️ No se pudo crear la llave primaria de '{tabla}': {e}".strip())
+    cursor.close()
 
-    cursor.execute("""
-        INSERT INTO pendientes_codActivo
-        SELECT * FROM historico_aba_macroactivos
-        WHERE cod_activo = '1022'
-    """)
-    cursor.execute("""
-        DELETE FROM historico_aba_macroactivos
-        WHERE cod_activo = '1022'
-    """)
+def _entero_pequeno(columna):
+    # Conversión tolerante a SMALLINT desde el esquema de texto/NUMERIC original
+    return f"CASE WHEN TRIM({columna}::TEXT) ~ '^-?[0-9]{{1,4}}$' THEN TRIM({columna}::TEXT)::SMALLINT END"
 
-    cursor.execute("""
-        UPDATE historico_aba_macroactivos
-        SET year = ingestion_year
-    """)
+def migrar_a_particionado(conn, conservar_anterior=False):
+    consultas = consultas_visualizacion(conn)
+    print("🧭 Planes antes de migrar:")
+    comparar_planes(conn, consultas)
 
-    cursor.execute("""
-        UPDATE historico_aba_macroactivos
-        SET ingestion_month = month
-        WHERE ingestion_month = 'NaN'
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE historico_aba_macroactivos RENAME TO historico_aba_macroactivos_anterior")
+    _agregar_columnas(cursor)
+    asegurar_tipo_macroactivo(conn, cargar_clasificacion_activos(conn)[0])
+    cursor.execute(f"""
+        CREATE TABLE historico_aba_macroactivos ({COLUMNAS_HISTORICO_TIPADO})
+        PARTITION BY RANGE (year, month)
     """)
+    cursor.execute("CREATE TABLE historico_aba_macroactivos_default PARTITION OF historico_aba_macroactivos DEFAULT")
 
-    conn.commit()
-    cursor.close()
-    print("🔄 Limpieza y organización de datos completada")
-
-def corregir_fila_desalineada(conn):
-    cursor = conn.cursor()
-    cursor.execute("""
-        DELETE FROM historico_aba_macroactivos
-        WHERE LOWER(TRIM(cod_activo)) = 'renta variable'
+    cursor.execute(f"""
+        SELECT DISTINCT {_entero_pequeno('year')}, {_entero_pequeno('month')}
+        FROM historico_aba_macroactivos_anterior
     """)
-    conn.commit()
-    print("✅ Fila 'Renta Variable' eliminada")
+    periodos = [(y, m) for y, m in cursor.fetchall() if y is not None and m is not None and 1 <= m <= 12]
+    asegurar_particiones(conn, periodos)
 
-    cursor.execute("""
+    # Códigos más largos que su columna tipada: a su tabla pendiente, como en reglas_tipado, y no a la nueva
+    columnas = ('id_sistema_cliente, ingestion_year, ingestion_month, ingestion_day, macroactivo, cod_activo, aba, '
+                'cod_perfil_riesgo, cod_banca, year, month')
+    largos, apartadas = 'FALSE', 0
+    for columna, (tabla, largo) in LARGOS_TIPADO.items():
+        condicion = f"COALESCE(LENGTH({columna}) > {largo}, FALSE)"
+        cursor.execute(f"""
+            INSERT INTO {tabla} ({columnas}, motivo)
+            SELECT {columnas}, '{columna}_largo' FROM historico_aba_macroactivos_anterior
+            WHERE {condicion} AND NOT ({largos})
+        """)
+        apartadas += cursor.rowcount
+        largos += f" OR {condicion}"
+    if apartadas:
+        print(f"🔎 {apartadas} fila(s) con códigos más largos que su columna enviadas a pendientes")
+
+    cursor.execute(f"""
         INSERT INTO historico_aba_macroactivos (
+            id_sistema_cliente, ingestion_year, ingestion_month, ingestion_day, macroactivo,
+            cod_activo, aba, cod_perfil_riesgo, cod_banca, year, month
+        )
+        SELECT
             id_sistema_cliente,
-            ingestion_year,
-            ingestion_month,
-            ingestion_day,
-            macroactivo,
+            {_entero_pequeno('ingestion_year')},
+            {_entero_pequeno('ingestion_month')},
+            {_entero_pequeno('ingestion_day')},
+            CASE WHEN macroactivo::TEXT = ANY(enum_range(NULL::tipo_macroactivo)::TEXT[])
+                 THEN macroactivo::TEXT::tipo_macroactivo END,
             cod_activo,
             aba,
             cod_perfil_riesgo,
             cod_banca,
-            year,
-            month
-        ) VALUES (
-            '10032184607',
-            '2024',
-            '5',
-            '10',
-            'Renta Variable',
-            '1002',
-            12615000.00,
-            '1468',
-            'PN',
-            '2024',
-            '5'
-        )
+            {_entero_pequeno('year')},
+            {_entero_pequeno('month')}
+        FROM historico_aba_macroactivos_anterior
+        WHERE NOT ({largos})
     """)
+    filas = cursor.rowcount
+    if not conservar_anterior:
+        cursor.execute("DROP TABLE historico_aba_macroactivos_anterior")
     conn.commit()
-    print("✅ Fila corregida y actualizada correctamente")
     cursor.close()
+    print(f"🚚 {filas} fila(s) migradas a {len(periodos)} partición(es) mensuales")
 
-def corregir_fila_desalineada_perfilRiesgo(conn):
+    crear_indices(conn)
+    cursor = conn.cursor()
+    cursor.execute("ANALYZE historico_aba_macroactivos")
+    conn.commit()
+    cursor.close()
+    print("🧭 Planes después de migrar:")
+    comparar_planes(conn, consultas)
+
+def consultas_visualizacion(conn):
+    # Consultas representativas de Gráficas Bancolombia.py sobre el último periodo y un cliente
     cursor = conn.cursor()
-    print("🔍 Verificando filas antes de eliminar...")
     cursor.execute("""
-        SELECT cod_perfil_riesgo, cod_banca, LENGTH(cod_perfil_riesgo) 
-        FROM historico_aba_macroactivos
-        WHERE LOWER(TRIM(cod_perfil_riesgo)) = 'pn'
+        SELECT year::TEXT, month::TEXT, id_sistema_cliente FROM historico_aba_macroactivos
+        WHERE year IS NOT NULL AND month IS NOT NULL
+        ORDER BY year DESC, month DESC
+        LIMIT 1
     """)
-    rows = cursor.fetchall()
-    if rows:
-        print("✅ Fila(s) encontrada(s) con 'PN':")
-        for row in rows:
-            print(f"  cod_perfil_riesgo: '{row[0]}' | cod_banca: {row[1]} | longitud: {row[2]}")
+    fila = cursor.fetchone()
+    cursor.close()
+    if fila is None:
+        return {}
+    year, month, cliente = fila
+    return {
+        'portafolio_ultimo_periodo': ("""
+            SELECT c.banca, h.macroactivo, SUM(h.aba)
+            FROM historico_aba_macroactivos h
+            LEFT JOIN cat_banca c ON h.cod_banca = c.cod_banca
+            WHERE h.year = %s AND h.month = %s
+            GROUP BY c.banca, h.macroactivo
+        """, (year, month)),
+        'portafolio_cliente': ("""
+            SELECT h.*, a.activo
+            FROM historico_aba_macroactivos h
+            LEFT JOIN catalogo_activos a ON h.cod_activo = a.cod_activo
+            WHERE h.id_sistema_cliente = %s
+        """, (cliente,)),
+        'evolucion_aba': ("""
+            SELECT year, month, AVG(aba)
+            FROM historico_aba_macroactivos
+            GROUP BY year, month
+        """, ()),
+    }
+
+def _nodos_plan(plan):
+    yield plan['Node Type']
+    for hijo in plan.get('Plans', []):
+        yield from _nodos_plan(hijo)
+
+def comparar_planes(conn, consultas):
+    cursor = conn.cursor()
+    resultados = {}
+    for nombre, (consulta, parametros) in consultas.items():
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + consulta, parametros)
+        plan = cursor.fetchone()[0][0]
+        nodos = sorted({n for n in _nodos_plan(plan['Plan']) if 'Scan' in n})
+        resultados[nombre] = plan['Execution Time']
+        print(f"   {nombre}: {plan['Execution Time']:.2f} ms ({', '.join(nodos)})")
+    conn.rollback()
+    cursor.close()
+    return resultados
+
+def _valor_entero(columna):
+    # Misma normalización que etiquetas_periodo para columnas de texto o NUMERIC
+    return f"CASE WHEN TRIM({columna}::TEXT) ~ '^-?[0-9]+(\\.0+)?$' THEN TRIM({columna}::TEXT)::NUMERIC END"
+
+def borrar_periodo(conn, periodo, tipado):
+    cursor = conn.cursor()
+    tablas = [('historico_aba_macroactivos', 'year')] + [(tabla, 'ingestion_year') for tabla in TABLAS_PENDIENTES]
+    tablas.append(('pendientes_desalineadas', 'ingestion_year'))
+    for tabla, columna_year in tablas:
+        if tabla == 'historico_aba_macroactivos' and tipado:
+            # En el esquema tipado la comparación directa aprovecha índices y particiones
+            year, month = 'year', 'month'
+        else:
+            year, month = _valor_entero(columna_year), _valor_entero('month')
+        if periodo == 'sin_periodo':
+            cursor.execute(f"DELETE FROM {tabla} WHERE {year} IS NULL OR {month} IS NULL")
+        else:
+            valor_year, valor_month = (int(parte) for parte in periodo.rsplit('-', 1))
+            cursor.execute(f"DELETE FROM {tabla} WHERE {year} = %s AND {month} = %s", (valor_year, valor_month))
+    cursor.close()
+
+def guardar_manifiesto(conn, huellas):
+    cursor = conn.cursor()
+    for periodo, (suma, filas) in huellas.items():
+        cursor.execute("""
+            INSERT INTO carga_manifiesto (periodo, huella, filas, cargado_en)
+            VALUES (%s, %s, %s, now())
+            ON CONFLICT (periodo) DO UPDATE
+            SET huella = EXCLUDED.huella, filas = EXCLUDED.filas, cargado_en = EXCLUDED.cargado_en
+        """, (periodo, f"{suma:016x}", filas))
+    conn.commit()
+    cursor.close()
+
+def cargar_incremental(conn, csv_file, chunk_size=CHUNK_SIZE):
+    tipado, particionado = detectar_esquema(conn)
+
+    huellas = {}
+    for df in leer_bloques(csv_file, 'historico_aba_macroactivos', chunk_size):
+        df.columns = [col.strip() for col in df.columns]
+        # Misma huella que en la carga: sobre las filas ya realineadas o apartadas
+        df, desalineadas, _ = reparar_desalineadas(df)
+        with metricas.etapa('huellas', 'historico_aba_macroactivos') as m:
+            acumular_huellas(df, huellas)
+            acumular_huellas(desalineadas, huellas)
+            m['filas_entrada'] = len(df) + len(desalineadas)
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT periodo, huella FROM carga_manifiesto")
+    cargadas = dict(cursor.fetchall())
+    cursor.close()
+    nuevos = {p: h for p, h in huellas.items() if cargadas.get(p) != f"{h[0]:016x}"}
+    if not nuevos:
+        print("✅ Sin periodos nuevos o modificados: no hay nada que cargar")
+        return []
+
+    print(f"🆕 Periodos a cargar: {', '.join(sorted(nuevos))}")
+    # El borrado y la carga quedan en la misma transacción: si la carga falla no se pierde nada
+    for periodo in nuevos:
+        borrar_periodo(conn, periodo, tipado)
+    if ingest_csv_data(conn, csv_file, 'historico_aba_macroactivos', chunk_size=chunk_size,
+                       tipado=tipado, particionado=particionado, periodos=set(nuevos)):
+        guardar_manifiesto(conn, nuevos)
+        return sorted(nuevos)
+    return []
+
+def _filtro_periodos(periodos, year, month):
+    condiciones, params = [], []
+    for periodo in periodos:
+        if periodo == 'sin_periodo':
+            condiciones.append(f"({year} IS NULL OR {month} IS NULL)")
+        else:
+            condiciones.append(f"({year} = %s AND {month} = %s)")
+            params.extend(int(parte) for parte in periodo.rsplit('-', 1))
+    return ' OR '.join(condiciones) or 'FALSE', params
+
+def refrescar_cubo(conn, periodos=None):
+    # Sin periodos se reconstruye todo; con periodos ('YYYY-MM' o 'sin_periodo') solo esos
+    tipado, _ = detectar_esquema(conn)
+    year, month = ('year', 'month') if tipado else (_entero_pequeno('year'), _entero_pequeno('month'))
+    if periodos is None:
+        filtro_cubo, filtro_historico, params = 'TRUE', 'TRUE', []
     else:
-        print("⚠️ No se encontraron filas con 'PN' en 'cod_perfil_riesgo'")
+        filtro_cubo, params = _filtro_periodos(periodos, 'year', 'month')
+        filtro_historico, _ = _filtro_periodos(periodos, year, month)
 
-    print("🗑️ Eliminando filas con 'cod_perfil_riesgo' = 'PN'...")
+    inicio = time.perf_counter()
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM cubo_aba_mensual WHERE {filtro_cubo}", params)
+    cursor.execute(f"""
+        INSERT INTO cubo_aba_mensual
+        SELECT {year}, {month}, cod_banca, cod_perfil_riesgo, macroactivo::TEXT, cod_activo,
+               SUM(aba), COUNT(*)
+        FROM historico_aba_macroactivos
+        WHERE {filtro_historico}
+        GROUP BY 1, 2, 3, 4, 5, 6
+    """, params)
+    cursor.execute(f"DELETE FROM cubo_cliente_mensual WHERE {filtro_cubo}", params)
+    cursor.execute(f"""
+        INSERT INTO cubo_cliente_mensual
+        SELECT {year}, {month}, id_sistema_cliente, cod_banca, macroactivo::TEXT, cod_activo,
+               SUM(aba), COUNT(*)
+        FROM historico_aba_macroactivos
+        WHERE {filtro_historico}
+        GROUP BY 1, 2, 3, 4, 5, 6
+    """, params)
+    # Con el índice por periodo del cubo es una lectura de una fila; las consultas la leen de aquí sin recorrer nada
+    cursor.execute("DELETE FROM ultimo_periodo_cargado")
     cursor.execute("""
-        DELETE FROM historico_aba_macroactivos
-        WHERE LOWER(TRIM(cod_perfil_riesgo)) = 'pn'
+        INSERT INTO ultimo_periodo_cargado (year, month)
+        SELECT year, month FROM cubo_aba_mensual
+        WHERE year IS NOT NULL AND month IS NOT NULL
+        ORDER BY year DESC, month DESC
+        LIMIT 1
     """)
     conn.commit()
-    print("✅ Fila(s) 'PN' eliminada(s)")
+    cursor.close()
+    alcance = 'completo' if periodos is None else f"{len(periodos)} periodo(s)"
+    print(f"🧊 Cubo de agregados actualizado ({alcance}, {time.perf_counter() - inicio:.2f} s)")
 
-    print("🧩 Insertando fila corregida...")
-    cursor.execute("""
-        INSERT INTO historico_aba_macroactivos (
-            id_sistema_cliente,
-            ingestion_year,
-            ingestion_month,
-            ingestion_day,
-            macroactivo,
-            cod_activo,
-            aba,
-            cod_perfil_riesgo,
-            cod_banca,
-            year,
-            month
-        ) VALUES (
-            '10071747544',
-            '2024',
-            '3',
-            '14',
-            'FICs',
-            '1007',
-            369990.35,
-            '1469',
-            'PN',
-            '2024',
-            '3'
-        )
-    """)
+def _tabla_vacia(conn, tabla):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {tabla})")
+    vacia = cursor.fetchone()[0]
+    cursor.close()
+    return vacia
+
+COLUMNAS_PARQUET_TEXTO = ['id_sistema_cliente', 'macroactivo', 'cod_activo', 'cod_perfil_riesgo', 'cod_banca',
+                          'banca', 'perfil_riesgo', 'activo']
+
+def _esquema_parquet():
+    # Textos repetidos como diccionario y enteros pequeños, igual que el DataFrame tipado
+    return pa.schema(
+        [(col, pa.int16()) for col in ['ingestion_year', 'ingestion_month', 'ingestion_day', 'year', 'month']]
+        + [(col, pa.dictionary(pa.int32(), pa.string())) for col in COLUMNAS_PARQUET_TEXTO]
+        + [('aba', pa.float64())]
+    )
+
+def _directorio_periodo(directorio, periodo):
+    if periodo == 'sin_periodo':
+        return [os.path.join(directorio, 'year=__HIVE_DEFAULT_PARTITION__')] + [
+            os.path.join(directorio, d, 'month=__HIVE_DEFAULT_PARTITION__') for d in os.listdir(directorio)]
+    year, month = (int(parte) for parte in periodo.rsplit('-', 1))
+    return [os.path.join(directorio, f"year={year}", f"month={month}")]
+
+def exportar_parquet(conn, directorio, periodos=None, tamano_lote=CHUNK_SIZE):
+    # Copia del histórico limpio (con las etiquetas de los catálogos) en Parquet, particionada por
+    # year/month, para leerla sin pasar por el CSV ni por PostgreSQL (consultas_parquet.py)
+    if pa is None:
+        print("⚠️ pyarrow no está instalado: se omite la exportación a Parquet")
+        return 0
+    tipado, _ = detectar_esquema(conn)
+    entero = (lambda col: f"h.{col}") if tipado else (lambda col: _entero_pequeno(f"h.{col}"))
+    if periodos is None:
+        filtro, params = 'TRUE', []
+        shutil.rmtree(directorio, ignore_errors=True)
+    else:
+        filtro, params = _filtro_periodos(periodos, entero('year'), entero('month'))
+        if os.path.isdir(directorio):
+            for periodo in periodos:
+                for ruta in _directorio_periodo(directorio, periodo):
+                    shutil.rmtree(ruta, ignore_errors=True)
+
+    inicio = time.perf_counter()
+    query = f"""
+        SELECT {', '.join(f"{entero(c)} AS {c}" for c in ['ingestion_year', 'ingestion_month', 'ingestion_day',
+                                                          'year', 'month'])},
+               h.id_sistema_cliente, h.macroactivo::TEXT AS macroactivo, h.cod_activo, h.cod_perfil_riesgo,
+               h.cod_banca, c.banca, p.perfil_riesgo, a.activo, h.aba::FLOAT8 AS aba
+        FROM historico_aba_macroactivos h
+        LEFT JOIN cat_banca c ON h.cod_banca = c.cod_banca
+        LEFT JOIN cat_perfil_riesgo p ON h.cod_perfil_riesgo = p.cod_perfil_riesgo
+        LEFT JOIN catalogo_activos a ON h.cod_activo = a.cod_activo
+        WHERE {filtro}
+    """
+    esquema = _esquema_parquet()
+    filas = [0]
+
+    def lotes():
+        for df in conexion.leer_por_lotes(conn, query, params, tamano_lote):
+            filas[0] += len(df)
+            yield from pa.Table.from_pandas(df, preserve_index=False).cast(esquema).to_batches()
+
+    ds.write_dataset(
+        lotes(), directorio, schema=esquema, format='parquet',
+        partitioning=ds.partitioning(pa.schema([('year', pa.int16()), ('month', pa.int16())]), flavor='hive'),
+        basename_template=f"parte-{time.time_ns()}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+    conn.commit()
+    alcance = 'completo' if periodos is None else f"{len(periodos)} periodo(s)"
+    print(f"🗂️ Histórico exportado a Parquet en '{directorio}' ({filas[0]} filas, {alcance}, "
+          f"{time.perf_counter() - inicio:.2f} s)")
+    return filas[0]
+
+def _codificar(serie, diccionario):
+    # Códigos enteros contra un diccionario que crece bloque a bloque; nulo = -1
+    codigos, etiquetas = pd.factorize(serie)
+    globales = np.array([diccionario.setdefault(e, len(diccionario)) for e in etiquetas] + [-1], dtype=np.int64)
+    return globales[codigos]
+
+def exportar_instantanea(conn, directorio=consultas_instantanea.RUTA_INSTANTANEA, tamano_lote=CHUNK_SIZE):
+    # Histórico unido a los catálogos y agregado al grano de las gráficas, una columna .npy por campo y
+    # ordenado por periodo (consultas_instantanea.py). Se escribe en un directorio aparte y se cambia por
+    # el anterior al final. Banca, perfil y activo llegan ya como números de la caché de catálogos, que
+    # sirven de código en la instantánea con las etiquetas del catálogo como diccionario
+    tipado, _ = detectar_esquema(conn)
+    entero = (lambda col: f"h.{col}") if tipado else (lambda col: _entero_pequeno(f"h.{col}"))
+    catalogo = catalogos.diccionarios(conn)
+    params = {}
+    query = f"""
+        SELECT {entero('year')} AS year, {entero('month')} AS month, h.id_sistema_cliente, c.banca,
+               p.perfil_riesgo, h.macroactivo::TEXT AS macroactivo, a.activo,
+               SUM(h.aba)::FLOAT8 AS aba_suma, COUNT(*) AS filas
+        FROM historico_aba_macroactivos h
+        LEFT JOIN {catalogos.cruce(catalogo, 'banca', 'c', params)} ON h.cod_banca = c.cod_banca
+        LEFT JOIN {catalogos.cruce(catalogo, 'perfil_riesgo', 'p', params)} ON h.cod_perfil_riesgo = p.cod_perfil_riesgo
+        LEFT JOIN {catalogos.cruce(catalogo, 'activo', 'a', params)} ON h.cod_activo = a.cod_activo
+        GROUP BY 1, 2, 3, 4, 5, 6, 7
+        ORDER BY 1 NULLS FIRST, 2 NULLS FIRST
+    """
+    inicio = time.perf_counter()
+    diccionarios = {col: {} for col in consultas_instantanea.COLUMNAS_TEXTO if col not in catalogo}
+    partes = {col: [] for col in consultas_instantanea.COLUMNAS}
+    for df in conexion.leer_por_lotes(conn, query, params, tamano_lote=tamano_lote):
+        for col, tipo in consultas_instantanea.COLUMNAS.items():
+            if col in diccionarios:
+                valores = _codificar(df[col], diccionarios[col])
+            else:
+                valores = pd.to_numeric(df[col]).fillna(-1).to_numpy()
+            partes[col].append(valores.astype(tipo))
     conn.commit()
-    print("✅ Fila corregida insertada")
+    columnas = {col: np.concatenate(partes.pop(col)) for col in consultas_instantanea.COLUMNAS}
+
+    # Inicio y fin de cada periodo en las filas ya ordenadas; los nulos (-1) quedan antes y no se listan
+    llave = columnas['year'].astype(np.int32) * 100 + columnas['month']
+    inicios = np.concatenate([[0], np.flatnonzero(np.diff(llave)) + 1])
+    fines = np.append(inicios[1:], len(llave))
+    periodos = {f"{columnas['year'][i]}-{columnas['month'][i]}": [int(i), int(f)] for i, f in zip(inicios, fines)
+                if len(llave) and columnas['year'][i] >= 0 and columnas['month'][i] >= 0}
+    cursor = conn.cursor()
+    cursor.execute("SELECT year, month FROM ultimo_periodo_cargado LIMIT 1")
+    periodo = cursor.fetchone()
     cursor.close()
+    manifiesto = {
+        'version': consultas_instantanea.VERSION,
+        'marca': consultas_instantanea.marca_carga(conn),
+        'catalogos': catalogos.version(conn),
+        'creada': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'filas': len(llave),
+        'ultimo_periodo': [int(periodo[0]), int(periodo[1])] if periodo else None,
+        'periodos': periodos,
+    }
 
-def main():
+    temporal = f"{directorio}.nueva"
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    for col, valores in columnas.items():
+        np.save(os.path.join(temporal, f"{col}.npy"), valores)
+    for col, diccionario in diccionarios.items():
+        np.save(os.path.join(temporal, f"diccionario_{col}.npy"), np.array(list(diccionario), dtype=str))
+    for col in catalogo:
+        np.save(os.path.join(temporal, f"diccionario_{col}.npy"), catalogo[col]['etiquetas'].astype(str))
+    with open(os.path.join(temporal, consultas_instantanea.MANIFIESTO), 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, ensure_ascii=False)
+    # Quien ya tiene abiertos los archivos anteriores los sigue leyendo hasta cerrarlos
+    anterior = f"{directorio}.anterior"
+    shutil.rmtree(anterior, ignore_errors=True)
+    if os.path.exists(directorio):
+        os.rename(directorio, anterior)
+    os.rename(temporal, directorio)
+    shutil.rmtree(anterior, ignore_errors=True)
+    tamano = sum(os.path.getsize(os.path.join(directorio, f)) for f in os.listdir(directorio))
+    print(f"⚡ Instantánea para las gráficas en '{directorio}' ({manifiesto['filas']:,} filas, "
+          f"{tamano / 2**20:.1f} MB, {time.perf_counter() - inicio:.2f} s)")
+    return manifiesto['filas']
+
+# Cargas que deben esperar a otras: la clasificación del histórico puede venir de catalogo_activos
+DEPENDENCIAS_CARGA = {
+    'historico_aba_macroactivos': ['catalogo_activos'],
+}
+
+def _preparar_archivo(csv_file, table_name, chunk_size, tipado, clasificacion, directorio, cola):
+    # Corre en un proceso aparte: lee y limpia el archivo y deja cada bloque en disco, avisando por
+    # la cola para que la carga empiece sin esperar al archivo completo (None marca el final)
+    inicio = time.time()
+    conteos_reglas = {}
+    memoria = [0, 0]
+    huellas = {}
+    # Las métricas y el perfil de calidad de este proceso viajan de vuelta con el resultado
+    metricas.reiniciar()
+    perfil_calidad.reiniciar()
+    try:
+        for i, df in enumerate(leer_bloques(csv_file, table_name, chunk_size)):
+            df, rechazos = preparar_bloque(df, table_name, clasificacion, tipado, None, huellas,
+                                           conteos_reglas, memoria)
+            ruta = os.path.join(directorio, f"{table_name}_{i}.pkl")
+            pd.to_pickle((df, rechazos), ruta)
+            cola.put(ruta)
+    finally:
+        cola.put(None)
+    return {'conteos': conteos_reglas, 'memoria': memoria, 'huellas': huellas,
+            'inicio': inicio, 'fin': time.time(), 'metricas': metricas.exportar(),
+            'perfil': perfil_calidad.exportar()}
+
+def _reclasificar(df, mapa, tipado):
+    df = asignar_macroactivo(df, mapa)
+    if tipado:
+        df['macroactivo'] = df['macroactivo'].astype('category')
+    return df
+
+def _apartar_fuera_del_tipo(df, rechazos, permitidos):
+    # Tras reclasificar con el catálogo, la regla macroactivo_fuera_del_tipo se vuelve a aplicar al bloque
+    with metricas.etapa('regla:macroactivo_fuera_del_tipo', 'pendientes_codActivo') as m:
+        fuera = df['macroactivo'].notna() & ~df['macroactivo'].isin(permitidos)
+        m['filas_entrada'] = len(df)
+        m['filas_rechazadas'] = int(fuera.sum())
+        m['filas_salida'] = len(df) - m['filas_rechazadas']
+    if fuera.any():
+        apartadas = df[fuera].assign(motivo='macroactivo_fuera_del_tipo')
+        rechazos['pendientes_codActivo'] = pd.concat([rechazos.get('pendientes_codActivo'), apartadas])
+    return df[~fuera]
+
+def _cargar_preparado(db_name, table_name, preparacion, cola, dependencias, clasificacion, tipado, particionado,
+                      metodo, huellas):
+    conn = conexion.obtener_conexion(db_name)
+    try:
+        for dependencia in dependencias:
+            dependencia.result()
+        inicio = time.time()
+        mapa = None
+        if table_name == 'historico_aba_macroactivos':
+            # Si el catálogo recién cargado cambia la clasificación, se reasigna el macroactivo
+            mapa = cargar_clasificacion_activos(conn)[0]
+            mapa = mapa if mapa != clasificacion[0] else None
+        permitidos = asegurar_tipo_macroactivo(conn, mapa) if mapa is not None and tipado else None
+        acumulado = {}
+        # Tiempo de trabajo real, sin contar la espera por el siguiente bloque
+        ocupado = time.time() - inicio
+        for ruta in iter(cola.get, None):
+            inicio_bloque = time.time()
+            df, rechazos = pd.read_pickle(ruta)
+            os.remove(ruta)
+            if mapa is not None:
+                df = _reclasificar(df, mapa, tipado)
+                rechazos = {tabla: _reclasificar(r, mapa, False) for tabla, r in rechazos.items()}
+                if permitidos is not None:
+                    df = _apartar_fuera_del_tipo(df, rechazos, permitidos)
+            _cargar_bloque(conn, df, rechazos, table_name, metodo, particionado, acumulado)
+            ocupado += time.time() - inicio_bloque
+        preparado = preparacion.result()
+        metricas.combinar(preparado['metricas'])
+        perfil_calidad.combinar(preparado['perfil'])
+        inicio_cierre = time.time()
+        if table_name == 'historico_aba_macroactivos':
+            huellas.update(preparado['huellas'])
+            guardar_manifiesto(conn, huellas)
+        conn.commit()
+        _reportar_ingesta(table_name, metodo, acumulado, preparado['conteos'], preparado['memoria'])
+        fin = time.time()
+        return {'inicio': inicio, 'fin': fin, 'ocupado': ocupado + fin - inicio_cierre}
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error al insertar en {table_name}: {e}")
+        raise
+    finally:
+        conexion.liberar_conexion(conn)
+
+def _reportar_etapas(etapas, inicio_total):
+    total = time.time() - inicio_total
+    print("⏲️ Tiempo por etapa (inicio → fin, relativo al arranque):")
+    for nombre, (inicio, fin, ocupado) in etapas.items():
+        print(f"   {nombre:<45} {inicio - inicio_total:7.2f} s → {fin - inicio_total:7.2f} s "
+              f"({ocupado:.2f} s de trabajo)")
+    # Lo que tomaría correr las etapas una tras otra frente a lo que tomó en paralelo
+    secuencial = sum(ocupado for _, _, ocupado in etapas.values())
+    print(f"⏲️ Suma de etapas: {secuencial:.2f} s | tiempo real: {total:.2f} s | ahorro: {secuencial - total:.2f} s")
+
+def ingesta_paralela(db_name, archivos, clasificacion, tipado=False, particionado=False, metodo='copy',
+                     chunk_size=CHUNK_SIZE, procesos=None):
+    # archivos: {tabla: ruta}. Todos los CSV se limpian a la vez en procesos separados; cada carga usa
+    # su propia conexión del pool y consume los bloques a medida que salen, una vez cargadas sus dependencias
+    tipado = tipado or particionado
+    inicio_total = time.time()
+    directorio = tempfile.mkdtemp(prefix='bic_ingesta_')
+    huellas = {}
+    cargas = {}
+    etapas = {}
+    try:
+        with multiprocessing.Manager() as administrador, \
+                ProcessPoolExecutor(max_workers=procesos or len(archivos)) as procesos_pool, \
+                ThreadPoolExecutor(max_workers=len(archivos)) as hilos:
+            colas = {tabla: administrador.Queue() for tabla in archivos}
+            preparaciones = {
+                tabla: procesos_pool.submit(_preparar_archivo, ruta, tabla, chunk_size, tipado,
+                                            clasificacion if tabla == 'historico_aba_macroactivos' else None,
+                                            directorio, colas[tabla])
+                for tabla, ruta in archivos.items()
+            }
+            # Se encolan en orden de dependencias para que cada carga encuentre creadas las que espera
+            pendientes = list(archivos)
+            while pendientes:
+                tabla = next(t for t in pendientes
+                             if all(d in cargas or d not in archivos for d in DEPENDENCIAS_CARGA.get(t, [])))
+                pendientes.remove(tabla)
+                dependencias = [cargas[d] for d in DEPENDENCIAS_CARGA.get(tabla, []) if d in cargas]
+                cargas[tabla] = hilos.submit(_cargar_preparado, db_name, tabla, preparaciones[tabla], colas[tabla],
+                                             dependencias,
+                                             clasificacion, tipado, particionado, metodo, huellas)
+
+            cargadas = []
+            for tabla, carga in cargas.items():
+                try:
+                    tiempos_carga = carga.result()
+                except Exception:
+                    continue
+                preparado = preparaciones[tabla].result()
+                etapas[f"limpieza {tabla}"] = (preparado['inicio'], preparado['fin'],
+                                               preparado['fin'] - preparado['inicio'])
+                etapas[f"carga {tabla}"] = (tiempos_carga['inicio'], tiempos_carga['fin'], tiempos_carga['ocupado'])
+                cargadas.append(tabla)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    _reportar_etapas(etapas, inicio_total)
+    return cargadas
+
+def main(tipado=False, particionado=False, incremental=False, secuencial=False, metricas_json=None,
+         metricas_prometheus=None, parquet=None, instantanea=consultas_instantanea.RUTA_INSTANTANEA,
+         analitica=True):
     db_name = "db_bancolombia"
+    id_ejecucion = metricas.iniciar_ejecucion()
+    perfil_calidad.reiniciar()
     conn = create_database(db_name)
-    create_tables(conn)
+    create_tables(conn, tipado, particionado, reiniciar=not incremental)
 
     csv_dir = "/Users/juanjose/Downloads/"
     file_table_mapping = {
@@ -353,24 +1436,104 @@ def main():
     }
 
     table_order = ['cat_perfil_riesgo', 'catalogo_activos', 'cat_banca', 'historico_aba_macroactivos']
+    # Huellas por periodo del archivo histórico, base de las cargas incrementales siguientes
+    huellas = {}
+    periodos_cargados = []
+    archivos = {}
     for table in table_order:
         filename = next((f for f, t in file_table_mapping.items() if t == table), None)
         if filename:
             path = os.path.join(csv_dir, filename)
-            if os.path.exists(path):
-                print(f"📄 Procesando {filename}")
-                ingest_csv_data(conn, path, table)
-            else:
+            if not os.path.exists(path):
                 print(f"⚠️ Archivo {filename} no encontrado")
+            else:
+                archivos[table] = path
 
-    mover_nulls(conn)
-    corregir_fila_desalineada(conn)
-    corregir_fila_desalineada_perfilRiesgo(conn)
-    conn.close()
+    # Una carga completa rehace los catálogos; la incremental solo los que estaban vacíos
+    catalogos_recargados = not incremental
+    if not incremental and not secuencial:
+        print(f"📄 Procesando {len(archivos)} archivo(s) en paralelo")
+        ingesta_paralela(db_name, archivos, cargar_clasificacion_activos(conn), tipado, particionado)
+    else:
+        for table, path in archivos.items():
+            filename = os.path.basename(path)
+            if incremental and table == 'historico_aba_macroactivos':
+                print(f"📄 Procesando {filename} (incremental)")
+                periodos_cargados = cargar_incremental(conn, path)
+            elif incremental and not _tabla_vacia(conn, table):
+                print(f"⏭️ Catálogo '{table}' ya cargado, se conserva")
+            else:
+                print(f"📄 Procesando {filename}")
+                catalogos_recargados = catalogos_recargados or table != 'historico_aba_macroactivos'
+                cargado = ingest_csv_data(conn, path, table, chunk_size=CHUNK_SIZE, tipado=tipado,
+                                          particionado=particionado, huellas=huellas)
+                if cargado and table == 'historico_aba_macroactivos':
+                    guardar_manifiesto(conn, huellas)
+
+    with metricas.etapa('perfil_calidad'):
+        perfil_calidad.guardar(conn, *metricas.ejecucion())
+    # Nueva marca de versión: las cachés de catálogos (catalogos.py) se vuelven a leer en la siguiente consulta
+    if catalogos_recargados or catalogos.version(conn) is None:
+        catalogos.registrar_version(conn)
+
+    # En una carga incremental solo se refrescan los periodos cargados (None = todo)
+    periodos = sorted(periodos_cargados) if incremental else None
+    with metricas.etapa('refrescar_cubo'):
+        if periodos is None or periodos:
+            refrescar_cubo(conn, periodos)
+    if parquet and (periodos is None or periodos):
+        with metricas.etapa('exportar_parquet', 'historico_aba_macroactivos') as m:
+            m['filas_salida'] = exportar_parquet(conn, parquet, periodos)
+    # También se rehace si falta o quedó de otra carga, aunque esta ejecución no haya cambiado datos
+    if instantanea and (periodos is None or periodos or not consultas_instantanea.vigente(instantanea, conn)):
+        with metricas.etapa('exportar_instantanea') as m:
+            m['filas_salida'] = exportar_instantanea(conn, instantanea)
+    if particionado:
+        with metricas.etapa('crear_indices'):
+            crear_indices(conn)
+    reportar_tamano_tablas(conn, ['historico_aba_macroactivos'])
+    # Los servicios de consulta con caché (api_bic.py) la descartan al recibir este aviso
+    conexion.notificar_carga(conn, id_ejecucion)
+
+    # Etapa aparte, después de índices, exportaciones y aviso: si tarda o falla, la carga ya quedó completa
+    if analitica and (periodos is None or periodos):
+        with metricas.etapa('analitica_clientes', analitica_clientes.TABLA) as m:
+            try:
+                m['filas_salida'] = analitica_clientes.refrescar(conn, periodos)
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"⚠️ No se pudo actualizar '{analitica_clientes.TABLA}': {e}".strip())
+
+    metricas.imprimir_resumen()
+    metricas.guardar(conn)
+    if metricas_json:
+        metricas.escribir_json(metricas_json)
+    if metricas_prometheus:
+        metricas.escribir_prometheus(metricas_prometheus)
+    conexion.liberar_conexion(conn)
     print("🎉 Proceso completo")
 
+def _valor_argumento(nombre):
+    # Valor que sigue a una opción de la línea de comandos, p. ej. --metricas-json salida.json
+    argumentos = sys.argv[1:]
+    if nombre in argumentos and argumentos.index(nombre) + 1 < len(argumentos):
+        return argumentos[argumentos.index(nombre) + 1]
+    return None
+
 if __name__ == "__main__":
-    main()
+    if '--migrar' in sys.argv[1:]:
+        conn = create_database("db_bancolombia")
+        migrar_a_particionado(conn)
+        conexion.liberar_conexion(conn)
+    else:
+        main(tipado='--tipado' in sys.argv[1:], particionado='--particionado' in sys.argv[1:],
+             incremental='--incremental' in sys.argv[1:], secuencial='--secuencial' in sys.argv[1:],
+             metricas_json=_valor_argumento('--metricas-json'),
+             metricas_prometheus=_valor_argumento('--metricas-prometheus'),
+             parquet=_valor_argumento('--parquet'),
+             instantanea=None if '--sin-instantanea' in sys.argv[1:] else
+             _valor_argumento('--instantanea') or consultas_instantanea.RUTA_INSTANTANEA,
+             analitica='--sin-analitica' not in sys.argv[1:])
     
     
 
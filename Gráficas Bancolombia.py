@@ -1,67 +1,152 @@
-import psycopg2
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as EsperaAgotada
 from datetime import datetime
+import argparse
+import json
+import os
+import threading
+import time
+import psycopg2
+import catalogos
+import conexion
+import consultas
+import consultas_instantanea
+import perfil_calidad
+
+# matplotlib y seaborn se importan al dibujar la primera gráfica (_cargar_graficas), no al arrancar
+plt = None
+sns = None
+
+# Destino de las gráficas: sin directorio se muestran en ventana; con directorio se guardan en cada formato
+SALIDA = {'directorio': None, 'formatos': ('png',)}
+
+def _cargar_graficas(backend=None):
+    global plt, sns
+    if plt is None:
+        import matplotlib
+        # Si las gráficas van a archivos no se necesita ventana
+        if backend or SALIDA['directorio']:
+            matplotlib.use(backend or 'Agg')
+        import matplotlib.pyplot
+        import seaborn
+        plt, sns = matplotlib.pyplot, seaborn
+    elif backend:
+        plt.switch_backend(backend)
+
+def _mostrar(nombre):
+    if SALIDA['directorio'] is None:
+        plt.show()
+        return
+    os.makedirs(SALIDA['directorio'], exist_ok=True)
+    for formato in SALIDA['formatos']:
+        ruta = os.path.join(SALIDA['directorio'], f"{nombre}.{formato}")
+        plt.savefig(ruta)
+        print(f"💾 Gráfica guardada en '{ruta}'")
+    plt.close('all')
 
 def connect_to_database():
-    return psycopg2.connect(
-        host="localhost",
-        user="postgres",
-        password="password",
-        port="5432",
-        database="db_bancolombia"
-    )
+    # Conexión del pool compartido, con tiempo límite por consulta (ver conexion.py)
+    return conexion.conexion_consultas()
 
+# Carga completa del histórico con sus catálogos; las gráficas usan consultas agregadas (consultas.py)
 def obtener_datos_portafolio():
     conn = connect_to_database()
-    query = """
+    # Banca, perfil y activo llegan como números de la caché de catálogos y quedan como pd.Categorical:
+    # cada fila guarda un entero en vez de repetir el texto
+    diccionarios = catalogos.diccionarios(conn)
+    params = {}
+    query = f"""
         SELECT h.*, c.banca, p.perfil_riesgo, a.activo
         FROM historico_aba_macroactivos h
-        LEFT JOIN cat_banca c ON h.cod_banca = c.cod_banca
-        LEFT JOIN cat_perfil_riesgo p ON h.cod_perfil_riesgo = p.cod_perfil_riesgo
-        LEFT JOIN catalogo_activos a ON h.cod_activo = a.cod_activo
+        LEFT JOIN {catalogos.cruce(diccionarios, 'banca', 'c', params)} ON h.cod_banca = c.cod_banca
+        LEFT JOIN {catalogos.cruce(diccionarios, 'perfil_riesgo', 'p', params)} ON h.cod_perfil_riesgo = p.cod_perfil_riesgo
+        LEFT JOIN {catalogos.cruce(diccionarios, 'activo', 'a', params)} ON h.cod_activo = a.cod_activo
     """
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df
-
-def grafico_portafolio_cliente(df):
-    ultima_fecha = df[['year', 'month']].dropna().astype(int).sort_values(['year', 'month']).drop_duplicates().iloc[-1]
-    df_ultima = df[(df['year'].astype(int) == ultima_fecha['year']) & (df['month'].astype(int) == ultima_fecha['month'])]
-
-    clientes = df_ultima['id_sistema_cliente'].unique()
-    for cliente in clientes:
-        df_cliente = df_ultima[df_ultima['id_sistema_cliente'] == cliente]
-        df_grouped = df_cliente.groupby(['macroactivo', 'activo'])['aba'].sum().reset_index()
-        df_grouped['porcentaje'] = df_grouped['aba'] / df_grouped['aba'].sum() * 100
-
-        plt.figure(figsize=(10, 6))
-        bars = sns.barplot(data=df_grouped, x='porcentaje', y='activo', hue='macroactivo')
-        plt.title(f"Portafolio del Cliente {cliente}")
-        plt.xlabel('% del Portafolio')
-        plt.ylabel('Activo')
-        plt.legend(title='Macroactivo')
-
-        # Etiquetas con porcentaje
-        for bar in bars.patches:
-            width = bar.get_width()
-            if width > 0:
-                plt.text(width + 0.5, bar.get_y() + bar.get_height() / 2,
-                         f'{width:.1f}%', va='center')
-
-        plt.tight_layout()
-        plt.show()
+    # Cursor del lado del servidor para no duplicar el histórico completo en memoria
+    df = conexion.leer_dataframe(conn, query, params)
+    conexion.liberar_conexion(conn)
+    return catalogos.etiquetar(df, diccionarios, ['banca', 'perfil_riesgo', 'activo'], categorias=True)
+
+def _dibujar_portafolio_cliente(cliente, df_cliente):
+    _cargar_graficas()
+    # Con las columnas categóricas de consultas.portafolio_clientes seaborn dibujaría todos los activos del catálogo
+    df_grouped = df_cliente[['macroactivo', 'activo', 'aba']].astype({'macroactivo': str, 'activo': str})
+    df_grouped = df_grouped.reset_index(drop=True)
+    df_grouped['porcentaje'] = df_grouped['aba'] / df_grouped['aba'].sum() * 100
+
+    plt.figure(figsize=(10, 6))
+    bars = sns.barplot(data=df_grouped, x='porcentaje', y='activo', hue='macroactivo')
+    plt.title(f"Portafolio del Cliente {cliente}")
+    plt.xlabel('% del Portafolio')
+    plt.ylabel('Activo')
+    plt.legend(title='Macroactivo')
 
-def grafico_portafolio_banca(df):
-    ultima_fecha = df[['year', 'month']].dropna().astype(int).sort_values(['year', 'month']).drop_duplicates().iloc[-1]
-    df_ultima = df[(df['year'].astype(int) == ultima_fecha['year']) & (df['month'].astype(int) == ultima_fecha['month'])]
+    # Etiquetas con porcentaje
+    for bar in bars.patches:
+        width = bar.get_width()
+        if width > 0:
+            plt.text(width + 0.5, bar.get_y() + bar.get_height() / 2,
+                     f'{width:.1f}%', va='center')
 
-    df_grouped = df_ultima.groupby(['banca', 'macroactivo'])['aba'].sum().reset_index()
-    df_total = df_grouped.groupby('banca')['aba'].sum().reset_index().rename(columns={'aba': 'total'})
-    df_grouped = df_grouped.merge(df_total, on='banca')
-    df_grouped['porcentaje'] = df_grouped['aba'] / df_grouped['total'] * 100
+    plt.tight_layout()
 
+def grafico_portafolio_cliente(df_portafolio):
+    # df_portafolio viene agrupado por cliente, macroactivo y activo (consultas.portafolio_clientes)
+    for cliente, df_cliente in df_portafolio.groupby('id_sistema_cliente', sort=False):
+        _dibujar_portafolio_cliente(cliente, df_cliente)
+        _mostrar(f"portafolio_{cliente}")
+
+def _iniciar_trabajador_graficas():
+    # Backend sin ventana: cada proceso solo escribe archivos
+    _cargar_graficas('Agg')
+
+def _rutas_cliente(directorio, cliente, formatos):
+    return [os.path.join(directorio, f"portafolio_{cliente}.{formato}") for formato in formatos]
+
+def _renderizar_cliente(tarea):
+    cliente, registros, rutas = tarea
+    df_cliente = pd.DataFrame(registros, columns=['macroactivo', 'activo', 'aba'])
+    _dibujar_portafolio_cliente(cliente, df_cliente)
+    for ruta in rutas:
+        plt.savefig(ruta)
+    plt.close('all')
+    return cliente
+
+def exportar_portafolios_clientes(df_portafolio, directorio, formatos=('png',), procesos=None, reanudar=True):
+    os.makedirs(directorio, exist_ok=True)
+
+    # Se agrupa una sola vez; cada tarea lleva solo las filas de su cliente
+    tareas = []
+    omitidos = 0
+    for cliente, df_cliente in df_portafolio.groupby('id_sistema_cliente', sort=False):
+        rutas = _rutas_cliente(directorio, cliente, formatos)
+        if reanudar and all(os.path.exists(ruta) for ruta in rutas):
+            omitidos += 1
+            continue
+        registros = list(df_cliente[['macroactivo', 'activo', 'aba']].itertuples(index=False, name=None))
+        tareas.append((cliente, registros, rutas))
+
+    if omitidos:
+        print(f"⏭️ {omitidos} cliente(s) ya tenían sus gráficas, se omiten")
+    if not tareas:
+        print("✅ No hay gráficas pendientes por generar")
+        return 0
+
+    total = len(tareas)
+    paso = max(1, total // 20)
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador_graficas) as pool:
+        lote = max(1, total // ((procesos or os.cpu_count() or 1) * 8))
+        for hechos, _ in enumerate(pool.map(_renderizar_cliente, tareas, chunksize=lote), 1):
+            if hechos % paso == 0 or hechos == total:
+                segundos = time.perf_counter() - inicio
+                print(f"🖼️ {hechos}/{total} gráficas ({hechos / segundos:,.1f} gráficas/s)")
+    print(f"✅ Gráficas de portafolio guardadas en '{directorio}'")
+    return total
+
+def grafico_portafolio_banca(df_grouped):
+    # df_grouped: consultas.mezcla_ultimo_periodo(conn, 'banca')
+    _cargar_graficas()
     plt.figure(figsize=(12, 6))
     bars = sns.barplot(data=df_grouped, x='banca', y='porcentaje', hue='macroactivo')
     plt.title('Distribución del Portafolio por Banca')
@@ -77,17 +162,11 @@ def grafico_portafolio_banca(df):
                      ha='center', va='bottom')
 
     plt.tight_layout()
-    plt.show()
-
-def grafico_portafolio_perfil_riesgo(df):
-    ultima_fecha = df[['year', 'month']].dropna().astype(int).sort_values(['year', 'month']).drop_duplicates().iloc[-1]
-    df_ultima = df[(df['year'].astype(int) == ultima_fecha['year']) & (df['month'].astype(int) == ultima_fecha['month'])]
-
-    df_grouped = df_ultima.groupby(['perfil_riesgo', 'macroactivo'])['aba'].sum().reset_index()
-    df_total = df_grouped.groupby('perfil_riesgo')['aba'].sum().reset_index().rename(columns={'aba': 'total'})
-    df_grouped = df_grouped.merge(df_total, on='perfil_riesgo')
-    df_grouped['porcentaje'] = df_grouped['aba'] / df_grouped['total'] * 100
+    _mostrar('portafolio_banca')
 
+def grafico_portafolio_perfil_riesgo(df_grouped):
+    # df_grouped: consultas.mezcla_ultimo_periodo(conn, 'perfil_riesgo')
+    _cargar_graficas()
     plt.figure(figsize=(12, 6))
     bars = sns.barplot(data=df_grouped, x='perfil_riesgo', y='porcentaje', hue='macroactivo')
     plt.title('Distribución del Portafolio por Perfil de Riesgo')
@@ -103,19 +182,11 @@ def grafico_portafolio_perfil_riesgo(df):
                      ha='center', va='bottom')
 
     plt.tight_layout()
-    plt.show()
-
-def grafico_evolucion_ABA(df, fecha_inicio=None, fecha_fin=None):
-    df['fecha'] = pd.to_datetime(df['year'].astype(str) + '-' + df['month'].astype(int).astype(str) + '-01')
-    
-    if fecha_inicio:
-        df = df[df['fecha'] >= pd.to_datetime(fecha_inicio)]
-    if fecha_fin:
-        df = df[df['fecha'] <= pd.to_datetime(fecha_fin)]
-
-    # 🔁 Promedio del ABA por mes
-    df_grouped = df.groupby('fecha')['aba'].mean().reset_index()  # Usar .mean() en lugar de .sum()
+    _mostrar('portafolio_perfil_riesgo')
 
+def grafico_evolucion_ABA(df_grouped):
+    # 🔁 Promedio del ABA por mes, ya filtrado por fechas (consultas.aba_promedio_mensual)
+    _cargar_graficas()
     plt.figure(figsize=(12, 6))
     sns.lineplot(data=df_grouped, x='fecha', y='aba', marker='o')
     plt.title('Evolución Mensual del ABA Promedio del Banco')
@@ -123,12 +194,17 @@ def grafico_evolucion_ABA(df, fecha_inicio=None, fecha_fin=None):
     plt.ylabel('ABA Promedio')
     plt.xticks(rotation=45)  # Rota las fechas para mejorar la legibilidad
     plt.tight_layout()
-    plt.show()
+    _mostrar('evolucion_aba')
     
     
-def grafico_eficiencia_carga():
-    datos_originales = 6694
-    datos_limpios = 4077
+def grafico_eficiencia_carga(df_eficiencia):
+    # Conteos de la última ejecución del ETL (tabla metricas_ejecucion)
+    if df_eficiencia.empty:
+        print("⚠️ No hay métricas de carga registradas; ejecute primero CÓDIGOBIC.py")
+        return
+    _cargar_graficas()
+    datos_originales = int(df_eficiencia['originales'].iloc[0])
+    datos_limpios = int(df_eficiencia['conservados'].iloc[0])
     datos_descartados = datos_originales - datos_limpios
 
     labels = ['Datos conservados', 'Datos descartados']
@@ -139,16 +215,62 @@ def grafico_eficiencia_carga():
     plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors)
     plt.title('Eficiencia de Carga de Datos a Plantilla')
     plt.axis('equal')  # Círculo perfecto
-    plt.show()
+    _mostrar('eficiencia_carga')
+
+def grafico_calidad_datos(df_perfil):
+    # Perfil de calidad de la última carga (consultas.perfil_calidad), calculado por el ETL mientras leía el archivo
+    historico = df_perfil[df_perfil['tabla'] == 'historico_aba_macroactivos']
+    if historico.empty:
+        print("⚠️ No hay perfil de calidad del histórico registrado; ejecute primero CÓDIGOBIC.py")
+        return
+    _cargar_graficas()
+    indicadores = historico.groupby('indicador')
+    filas = indicadores.get_group('filas')['valor'].iloc[0]
+    fig, ejes = plt.subplots(2, 2, figsize=(14, 10))
+
+    # Nulos por columna, con su cardinalidad en la etiqueta
+    nulos = indicadores.get_group('nulos').set_index('columna')['valor']
+    distintos = indicadores.get_group('distintos').set_index('columna')['valor']
+    etiquetas = [f"{col} ({int(distintos[col]):,} distintos)" if col in distintos else col for col in nulos.index]
+    ejes[0, 0].barh(etiquetas, nulos.to_numpy() / filas * 100, color='#F4A261')
+    ejes[0, 0].invert_yaxis()
+    ejes[0, 0].set_title(f'Nulos por columna (% de {int(filas):,} filas)')
+
+    reglas = historico[historico['indicador'].str.startswith('regla:')]
+    ejes[0, 1].barh(reglas['indicador'].str.removeprefix('regla:'), reglas['valor'], color='#F44336')
+    ejes[0, 1].invert_yaxis()
+    ejes[0, 1].set_title('Filas enviadas a pendientes por regla')
+
+    # Filas con códigos que no están en su catálogo, con los códigos más frecuentes encima de cada barra
+    desconocidos = indicadores.get_group('filas_codigo_desconocido').set_index('columna')['valor']
+    codigos = indicadores.get_group('codigos_desconocidos').set_index('columna')
+    barras = ejes[1, 0].bar(desconocidos.index, desconocidos.to_numpy(), color='#2E86AB')
+    for barra, col in zip(barras, desconocidos.index):
+        ejemplos = ', '.join(list(json.loads(codigos.loc[col, 'detalle']))[:3])
+        ejes[1, 0].text(barra.get_x() + barra.get_width() / 2, barra.get_height(),
+                        f"{int(codigos.loc[col, 'valor'])} código(s)\n{ejemplos}", ha='center', va='bottom')
+    ejes[1, 0].set_ylim(0, max(desconocidos.max(), 1) * 1.25)
+    ejes[1, 0].set_title('Filas con códigos que no están en su catálogo')
+
+    # Distribución del ABA por orden de magnitud, desde el sketch guardado
+    if 'sketch' in indicadores.groups:
+        histograma = perfil_calidad.histograma_aba(indicadores.get_group('sketch')['detalle'].iloc[0])
+        ejes[1, 1].bar(histograma['rango'], histograma['filas'], color='#4CAF50')
+        ejes[1, 1].set_yscale('log')
+        cuantiles = historico[(historico['columna'] == 'aba') & historico['indicador'].str.fullmatch(r'p\d\d')]
+        ejes[1, 1].text(0.02, 0.97, '\n'.join(f"{i}: {v:,.0f}" for i, v in zip(cuantiles['indicador'], cuantiles['valor'])),
+                        transform=ejes[1, 1].transAxes, va='top')
+    ejes[1, 1].set_xlabel('Orden de magnitud')
+    ejes[1, 1].set_title('Distribución del ABA leído')
+
+    fig.suptitle(f"Perfil de calidad de la carga {df_perfil['id_ejecucion'].iloc[0]}")
+    plt.tight_layout()
+    _mostrar('calidad_datos')
     
 
-def grafico_top_clientes_piramide(df, top_n=10):
-    # Agrupar y ordenar por ABA total
-    df_top = df.groupby('id_sistema_cliente')['aba'].sum().reset_index()
-    df_top = df_top.sort_values('aba', ascending=True).head(top_n)
-
-    # Invertir el orden para que el mayor quede arriba
-    df_top = df_top[::-1]
+def grafico_top_clientes_piramide(df_top, top_n=10):
+    # df_top: consultas.top_clientes(conn, top_n), ya agrupado y de mayor a menor ABA total
+    _cargar_graficas()
 
     plt.figure(figsize=(8, 6))
     bars = plt.barh(y=df_top['id_sistema_cliente'], width=df_top['aba'], color='#2E86AB')
@@ -161,15 +283,12 @@ def grafico_top_clientes_piramide(df, top_n=10):
     plt.gca().invert_yaxis()  # Esto hace la pirámide: pone el mayor arriba
 
     plt.tight_layout()
-    plt.show()
+    _mostrar('top_clientes')
 
 
-def grafico_activo_mas_menos_inversion_fics(df):
-    # Filtramos solo FICs
-    df_fics = df[df['macroactivo'] == 'FICs']
-
-    # Agrupamos por activo y sumamos ABA
-    df_grouped = df_fics.groupby('activo')['aba'].sum().reset_index()
+def grafico_activo_mas_menos_inversion_fics(df_grouped):
+    # df_grouped: ABA total por activo dentro de FICs (consultas.activos_por_macroactivo)
+    _cargar_graficas()
 
     # Identificamos el activo más y el menos invertido
     activo_max = df_grouped.loc[df_grouped['aba'].idxmax()]
@@ -190,14 +309,11 @@ def grafico_activo_mas_menos_inversion_fics(df):
     plt.xlabel('Activo')
     plt.ylabel('Total ABA')
     plt.tight_layout()
-    plt.show()
+    _mostrar('activos_fics')
     
-def grafico_activo_mas_menos_inversion_RentaVariable(df):
-    # Filtramos solo Renta Varibale
-    df_fics = df[df['macroactivo'] == 'Renta Variable']
-
-    # Agrupamos por activo y sumamos ABA
-    df_grouped = df_fics.groupby('activo')['aba'].sum().reset_index()
+def grafico_activo_mas_menos_inversion_RentaVariable(df_grouped):
+    # df_grouped: ABA total por activo dentro de Renta Variable (consultas.activos_por_macroactivo)
+    _cargar_graficas()
 
     # Identificamos el activo más y el menos invertido
     activo_max = df_grouped.loc[df_grouped['aba'].idxmax()]
@@ -218,49 +334,329 @@ def grafico_activo_mas_menos_inversion_RentaVariable(df):
     plt.xlabel('Activo')
     plt.ylabel('Total ABA')
     plt.tight_layout()
-    plt.show()
-
-
-
+    _mostrar('activos_renta_variable')
+
+
+def abrir_origen(parquet=None, instantanea=None):
+    # Con un directorio Parquet se lee la copia del histórico (consultas_parquet.py) sin conectarse a PostgreSQL.
+    # Si no, se usa la instantánea que deja el ETL (consultas_instantanea.py) mientras corresponda a la última
+    # carga; si está desactualizada se consulta la base
+    if parquet:
+        import consultas_parquet
+        return consultas_parquet, parquet
+    try:
+        conn = connect_to_database()
+    except psycopg2.OperationalError:
+        if instantanea and consultas_instantanea.leer_manifiesto(instantanea):
+            print(f"⚠️ Sin conexión a PostgreSQL: se usa la instantánea '{instantanea}' aunque no se pudo verificar")
+            return consultas_instantanea, instantanea
+        raise
+    if instantanea:
+        if consultas_instantanea.vigente(instantanea, conn):
+            conexion.liberar_conexion(conn)
+            return consultas_instantanea, instantanea
+        print(f"⚠️ La instantánea '{instantanea}' no existe o no corresponde a la última carga: se consulta PostgreSQL")
+    return consultas, conn
+
+def cerrar_origen(origen):
+    if not isinstance(origen, str):
+        conexion.liberar_conexion(origen)
+
+def consultas_en_cache(fuente, origen):
+    # Cada consulta se hace una sola vez por función y argumentos; las gráficas que la repiten reusan el resultado
+    resultados = {}
+    uso = {'consultas': 0, 'reutilizadas': 0}
+
+    def consultar(nombre, *argumentos, **opciones):
+        llave = (nombre, argumentos, tuple(sorted(opciones.items())))
+        if llave in resultados:
+            uso['reutilizadas'] += 1
+        else:
+            uso['consultas'] += 1
+            resultados[llave] = getattr(fuente, nombre)(origen, *argumentos, **opciones)
+        return resultados[llave]
+
+    consultar.uso = uso
+    return consultar
+
+class ConsultaCancelada(Exception):
+    pass
+
+def consultas_en_segundo_plano(fuente, origen, hilos=3, tiempo_limite=None):
+    # Como consultas_en_cache, pero cada consulta corre en un hilo y, si la fuente es PostgreSQL, con su propia
+    # conexión del pool: el menú puede precargar resultados mientras el usuario elige, mostrar el avance de
+    # la lectura por lotes (conexion.leer_por_lotes) y cancelar con Ctrl+C o al pasar tiempo_limite segundos
+    ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='consulta')
+    resultados = {}
+    estados = {}
+    candado = threading.Lock()
+    uso = {'consultas': 0, 'reutilizadas': 0}
+
+    def ejecutar(estado, nombre, argumentos, opciones):
+        if isinstance(origen, str):
+            return getattr(fuente, nombre)(origen, *argumentos, **opciones)
+
+        def avance(filas):
+            estado['filas'] = filas
+            if estado['cancelada'].is_set():
+                raise ConsultaCancelada(f"'{nombre}' cancelada")
+
+        conn = conexion.conexion_consultas()
+        estado['conn'] = conn
+        conexion.registrar_avance(conn, avance)
+        try:
+            return getattr(fuente, nombre)(conn, *argumentos, **opciones)
+        finally:
+            conexion.quitar_avance(conn)
+            estado['conn'] = None
+            conexion.liberar_conexion(conn)
+
+    def pedir(nombre, *argumentos, **opciones):
+        # Futuro del resultado: el que ya está en curso o terminado, o uno nuevo
+        llave = (nombre, argumentos, tuple(sorted(opciones.items())))
+        with candado:
+            if llave in resultados:
+                uso['reutilizadas'] += 1
+            else:
+                uso['consultas'] += 1
+                estados[llave] = {'conn': None, 'filas': 0, 'cancelada': threading.Event()}
+                resultados[llave] = ejecutor.submit(ejecutar, estados[llave], nombre, argumentos, opciones)
+            return llave, resultados[llave]
+
+    def descartar(llave, cancelar=False):
+        # Sin el resultado en la caché, la próxima vez que se pida se vuelve a consultar
+        with candado:
+            futuro, estado = resultados.pop(llave, None), estados.pop(llave, None)
+        if cancelar and futuro is not None:
+            estado['cancelada'].set()
+            futuro.cancel()
+            # Interrumpe la sentencia en el servidor; es seguro llamarlo desde otro hilo
+            conn = estado['conn']
+            if conn is not None:
+                conn.cancel()
+
+    def consultar(nombre, *argumentos, **opciones):
+        llave, futuro = pedir(nombre, *argumentos, **opciones)
+        estado = estados.get(llave, {'filas': 0})
+        inicio = time.perf_counter()
+        esperando = False
+        try:
+            while True:
+                try:
+                    return futuro.result(timeout=0.5)
+                except EsperaAgotada:
+                    pass
+                segundos = time.perf_counter() - inicio
+                if tiempo_limite and segundos > tiempo_limite:
+                    descartar(llave, cancelar=True)
+                    raise ConsultaCancelada(f"'{nombre}' superó el límite de {tiempo_limite:g} s")
+                print(f"\r⏳ {nombre}: {estado['filas']:,} fila(s) recibidas en {segundos:.1f} s (Ctrl+C cancela)",
+                      end='', flush=True)
+                esperando = True
+        except KeyboardInterrupt:
+            descartar(llave, cancelar=True)
+            raise ConsultaCancelada(f"'{nombre}' cancelada")
+        except ConsultaCancelada:
+            raise
+        except Exception:
+            descartar(llave)
+            raise
+        finally:
+            if esperando:
+                print()
+
+    def precargar(funciones):
+        # Cada función pide sus datos como lo hace su gráfica, así que reusan las mismas llaves de la caché
+        def silencioso(nombre, *argumentos, **opciones):
+            return pedir(nombre, *argumentos, **opciones)[1].result()
+
+        def correr():
+            for funcion in funciones:
+                try:
+                    funcion(silencioso)
+                except Exception:
+                    # Si falla o se cancela, la gráfica la vuelve a pedir cuando se elija
+                    pass
+
+        threading.Thread(target=correr, daemon=True, name='precarga').start()
+
+    def cerrar():
+        for llave in list(resultados):
+            if not resultados[llave].done():
+                descartar(llave, cancelar=True)
+        ejecutor.shutdown(wait=False, cancel_futures=True)
+
+    consultar.uso = uso
+    consultar.precargar = precargar
+    consultar.cerrar = cerrar
+    return consultar
+
+def _portafolio_clientes(consultar):
+    return consultar('portafolio_clientes', periodo=consultar('ultimo_periodo'))
+
+def _mezcla(consultar, dimension):
+    return consultar('mezcla_ultimo_periodo', dimension, periodo=consultar('ultimo_periodo'))
+
+def _lista(valor):
+    return tuple(v.strip() for v in valor.split(',')) if valor else None
+
+def _top_clientes(consultar, args):
+    # --periodo ultimo usa el periodo que dejó la carga, ya resuelto en la caché de consultas
+    periodo = getattr(args, 'periodo', None)
+    if periodo == 'ultimo':
+        periodo = consultar('ultimo_periodo')
+    elif periodo:
+        periodo = tuple(int(parte) for parte in periodo.split('-'))
+    return consultar('top_clientes', args.n, periodo=periodo, bancas=_lista(getattr(args, 'banca', None)),
+                     macroactivos=_lista(getattr(args, 'macroactivo', None)))
+
+# Comando de la línea de comandos → gráfica; cada una recibe la función de consulta y los argumentos
+GRAFICAS = {
+    'portafolio-cliente': lambda consultar, args: grafico_portafolio_cliente(_portafolio_clientes(consultar)),
+    'banca': lambda consultar, args: grafico_portafolio_banca(_mezcla(consultar, 'banca')),
+    'perfil': lambda consultar, args: grafico_portafolio_perfil_riesgo(_mezcla(consultar, 'perfil_riesgo')),
+    'evolucion': lambda consultar, args: grafico_evolucion_ABA(
+        consultar('aba_promedio_mensual', args.desde, args.hasta)),
+    'eficiencia': lambda consultar, args: grafico_eficiencia_carga(consultar('eficiencia_carga')),
+    'calidad': lambda consultar, args: grafico_calidad_datos(consultar('perfil_calidad')),
+    'top-clientes': lambda consultar, args: grafico_top_clientes_piramide(_top_clientes(consultar, args), args.n),
+    'fics': lambda consultar, args: grafico_activo_mas_menos_inversion_fics(
+        consultar('activos_por_macroactivo', 'FICs')),
+    'renta-variable': lambda consultar, args: grafico_activo_mas_menos_inversion_RentaVariable(
+        consultar('activos_por_macroactivo', 'Renta Variable')),
+}
+
+# Datos de las opciones más usadas del menú; se piden en segundo plano mientras el usuario elige
+PRECARGA = [
+    lambda consultar: _mezcla(consultar, 'banca'),
+    lambda consultar: _mezcla(consultar, 'perfil_riesgo'),
+    lambda consultar: consultar('aba_promedio_mensual', None, None),
+    lambda consultar: _top_clientes(consultar, argparse.Namespace(n=10)),
+]
+
+MENU = [
+    ('portafolio-cliente', "Portafolio por cliente"),
+    ('banca', "Portafolio por banca"),
+    ('perfil', "Portafolio por perfil de riesgo"),
+    ('evolucion', "Evolución ABA promedio"),
+    ('eficiencia', "Eficiencia de carga de datos"),
+    ('calidad', "Perfil de calidad de la última carga"),
+    ('top-clientes', "Top 10 clientes con mayor ABA total"),
+    ('fics', "Activo más y menos invertido dentro de FICs"),
+    ('renta-variable', "Activo más y menos invertido dentro de Renta Variable"),
+]
+
+def _agregar_periodo(parser):
+    parser.add_argument('--desde', metavar='YYYY-MM', help="Primer mes de la evolución del ABA")
+    parser.add_argument('--hasta', metavar='YYYY-MM', help="Último mes de la evolución del ABA")
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description="Gráficas del portafolio de inversiones BIC")
+    parser.add_argument('--parquet', metavar='DIRECTORIO', help="Leer la copia Parquet del histórico en vez de PostgreSQL")
+    parser.add_argument('--instantanea', metavar='DIRECTORIO', default=consultas_instantanea.RUTA_INSTANTANEA,
+                        help="Instantánea del ETL que se usa mientras esté al día (por defecto 'instantanea')")
+    parser.add_argument('--sin-instantanea', action='store_true', help="Consultar siempre PostgreSQL")
+    parser.add_argument('--salida', metavar='DIRECTORIO', help="Guardar las gráficas en archivos en vez de mostrarlas")
+    parser.add_argument('--formatos', default='png', help="Formatos de archivo separados por coma (png,svg,pdf)")
+    parser.add_argument('--tiempo-limite', type=float, metavar='SEGUNDOS',
+                        help="En el menú, cancelar la consulta de una gráfica que tarde más de esto")
+    comandos = parser.add_subparsers(dest='comando', metavar='comando')
+    comandos.add_parser('menu', help="Menú interactivo (comando por defecto)")
+    comandos.add_parser('portafolio-cliente', help="Portafolio por cliente")
+    comandos.add_parser('banca', help="Portafolio por banca")
+    comandos.add_parser('perfil', help="Portafolio por perfil de riesgo")
+    _agregar_periodo(comandos.add_parser('evolucion', help="Evolución ABA promedio"))
+    comandos.add_parser('eficiencia', help="Eficiencia de carga de datos")
+    comandos.add_parser('calidad', help="Perfil de calidad de la última carga (nulos, reglas, códigos, ABA)")
+    top = comandos.add_parser('top-clientes', help="Top de clientes con mayor ABA total")
+    top.add_argument('--n', type=int, default=10, help="Número de clientes")
+    top.add_argument('--periodo', metavar='YYYY-MM', help="Solo ese mes ('ultimo' para el último cargado)")
+    top.add_argument('--banca', help="Bancas separadas por coma")
+    top.add_argument('--macroactivo', help="Macroactivos separados por coma")
+    comandos.add_parser('fics', help="Activo más y menos invertido dentro de FICs")
+    comandos.add_parser('renta-variable', help="Activo más y menos invertido dentro de Renta Variable")
+
+    reporte = comandos.add_parser('report', help="Todas las gráficas en archivos, en un solo proceso")
+    reporte.add_argument('directorio', nargs='?', default='reporte')
+    _agregar_periodo(reporte)
+    reporte.add_argument('--n', type=int, default=10, help="Número de clientes del top")
+    reporte.add_argument('--portafolios', action='store_true',
+                         help="Incluir una gráfica de portafolio por cliente (subdirectorio portafolios)")
+
+    lote = comandos.add_parser('lote', help="Una gráfica de portafolio por cliente, en paralelo")
+    lote.add_argument('directorio', nargs='?', default='graficas_clientes')
+    lote.add_argument('--procesos', type=int, default=None)
+    lote.add_argument('--rehacer', action='store_true', help="Volver a generar las gráficas que ya existen")
+    return parser
+
+def generar_reporte(consultar, args):
+    SALIDA['directorio'] = args.directorio
+    inicio = time.perf_counter()
+    for comando, grafica in GRAFICAS.items():
+        if comando != 'portafolio-cliente':
+            grafica(consultar, args)
+    if args.portafolios:
+        exportar_portafolios_clientes(_portafolio_clientes(consultar), os.path.join(args.directorio, 'portafolios'),
+                                      SALIDA['formatos'])
+    uso = consultar.uso
+    print(f"🗃️ {uso['consultas']} consulta(s), {uso['reutilizadas']} resultado(s) reutilizados de la caché")
+    print(f"✅ Reporte generado en '{args.directorio}' ({time.perf_counter() - inicio:.2f} s)")
+
+def menu(consultar, args):
+    # Se repite hasta que el usuario salga; lo ya consultado (o precargado) sirve para las siguientes gráficas
+    if hasattr(consultar, 'precargar'):
+        consultar.precargar(PRECARGA)
+    while True:
+        print("\n--- Gráficas disponibles ---")
+        for numero, (_, descripcion) in enumerate(MENU, 1):
+            print(f"{numero}. {descripcion}")
+
+        try:
+            opcion = input(f"Seleccione una opción (1-{len(MENU)}, Enter para salir): ").strip()
+        except (KeyboardInterrupt, EOFError):
+            print()
+            return
+        if not opcion:
+            return
+        if not opcion.isdigit() or not 1 <= int(opcion) <= len(MENU):
+            print("⚠️ Opción no válida.")
+            continue
+        comando = MENU[int(opcion) - 1][0]
+        if comando == 'evolucion':
+            args.desde = input("Ingrese fecha de inicio (YYYY-MM) o presione Enter para omitir: ") or None
+            args.hasta = input("Ingrese fecha de fin (YYYY-MM) o presione Enter para omitir: ") or None
+        elif comando == 'top-clientes':
+            args.n = 10
+        try:
+            GRAFICAS[comando](consultar, args)
+        except ConsultaCancelada as error:
+            print(f"🛑 Consulta {error}")
+        except KeyboardInterrupt:
+            print("\n🛑 Gráfica cancelada")
 
 
 if __name__ == "__main__":
-    df = obtener_datos_portafolio()
-
-    print("\n--- Gráficas disponibles ---")
-    print("1. Portafolio por cliente")
-    print("2. Portafolio por banca")
-    print("3. Portafolio por perfil de riesgo")
-    print("4. Evolución ABA promedio")
-    print("5. Eficiencia de carga de datos")
-    print("6. Top 10 clientes con mayor ABA total")
-    print("7. Activo más y menos invertido dentro de FICs")
-    print("8. Activo más y menos invertido dentro de Renta Variable")
-
-
-    opcion = input("Seleccione una opción (1-8): ")
-    if opcion == '1':
-        grafico_portafolio_cliente(df)
-    elif opcion == '2':
-        grafico_portafolio_banca(df)
-    elif opcion == '3':
-        grafico_portafolio_perfil_riesgo(df)
-    elif opcion == '4':
-        fecha_inicio = input("Ingrese fecha de inicio (YYYY-MM) o presione Enter para omitir: ") or None
-        fecha_fin = input("Ingrese fecha de fin (YYYY-MM) o presione Enter para omitir: ") or None
-        grafico_evolucion_ABA(df, fecha_inicio, fecha_fin)
-    elif opcion == '5':
-        grafico_eficiencia_carga()  
-    elif opcion == '6':
-        grafico_top_clientes_piramide(df)
-    elif opcion == '7':
-        grafico_activo_mas_menos_inversion_fics(df)
-    elif opcion == '8':
-        grafico_activo_mas_menos_inversion_RentaVariable(df)
-
-
-
+    args = crear_parser().parse_args()
+    SALIDA['directorio'] = args.salida
+    SALIDA['formatos'] = tuple(args.formatos.split(','))
+    comando = args.comando or 'menu'
+
+    fuente, origen = abrir_origen(args.parquet, None if args.sin_instantanea else args.instantanea)
+    if comando == 'menu':
+        consultar = consultas_en_segundo_plano(fuente, origen, tiempo_limite=args.tiempo_limite)
     else:
-        print("⚠️ Opción no válida.")
-        
-        
+        consultar = consultas_en_cache(fuente, origen)
+    try:
+        if comando == 'lote':
+            exportar_portafolios_clientes(_portafolio_clientes(consultar), args.directorio, SALIDA['formatos'],
+                                          args.procesos, reanudar=not args.rehacer)
+        elif comando == 'report':
+            generar_reporte(consultar, args)
+        elif comando == 'menu':
+            menu(consultar, args)
+        else:
+            GRAFICAS[comando](consultar, args)
+    finally:
+        if hasattr(consultar, 'cerrar'):
+            consultar.cerrar()
+        cerrar_origen(origen)
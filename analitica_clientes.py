@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+import conexion
+import consultas
+
+# Indicadores por cliente y mes calculados dentro de PostgreSQL con funciones de ventana (sin ciclos por
+# cliente en Python) y guardados en analitica_clientes_mensual:
+#   - mezcla: porcentaje del ABA del mes en cada macroactivo
+#   - variación del ABA frente al mes anterior con datos del cliente (LAG)
+#   - concentración: índice Herfindahl-Hirschman sobre los activos (1 = todo en un activo)
+#   - descalce: puntos porcentuales por encima del máximo que permite el perfil de riesgo a cada macroactivo
+
+RUTA_CLASIFICACION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'macroactivos.json')
+RUTA_LIMITES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perfiles_riesgo.json')
+
+TABLA = 'analitica_clientes_mensual'
+
+
+def _columna(macroactivo):
+    # 'Renta Variable' → pct_renta_variable
+    return 'pct_' + re.sub(r'\W+', '_', macroactivo.lower()).strip('_')
+
+
+def macroactivos_cargados(conn):
+    # Macroactivos que quedaron en los datos cargados (cubo o histórico): la clasificación que de verdad aplicó la
+    # carga, incluidos los de catalogo_activos. Los de macroactivos.json van primero y en su orden
+    fuente = consultas._fuentes(conn, usar_cubo=True)['aba']
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT macroactivo::TEXT FROM {fuente} WHERE macroactivo IS NOT NULL")
+    presentes = {macroactivo for (macroactivo,) in cursor.fetchall()}
+    cursor.close()
+    with open(RUTA_CLASIFICACION, encoding='utf-8') as archivo:
+        orden = [m for m in json.load(archivo)['macroactivos'] if m in presentes]
+    return orden + sorted(presentes - set(orden))
+
+
+def _columnas_mezcla(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s AND column_name LIKE 'pct\\_%%'
+    """, (TABLA,))
+    columnas = {columna for (columna,) in cursor.fetchall()}
+    cursor.close()
+    return columnas
+
+
+def cargar_limites(conn, ruta=RUTA_LIMITES):
+    # Máximo porcentaje por perfil y macroactivo; se guardan en limites_perfil_riesgo para cruzarlos en SQL
+    with open(ruta, encoding='utf-8') as archivo:
+        limites = json.load(archivo)['limites']
+    filas = [(perfil, macroactivo, maximo) for perfil, maximos in limites.items()
+             for macroactivo, maximo in maximos.items()]
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS limites_perfil_riesgo (
+          perfil_riesgo VARCHAR(255),
+          macroactivo VARCHAR(255),
+          porcentaje_maximo FLOAT8
+        )
+    """)
+    cursor.execute("DELETE FROM limites_perfil_riesgo")
+    cursor.executemany("INSERT INTO limites_perfil_riesgo VALUES (%s, %s, %s)", filas)
+    cursor.close()
+    return len(filas)
+
+
+def _pasos(conn, macroactivos, desde=None):
+    # Cada paso se guarda en una tabla temporal con estadísticas. Encadenados como CTE, el planificador
+    # estimaba una fila por unión y elegía ciclos anidados, cuadráticos en el número de cliente-mes
+    fuentes = consultas._fuentes(conn, usar_cubo=False)
+    year, month = fuentes['year'], fuentes['month']
+    mezcla = ''.join(
+        f",\n                   (100 * COALESCE(SUM(aba) FILTER (WHERE macroactivo = %(m{i})s), 0) / NULLIF(SUM(aba), 0))::FLOAT8"
+        f" AS {_columna(macroactivo)}"
+        for i, macroactivo in enumerate(macroactivos))
+    params = {f'm{i}': macroactivo for i, macroactivo in enumerate(macroactivos)}
+    params['desde'] = desde
+    filtro, serie_previos = '', ''
+    if desde is not None:
+        # Solo se leen los meses desde 'desde'; el mes anterior de cada cliente sale de la tabla ya calculada
+        filtro = f"AND {year} * 100 + {month} >= %(desde)s"
+        serie_previos = f"""
+                UNION ALL
+                SELECT * FROM (
+                    SELECT DISTINCT ON (id_sistema_cliente) year, month, id_sistema_cliente, aba_total
+                    FROM {TABLA}
+                    WHERE year * 100 + month < %(desde)s
+                    ORDER BY id_sistema_cliente, year DESC, month DESC
+                ) previos"""
+    # base: una sola lectura del histórico, agrupada por cliente, mes, macroactivo, activo y perfil;
+    # el perfil del mes es el de más filas del cliente
+    pasos = [
+        ('tmp_analitica_base', f"""
+            SELECT {year}::SMALLINT AS year, {month}::SMALLINT AS month, h.id_sistema_cliente,
+                   h.macroactivo::TEXT AS macroactivo, h.cod_activo, h.cod_perfil_riesgo,
+                   SUM(h.aba) AS aba, COUNT(*) AS filas
+            FROM historico_aba_macroactivos h
+            WHERE {year} IS NOT NULL AND {month} IS NOT NULL
+              AND h.id_sistema_cliente IS NOT NULL AND h.aba IS NOT NULL {filtro}
+            GROUP BY 1, 2, 3, 4, 5, 6
+        """),
+        ('tmp_analitica_macro', """
+            SELECT year, month, id_sistema_cliente, macroactivo, SUM(aba) AS aba
+            FROM tmp_analitica_base
+            GROUP BY 1, 2, 3, 4
+        """),
+        ('tmp_analitica_perfil', """
+            SELECT year, month, id_sistema_cliente,
+                   (ARRAY_AGG(cod_perfil_riesgo ORDER BY filas DESC, cod_perfil_riesgo))[1] AS cod_perfil_riesgo
+            FROM (
+                SELECT year, month, id_sistema_cliente, cod_perfil_riesgo, SUM(filas) AS filas
+                FROM tmp_analitica_base
+                WHERE cod_perfil_riesgo IS NOT NULL
+                GROUP BY 1, 2, 3, 4
+            ) perfiles
+            GROUP BY 1, 2, 3
+        """),
+        ('tmp_analitica_cliente_mes', f"""
+            SELECT m.year, m.month, m.id_sistema_cliente, p.perfil_riesgo,
+                   SUM(m.aba)::FLOAT8 AS aba_total{mezcla}
+            FROM tmp_analitica_macro m
+            LEFT JOIN tmp_analitica_perfil perfil USING (year, month, id_sistema_cliente)
+            LEFT JOIN cat_perfil_riesgo p ON perfil.cod_perfil_riesgo = p.cod_perfil_riesgo
+            GROUP BY 1, 2, 3, 4
+        """),
+        ('tmp_analitica_concentracion', """
+            SELECT year, month, id_sistema_cliente,
+                   SUM(POWER(aba / NULLIF(total, 0), 2))::FLOAT8 AS hhi
+            FROM (
+                SELECT year, month, id_sistema_cliente, SUM(aba) AS aba,
+                       SUM(SUM(aba)) OVER (PARTITION BY year, month, id_sistema_cliente) AS total
+                FROM tmp_analitica_base
+                GROUP BY year, month, id_sistema_cliente, cod_activo
+            ) activos
+            GROUP BY 1, 2, 3
+        """),
+        # Cada límite del perfil contra el porcentaje del cliente en ese macroactivo (0 si no tiene)
+        ('tmp_analitica_descalce', """
+            SELECT year, month, id_sistema_cliente,
+                   MAX(porcentaje - porcentaje_maximo)::FLOAT8 AS exceso_limite,
+                   (ARRAY_AGG(macroactivo ORDER BY porcentaje - porcentaje_maximo DESC))[1] AS macroactivo_excedido
+            FROM (
+                SELECT c.year, c.month, c.id_sistema_cliente, l.macroactivo, l.porcentaje_maximo,
+                       100 * COALESCE(m.aba, 0) / NULLIF(c.aba_total, 0) AS porcentaje
+                FROM tmp_analitica_cliente_mes c
+                JOIN limites_perfil_riesgo l ON l.perfil_riesgo = c.perfil_riesgo
+                LEFT JOIN tmp_analitica_macro m ON m.year = c.year AND m.month = c.month
+                                               AND m.id_sistema_cliente = c.id_sistema_cliente
+                                               AND m.macroactivo = l.macroactivo
+            ) limites
+            GROUP BY 1, 2, 3
+        """),
+        ('tmp_analitica_variaciones', f"""
+            SELECT year, month, id_sistema_cliente,
+                   LAG(aba_total) OVER cliente AS aba_anterior,
+                   (year * 12 + month) - LAG(year * 12 + month) OVER cliente AS meses_desde_anterior
+            FROM (
+                SELECT year, month, id_sistema_cliente, aba_total FROM tmp_analitica_cliente_mes{serie_previos}
+            ) serie
+            WINDOW cliente AS (PARTITION BY id_sistema_cliente ORDER BY year, month)
+        """),
+    ]
+    query = """
+        SELECT c.*, v.aba_anterior, v.meses_desde_anterior,
+               k.hhi, d.exceso_limite,
+               CASE WHEN d.exceso_limite > 0 THEN d.macroactivo_excedido END AS macroactivo_excedido,
+               d.exceso_limite > 0 AS descalce,
+               c.aba_total - v.aba_anterior AS variacion_aba,
+               (100 * (c.aba_total - v.aba_anterior) / NULLIF(v.aba_anterior, 0))::FLOAT8 AS variacion_pct
+        FROM tmp_analitica_cliente_mes c
+        JOIN tmp_analitica_variaciones v USING (year, month, id_sistema_cliente)
+        LEFT JOIN tmp_analitica_concentracion k USING (year, month, id_sistema_cliente)
+        LEFT JOIN tmp_analitica_descalce d USING (year, month, id_sistema_cliente)
+    """
+    return pasos, query, params
+
+
+def refrescar(conn, periodos=None):
+    # Sin periodos se reconstruye la tabla; con periodos ('YYYY-MM') se recalculan desde el más antiguo,
+    # porque la variación de los meses siguientes depende de ellos
+    inicio = time.perf_counter()
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (TABLA,))
+    existe = cursor.fetchone()[0]
+    meses = [int(p.rsplit('-', 1)[0]) * 100 + int(p.rsplit('-', 1)[1]) for p in (periodos or [])
+             if p != 'sin_periodo']
+    if periodos is not None and not meses:
+        cursor.close()
+        return 0
+    desde = min(meses) if periodos is not None and existe else None
+    macroactivos = macroactivos_cargados(conn)
+    if desde is not None and _columnas_mezcla(conn) != {_columna(m) for m in macroactivos}:
+        # Apareció o desapareció un macroactivo: cambian las columnas de mezcla y se reconstruye todo
+        desde = None
+
+    cargar_limites(conn)
+    pasos, query, params = _pasos(conn, macroactivos, desde)
+    for temporal, paso in pasos:
+        cursor.execute(f"DROP TABLE IF EXISTS {temporal}")
+        cursor.execute(f"CREATE TEMP TABLE {temporal} AS {paso}", params)
+        cursor.execute(f"ANALYZE {temporal}")
+    if desde is None:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLA}")
+        cursor.execute(f"CREATE TABLE {TABLA} AS {query}")
+        cursor.execute(f"CREATE INDEX idx_{TABLA}_cliente ON {TABLA} (id_sistema_cliente, year, month)")
+        cursor.execute(f"CREATE INDEX idx_{TABLA}_periodo ON {TABLA} (year, month)")
+        # Sin estadísticas el siguiente recálculo incremental elige planes con ciclos anidados
+        cursor.execute(f"ANALYZE {TABLA}")
+    else:
+        cursor.execute(f"DELETE FROM {TABLA} WHERE year * 100 + month >= %s", (desde,))
+        cursor.execute(f"INSERT INTO {TABLA} {query}")
+    for temporal, _ in pasos:
+        cursor.execute(f"DROP TABLE {temporal}")
+    cursor.execute(f"SELECT COUNT(*) FROM {TABLA}")
+    filas = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    alcance = 'completo' if desde is None else f"desde {desde // 100}-{desde % 100:02d}"
+    print(f"🔎 Analítica de clientes actualizada ({alcance}): {filas:,} cliente-mes en "
+          f"{time.perf_counter() - inicio:.2f} s")
+    return filas
+
+
+def leer(conn, cliente=None, periodo=None, solo_descalce=False):
+    condiciones, params = [], {}
+    if cliente is not None:
+        condiciones.append("id_sistema_cliente = %(cliente)s")
+        params['cliente'] = str(cliente)
+    if periodo is not None:
+        condiciones.append("year = %(year)s AND month = %(month)s")
+        params.update(year=int(periodo[0]), month=int(periodo[1]))
+    if solo_descalce:
+        condiciones.append("descalce")
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    query = f"SELECT * FROM {TABLA} {where} ORDER BY id_sistema_cliente, year, month"
+    return pd.read_sql(query, conn, params=params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mezcla, variación, concentración y descalce por cliente y mes")
+    parser.add_argument('--desde', metavar='YYYY-MM', help="Recalcular solo desde ese mes (por defecto, todo)")
+    args = parser.parse_args()
+    with conexion.conexion() as conn:
+        refrescar(conn, [args.desde] if args.desde else None)
+        periodo = consultas.ultimo_periodo(conn)
+        if periodo is not None:
+            df = leer(conn, periodo=periodo)
+            print(f"📅 {int(periodo[0])}-{int(periodo[1]):02d}: {len(df):,} clientes | "
+                  f"{int(df['descalce'].fillna(False).sum()):,} con descalce frente a su perfil | "
+                  f"HHI mediano {df['hhi'].median():.2f}")
@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import json
+import select
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import conexion
+import consultas
+
+# API HTTP de solo lectura con los datos de las gráficas en JSON. Las consultas corren en hilos con
+# conexiones del pool (conexion.py) y las respuestas ya serializadas se guardan en una caché LRU con
+# vencimiento; la caché se vacía cuando el ETL avisa por LISTEN/NOTIFY que terminó una carga.
+
+CONFIG = {'ttl': 300, 'max_entradas': 256}
+
+_cache = OrderedDict()
+# Consultas en curso por llave: las peticiones iguales que llegan mientras tanto esperan el mismo resultado
+_en_curso = {}
+_estado = {'generacion': 0, 'aciertos': 0, 'fallos': 0, 'invalidaciones': 0, 'inicio': time.time()}
+_ejecutor = None
+
+
+class PeticionInvalida(ValueError):
+    pass
+
+
+def _periodo(valor, nombre):
+    if valor is None:
+        return None
+    try:
+        return pd.to_datetime(valor, format='%Y-%m').strftime('%Y-%m')
+    except ValueError:
+        raise PeticionInvalida(f"'{nombre}' debe tener el formato YYYY-MM")
+
+
+def _lista(valor):
+    # banca=Personas,Empresas → ('Empresas', 'Personas'); ordenada para que la llave de caché no dependa del orden
+    if not valor:
+        return None
+    return tuple(sorted({v.strip() for v in valor.split(',') if v.strip()})) or None
+
+
+def _top_n(valor):
+    try:
+        top_n = int(valor or 10)
+    except ValueError:
+        raise PeticionInvalida("'top_n' debe ser un entero")
+    if not 1 <= top_n <= 1000:
+        raise PeticionInvalida("'top_n' debe estar entre 1 y 1000")
+    return top_n
+
+
+def _filtros_top(parametros):
+    periodo = _periodo(parametros.get('periodo'), 'periodo')
+    return {
+        'top_n': _top_n(parametros.get('top_n')),
+        'periodo': tuple(int(parte) for parte in periodo.split('-')) if periodo else None,
+        'bancas': _lista(parametros.get('banca')),
+        'macroactivos': _lista(parametros.get('macroactivo')),
+    }
+
+
+def _filtros(parametros):
+    return {
+        'desde': _periodo(parametros.get('desde'), 'desde'),
+        'hasta': _periodo(parametros.get('hasta'), 'hasta'),
+        'bancas': _lista(parametros.get('banca')),
+        'perfiles': _lista(parametros.get('perfil')),
+    }
+
+
+# Ruta → (parámetros normalizados de la petición, consulta que recibe la conexión y esos parámetros)
+RUTAS = {
+    '/api/portafolio-banca': (
+        _filtros,
+        lambda conn, p: consultas.mezcla_portafolio(conn, 'banca', p['desde'], p['hasta'], p['bancas'], p['perfiles'])),
+    '/api/portafolio-perfil': (
+        _filtros,
+        lambda conn, p: consultas.mezcla_portafolio(conn, 'perfil_riesgo', p['desde'], p['hasta'], p['bancas'],
+                                                    p['perfiles'])),
+    '/api/evolucion-aba': (
+        _filtros,
+        lambda conn, p: consultas.aba_promedio_mensual(conn, p['desde'], p['hasta'], bancas=p['bancas'],
+                                                       perfiles=p['perfiles'])),
+    '/api/top-clientes': (
+        _filtros_top,
+        lambda conn, p: consultas.top_clientes(conn, p['top_n'], p['periodo'], p['bancas'], p['macroactivos'])),
+}
+
+
+def _ejecutar(consulta, parametros):
+    # Corre en un hilo del ejecutor; la conexión vuelve al pool aunque la consulta falle
+    conn = conexion.conexion_consultas()
+    try:
+        df = consulta(conn, parametros)
+    finally:
+        conexion.liberar_conexion(conn)
+    return df.to_json(orient='records', date_format='iso', force_ascii=False).encode('utf-8')
+
+
+def invalidar_cache():
+    _cache.clear()
+    _estado['generacion'] += 1
+    _estado['invalidaciones'] += 1
+    print(f"♻️ Caché invalidada (generación {_estado['generacion']})")
+
+
+async def consultar(ruta, parametros):
+    llave = (ruta, tuple(sorted(parametros.items())))
+    ahora = time.monotonic()
+    entrada = _cache.get(llave)
+    if entrada is not None and entrada[0] > ahora:
+        _cache.move_to_end(llave)
+        _estado['aciertos'] += 1
+        return entrada[1]
+
+    _estado['fallos'] += 1
+    futuro = _en_curso.get(llave)
+    if futuro is None:
+        generacion = _estado['generacion']
+        futuro = asyncio.get_running_loop().run_in_executor(_ejecutor, _ejecutar, RUTAS[ruta][1], parametros)
+        _en_curso[llave] = futuro
+        try:
+            cuerpo = await futuro
+        finally:
+            _en_curso.pop(llave, None)
+        # Un resultado que empezó antes de una invalidación no se guarda: puede traer datos de la carga anterior
+        if generacion == _estado['generacion']:
+            _cache[llave] = (time.monotonic() + CONFIG['ttl'], cuerpo)
+            _cache.move_to_end(llave)
+            while len(_cache) > CONFIG['max_entradas']:
+                _cache.popitem(last=False)
+        return cuerpo
+    return await asyncio.shield(futuro)
+
+
+def _respuesta(estado, cuerpo, mantener):
+    textos = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+              500: 'Internal Server Error'}
+    cabecera = (f"HTTP/1.1 {estado} {textos[estado]}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(cuerpo)}\r\n"
+                f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n")
+    return cabecera.encode('ascii') + cuerpo
+
+
+def _error(mensaje):
+    return json.dumps({'error': mensaje}, ensure_ascii=False).encode('utf-8')
+
+
+async def atender(ruta_completa, metodo):
+    if metodo != 'GET':
+        return 405, _error("Solo se admite GET")
+    url = urlsplit(ruta_completa)
+    if url.path == '/api/salud':
+        cuerpo = {k: v for k, v in _estado.items() if k != 'inicio'}
+        cuerpo.update(entradas=len(_cache), segundos_activo=round(time.time() - _estado['inicio'], 1))
+        return 200, json.dumps(cuerpo).encode('utf-8')
+    if url.path not in RUTAS:
+        return 404, _error(f"Ruta desconocida; disponibles: {', '.join(sorted(RUTAS))}")
+    parametros = {clave: valores[-1] for clave, valores in parse_qs(url.query).items()}
+    try:
+        parametros = RUTAS[url.path][0](parametros)
+        return 200, await consultar(url.path, parametros)
+    except PeticionInvalida as error:
+        return 400, _error(str(error))
+    except Exception as error:
+        print(f"❌ Error en {url.path}: {error}")
+        return 500, _error("Error al consultar la base de datos")
+
+
+async def manejar_conexion(lector, escritor):
+    # HTTP/1.1 con keep-alive: varias peticiones por conexión hasta que el cliente la cierre
+    try:
+        while True:
+            try:
+                encabezado = await lector.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+            lineas = encabezado.decode('latin-1').split('\r\n')
+            partes = lineas[0].split(' ')
+            if len(partes) != 3:
+                break
+            metodo, ruta, version = partes
+            cabeceras = {l.split(':', 1)[0].strip().lower(): l.split(':', 1)[1].strip()
+                         for l in lineas[1:] if ':' in l}
+            mantener = (cabeceras.get('connection', '').lower() != 'close'
+                        and (version == 'HTTP/1.1' or cabeceras.get('connection', '').lower() == 'keep-alive'))
+            estado, cuerpo = await atender(ruta, metodo)
+            escritor.write(_respuesta(estado, cuerpo, mantener))
+            await escritor.drain()
+            if not mantener:
+                break
+    finally:
+        escritor.close()
+
+
+def escuchar_cargas(loop, detener):
+    # Hilo con una conexión propia en LISTEN; cada aviso del ETL vacía la caché en el hilo del servidor
+    while not detener.is_set():
+        try:
+            conn = conexion.conectar()
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {conexion.CANAL_CARGAS}")
+            print(f"👂 Escuchando avisos de carga en '{conexion.CANAL_CARGAS}'")
+            while not detener.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    loop.call_soon_threadsafe(invalidar_cache)
+        except Exception as error:
+            # Sin aviso no se sabe qué cambió: se vacía la caché y se reintenta la conexión
+            print(f"⚠️ Escucha de cargas interrumpida ({error}); reintentando")
+            loop.call_soon_threadsafe(invalidar_cache)
+            detener.wait(5)
+
+
+async def servir(host='127.0.0.1', puerto=8080, hilos=None):
+    global _ejecutor
+    hilos = hilos or conexion.cargar_configuracion()['pool_max']
+    _ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='consulta')
+    detener = threading.Event()
+    threading.Thread(target=escuchar_cargas, args=(asyncio.get_running_loop(), detener), daemon=True).start()
+    servidor = await asyncio.start_server(manejar_conexion, host, puerto)
+    print(f"🌐 API en http://{host}:{puerto} (caché: {CONFIG['max_entradas']} entradas, {CONFIG['ttl']} s)")
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        detener.set()
+        _ejecutor.shutdown(wait=False)
+        conexion.cerrar_pools()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API HTTP con los datos de las gráficas del portafolio BIC")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8080)
+    parser.add_argument('--ttl', type=int, default=CONFIG['ttl'], help="Segundos de vida de cada resultado en caché")
+    parser.add_argument('--max-entradas', type=int, default=CONFIG['max_entradas'])
+    parser.add_argument('--hilos', type=int, default=None, help="Consultas simultáneas (por defecto pool_max)")
+    args = parser.parse_args()
+    CONFIG.update(ttl=args.ttl, max_entradas=args.max_entradas)
+    try:
+        asyncio.run(servir(args.host, args.puerto, args.hilos))
+    except KeyboardInterrupt:
+        print("👋 API detenida")
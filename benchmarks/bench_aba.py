@@ -0,0 +1,86 @@
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+etl = importlib.import_module('CÓDIGOBIC')
+from generar_datos import FORMATOS_ABA
+
+
+def aba_cadena(serie):
+    # Ruta original: dos replace de texto y astype sobre toda la columna
+    return (
+        serie
+        .str.replace(",", ".", regex=False)
+        .str.replace(r"[^\d.]", "", regex=True)
+        .replace('', pd.NA)
+        .astype(float)
+    )
+
+
+def aba_parser(serie):
+    return etl.parsear_aba(serie)[0]
+
+
+def generar_montos(filas, tasa_formatos=0.05, negativos=False, semilla=0):
+    # Montos con coma decimal como en el archivo (un decimal, para que todos los formatos sean exactos),
+    # una parte con miles o moneda, opcionalmente con signo, y algunos nulos
+    rng = np.random.default_rng(semilla)
+    montos = np.round(rng.uniform(-1e6 if negativos else 0, 5e6, filas), 1)
+    serie = pd.Series(pd.Series(montos).map('{:.1f}'.format).str.replace('.', ',', regex=False).to_numpy(dtype=object))
+    sucias = np.flatnonzero(rng.random(filas) < tasa_formatos)
+    formatos = list(FORMATOS_ABA.values())
+    for i, formatear in enumerate(formatos):
+        filas_formato = sucias[sucias % len(formatos) == i]
+        serie.iloc[filas_formato] = [formatear(x) for x in montos[filas_formato]]
+    serie.iloc[rng.choice(filas, filas // 100, replace=False)] = np.nan
+    return serie, montos
+
+
+def medir(funcion, serie):
+    inicio = time.perf_counter()
+    resultado = funcion(serie)
+    return time.perf_counter() - inicio, resultado
+
+
+def comparar(serie, esperado):
+    # Montos leídos igual al valor generado; la cadena original se cae con los separadores de miles
+    nulos = serie.isna().to_numpy()
+    correctos = {}
+    for nombre, funcion in (('cadena', aba_cadena), ('parsear_aba', aba_parser)):
+        try:
+            resultado = funcion(serie).to_numpy(dtype=float)
+            correctos[nombre] = f"{np.sum(resultado[~nulos] == esperado[~nulos]):,}"
+        except ValueError as error:
+            correctos[nombre] = f"error ({error})"
+    return correctos, int(np.sum(~nulos))
+
+
+if __name__ == "__main__":
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    # Rendimiento sobre el formato que ya soportaba la cadena original (coma decimal), por bloques de la carga
+    serie, _ = generar_montos(filas, tasa_formatos=0)
+    segundos_cadena = segundos_parser = 0.0
+    iguales = True
+    for inicio in range(0, filas, etl.CHUNK_SIZE):
+        bloque = serie.iloc[inicio:inicio + etl.CHUNK_SIZE]
+        segundos, cadena = medir(aba_cadena, bloque)
+        segundos_cadena += segundos
+        segundos, parser = medir(aba_parser, bloque)
+        segundos_parser += segundos
+        iguales &= cadena.astype(float).equals(parser)
+
+    print(f"📊 {filas:,} montos ({etl.CHUNK_SIZE:,} por bloque)")
+    print(f"   cadena replace/astype: {segundos_cadena:8.2f} s ({filas / segundos_cadena:,.0f} montos/s)")
+    print(f"   parsear_aba:           {segundos_parser:8.2f} s ({filas / segundos_parser:,.0f} montos/s)")
+    print(f"   aceleración: {segundos_cadena / segundos_parser:.1f}x | resultados iguales: {iguales}")
+
+    # Exactitud con montos sucios: miles, moneda y negativos
+    correctos, total = comparar(*generar_montos(min(filas, etl.CHUNK_SIZE), tasa_formatos=0.2,
+                                                 negativos=True))
+    print(f"   montos sucios correctos de {total:,}: " + ' | '.join(f"{k} {v}" for k, v in correctos.items()))
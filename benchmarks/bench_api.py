@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+# Carga concurrente contra api_bic.py: varios clientes con keep-alive piden una mezcla de rutas y filtros.
+# La primera ronda encuentra la caché fría (la vacía un aviso de carga o un servidor recién iniciado);
+# la segunda repite las mismas peticiones con la caché caliente.
+
+PETICIONES = [
+    '/api/portafolio-banca',
+    '/api/portafolio-perfil',
+    '/api/portafolio-banca?desde=2023-01&hasta=2023-12',
+    '/api/portafolio-perfil?banca=Personas',
+    '/api/portafolio-perfil?banca=Empresas,Personas&desde=2023-06',
+    '/api/evolucion-aba',
+    '/api/evolucion-aba?desde=2023-01&hasta=2023-06',
+    '/api/evolucion-aba?perfil=Agresivo,Moderado',
+    '/api/top-clientes',
+    '/api/top-clientes?top_n=50',
+]
+
+
+async def cliente(host, puerto, rutas, latencias):
+    lector, escritor = await asyncio.open_connection(host, puerto)
+    try:
+        for ruta in rutas:
+            inicio = time.perf_counter()
+            escritor.write(f"GET {ruta} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('ascii'))
+            await escritor.drain()
+            encabezado = await lector.readuntil(b'\r\n\r\n')
+            largo = next(int(l.split(b':', 1)[1]) for l in encabezado.split(b'\r\n')
+                         if l.lower().startswith(b'content-length'))
+            await lector.readexactly(largo)
+            latencias.append(time.perf_counter() - inicio)
+    finally:
+        escritor.close()
+
+
+async def ronda(host, puerto, clientes, por_cliente, semilla):
+    rng = random.Random(semilla)
+    latencias = []
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente(host, puerto, [rng.choice(PETICIONES) for _ in range(por_cliente)], latencias)
+                           for _ in range(clientes)))
+    return np.array(latencias), time.perf_counter() - inicio
+
+
+async def salud(host, puerto):
+    lector, escritor = await asyncio.open_connection(host, puerto)
+    escritor.write(f"GET /api/salud HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode('ascii'))
+    respuesta = await lector.read()
+    escritor.close()
+    return json.loads(respuesta.split(b'\r\n\r\n', 1)[1])
+
+
+def reportar(nombre, latencias, segundos):
+    p50, p95, p99 = np.percentile(latencias * 1000, [50, 95, 99])
+    print(f"   {nombre:<8} {len(latencias):>6,} peticiones en {segundos:6.2f} s "
+          f"({len(latencias) / segundos:8,.0f}/s) | p50 {p50:7.2f} ms | p95 {p95:7.2f} ms | p99 {p99:7.2f} ms")
+
+
+async def main(host, puerto, clientes, por_cliente):
+    print(f"📊 {clientes} clientes × {por_cliente} peticiones contra http://{host}:{puerto}")
+    for nombre in ('fría', 'caliente'):
+        latencias, segundos = await ronda(host, puerto, clientes, por_cliente, semilla=0)
+        reportar(nombre, latencias, segundos)
+    estado = await salud(host, puerto)
+    print(f"   caché: {estado['aciertos']:,} aciertos | {estado['fallos']:,} fallos | {estado['entradas']} entradas")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia de api_bic.py con caché fría y caliente")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8080)
+    parser.add_argument('--clientes', type=int, default=20)
+    parser.add_argument('--peticiones', type=int, default=50, help="Peticiones por cliente en cada ronda")
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.puerto, args.clientes, args.peticiones))
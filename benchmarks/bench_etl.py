@@ -0,0 +1,195 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+etl = importlib.import_module('CÓDIGOBIC')
+import analitica_clientes
+import conexion
+import consultas
+from generar_datos import generar_datos
+
+ARCHIVOS = {
+    'cat_perfil_riesgo': 'cat_perfil_riesgo.csv',
+    'catalogo_activos': 'catalogo_activos.csv',
+    'cat_banca': 'catalogo_banca.csv',
+    'historico_aba_macroactivos': 'historico_aba_macroactivos.csv',
+}
+
+# Ruta de datos de cada gráfica del menú, leyendo del cubo y directamente del histórico
+CONSULTAS = {
+    'portafolio_clientes': lambda conn, cubo: consultas.portafolio_clientes(conn, usar_cubo=cubo),
+    'mezcla_banca': lambda conn, cubo: consultas.mezcla_ultimo_periodo(conn, 'banca', usar_cubo=cubo),
+    'mezcla_perfil_riesgo': lambda conn, cubo: consultas.mezcla_ultimo_periodo(conn, 'perfil_riesgo', usar_cubo=cubo),
+    'aba_promedio_mensual': lambda conn, cubo: consultas.aba_promedio_mensual(conn, usar_cubo=cubo),
+    'ultimo_periodo': lambda conn, cubo: consultas.ultimo_periodo(conn, usar_cubo=cubo),
+    'top_clientes': lambda conn, cubo: consultas.top_clientes(conn, 10, usar_cubo=cubo),
+    'top_clientes_periodo': lambda conn, cubo: consultas.top_clientes(
+        conn, 10, periodo=consultas.ultimo_periodo(conn, cubo), bancas=('Personas',), usar_cubo=cubo),
+    'activos_fics': lambda conn, cubo: consultas.activos_por_macroactivo(conn, 'FICs', usar_cubo=cubo),
+    'activos_renta_variable': lambda conn, cubo: consultas.activos_por_macroactivo(conn, 'Renta Variable',
+                                                                                   usar_cubo=cubo),
+}
+
+
+def medir(funcion, repeticiones=1):
+    # Mediana de varias repeticiones para que un valor atípico no marque una regresión
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def _datos(filas, semilla):
+    directorio = os.path.join(tempfile.gettempdir(), 'bic_bench', f"{filas}_{semilla}")
+    if not os.path.exists(os.path.join(directorio, 'historico_aba_macroactivos.csv')):
+        generar_datos(directorio, filas, semilla=semilla)
+    return directorio
+
+
+def _cargar_sin_reglas(conn, ruta):
+    # Carga previa a mover_nulls: el histórico limpio de formato pero sin aplicar las reglas de calidad
+    clasificacion = etl.cargar_clasificacion_activos(conn)
+    for df in pd.read_csv(ruta, sep=";", dtype=str, chunksize=etl.CHUNK_SIZE):
+        df.columns = [col.strip() for col in df.columns]
+        df = etl.preparar_historico(df, clasificacion).drop(columns=etl.COLUMNAS_AUXILIARES)
+        etl.cargar_dataframe(conn, df, 'historico_aba_macroactivos', acumulado={})
+    conn.commit()
+
+
+# Reglas de calidad de la ruta anterior, aplicadas con SQL sobre el histórico ya cargado. Solo sirven de
+# referencia para medir la ruta actual (REGLAS_CALIDAD en streaming); el ETL ya no las usa
+REGLAS_SQL = [
+    ('pendientes_idCliente', "id_sistema_cliente IS NULL OR LENGTH(id_sistema_cliente) != 11"),
+    ('pendientes_perfil_riesgo', "cod_perfil_riesgo IS NULL"),
+    ('pendientes_month', "ingestion_month IS NULL"),
+    ('pendientes_codActivo', "cod_activo IS NULL"),
+    ('pendientes_codbanca', "cod_banca IS NULL"),
+    ('pendientes_codActivo', "cod_activo = '1022'"),
+]
+
+
+def mover_nulls(conn):
+    # Un INSERT y un DELETE por regla, y los UPDATE finales de año y mes
+    cursor = conn.cursor()
+    for tabla, condicion in REGLAS_SQL:
+        cursor.execute(f"INSERT INTO {tabla} SELECT * FROM historico_aba_macroactivos WHERE {condicion}")
+        cursor.execute(f"DELETE FROM historico_aba_macroactivos WHERE {condicion}")
+    cursor.execute("UPDATE historico_aba_macroactivos SET year = ingestion_year")
+    cursor.execute("UPDATE historico_aba_macroactivos SET ingestion_month = month WHERE ingestion_month = 'NaN'")
+    conn.commit()
+    cursor.close()
+
+
+def bench_tamano(conn, filas, semilla=0, repeticiones=3):
+    directorio = _datos(filas, semilla)
+    resultados = {}
+
+    # Ruta anterior: reglas de calidad en la base con mover_nulls
+    etl.create_tables(conn)
+    _cargar_sin_reglas(conn, os.path.join(directorio, ARCHIVOS['historico_aba_macroactivos']))
+    resultados['mover_nulls'] = medir(lambda: mover_nulls(conn))
+
+    # Ruta actual: reglas en streaming dentro de ingest_csv_data
+    etl.create_tables(conn)
+    for tabla, archivo in ARCHIVOS.items():
+        ruta = os.path.join(directorio, archivo)
+        resultados[f"ingest_csv_data:{tabla}"] = medir(
+            lambda: etl.ingest_csv_data(conn, ruta, tabla, chunk_size=etl.CHUNK_SIZE))
+    resultados['refrescar_cubo'] = medir(lambda: etl.refrescar_cubo(conn))
+    resultados['analitica_clientes'] = medir(lambda: analitica_clientes.refrescar(conn))
+
+    for nombre, consulta in CONSULTAS.items():
+        for cubo in (True, False):
+            medida = f"consulta:{nombre}:{'cubo' if cubo else 'historico'}"
+            resultados[medida] = medir(lambda: consulta(conn, cubo), repeticiones)
+            conn.rollback()
+    return resultados
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, base, umbral=0.10, minimo=0.01):
+    # Devuelve las medidas que empeoraron más que el umbral frente a la ejecución base; diferencias
+    # de menos de `minimo` segundos se consideran ruido
+    regresiones = []
+    print(f"📈 Comparación contra {base.get('commit')} ({base.get('fecha')}):")
+    for tamano, medidas in actual['resultados'].items():
+        for medida, segundos in medidas.items():
+            anterior = base['resultados'].get(tamano, {}).get(medida)
+            if not anterior:
+                continue
+            cambio = segundos / anterior - 1
+            regresion = cambio > umbral and segundos - anterior > minimo
+            marca = '⚠️' if regresion else '  '
+            print(f" {marca} {tamano:>10} {medida:<55} {anterior:9.3f} s → {segundos:9.3f} s ({cambio:+.1%})")
+            if regresion:
+                regresiones.append((tamano, medida, cambio))
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del ETL y de las consultas de las gráficas")
+    parser.add_argument('--tamanos', default='10000,1000000,10000000',
+                        help="Filas del histórico sintético, separadas por coma")
+    parser.add_argument('--base-datos', default='db_bancolombia_bench')
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', default=None, help="Archivo JSON de resultados")
+    parser.add_argument('--comparar', default=None, help="JSON de una ejecución anterior")
+    parser.add_argument('--umbral', type=float, default=0.10, help="Empeoramiento que cuenta como regresión")
+    parser.add_argument('--minimo', type=float, default=0.01, help="Diferencia mínima en segundos para marcarla")
+    args = parser.parse_args()
+
+    conn = etl.create_database(args.base_datos)
+    ejecucion = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_actual(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'resultados': {},
+    }
+    for filas in [int(t) for t in args.tamanos.split(',')]:
+        print(f"🏁 Benchmark con {filas:,} filas")
+        ejecucion['resultados'][str(filas)] = bench_tamano(conn, filas, args.semilla, args.repeticiones)
+    conexion.liberar_conexion(conn)
+
+    salida = args.salida or os.path.join(RAIZ, 'benchmarks', 'resultados',
+                                         f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as archivo:
+        json.dump(ejecucion, archivo, indent=2)
+    print(f"💾 Resultados guardados en '{salida}'")
+
+    for filas, medidas in ejecucion['resultados'].items():
+        print(f"📊 {int(filas):,} filas")
+        for medida, segundos in medidas.items():
+            print(f"   {medida:<55} {segundos:9.3f} s")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            regresiones = comparar(ejecucion, json.load(archivo), args.umbral, args.minimo)
+        if regresiones:
+            print(f"❌ {len(regresiones)} regresión(es) por encima de {args.umbral:.0%}")
+            sys.exit(1)
+        print("✅ Sin regresiones")
@@ -0,0 +1,68 @@
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+etl = importlib.import_module('CÓDIGOBIC')
+
+
+def clasificacion_apply(df):
+    # Ruta original: dos replace y un apply de Python por fila
+    df['cod_activo'] = df['cod_activo'].replace('10007', '1007')
+    df['cod_activo'] = df['cod_activo'].replace('1015', '1115')
+    renta_fija = ['1000', '1001']
+    renta_variable = ['1002', '1003', '1004', '1005', '1011', '1012', '1014', '1115', '1016', '1017']
+    fics = ['1009', '1010', '1007', '1008', '1018', '1019', '1020']
+
+    def clasificar(codigo):
+        if pd.isna(codigo):
+            return None
+        codigo = str(codigo).strip()
+        if codigo in renta_fija:
+            return 'Renta Fija'
+        elif codigo in renta_variable:
+            return 'Renta Variable'
+        elif codigo in fics:
+            return 'FICs'
+        return None
+
+    df['macroactivo'] = df['cod_activo'].apply(clasificar)
+    return df
+
+
+def clasificacion_vectorizada(df):
+    mapa, correcciones = etl.cargar_clasificacion_activos()
+    df = etl.limpiar_columnas(df, correcciones)
+    return etl.asignar_macroactivo(df, mapa)
+
+
+def generar_codigos(filas, semilla=0):
+    codigos = np.array(['1000', '1001', '1002', '1003', '1004', '1005', '1007', '1008', '1009', '1010',
+                        '1011', '1012', '1014', '1015', '1016', '1017', '1018', '1019', '1020', '10007',
+                        '1022', None], dtype=object)
+    rng = np.random.default_rng(semilla)
+    return pd.DataFrame({'cod_activo': codigos[rng.integers(0, len(codigos), filas)]})
+
+
+def medir(funcion, df):
+    inicio = time.perf_counter()
+    resultado = funcion(df.copy())
+    return time.perf_counter() - inicio, resultado
+
+
+if __name__ == "__main__":
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    df = generar_codigos(filas)
+
+    segundos_apply, esperado = medir(clasificacion_apply, df)
+    segundos_vector, obtenido = medir(clasificacion_vectorizada, df)
+
+    iguales = (esperado.fillna('') == obtenido.fillna('')).all().all()
+    print(f"📊 {filas:,} filas")
+    print(f"   apply:       {segundos_apply:8.2f} s ({filas / segundos_apply:,.0f} filas/s)")
+    print(f"   vectorizado: {segundos_vector:8.2f} s ({filas / segundos_vector:,.0f} filas/s)")
+    print(f"   aceleración: {segundos_apply / segundos_vector:.1f}x | resultados iguales: {iguales}")
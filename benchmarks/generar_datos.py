@@ -0,0 +1,114 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+PERFILES = {'1466': 'Conservador', '1467': 'Moderado', '1468': 'Agresivo', '1469': 'Muy Agresivo'}
+BANCAS = {'PN': 'Personas', 'PJ': 'Empresas', 'PP': 'Preferencial'}
+# Catálogo con los códigos ya corregidos; el histórico trae además 10007, 1015 y 1022
+ACTIVOS = ['1000', '1001', '1002', '1003', '1004', '1005', '1007', '1008', '1009', '1010', '1011', '1012',
+           '1014', '1115', '1016', '1017', '1018', '1019', '1020']
+CODIGOS_HISTORICO = ACTIVOS + ['10007', '1015', '1022']
+COLUMNAS_HISTORICO = ['id_sistema_cliente', 'ingestion_year', 'ingestion_month', 'ingestion_day', 'macroactivo',
+                      'cod_activo', 'aba', 'cod_perfil_riesgo', 'cod_banca', 'year', 'month']
+# Errores que se inyectan; cada fila sucia tiene uno solo, repartidos por igual
+ERRORES = ['id_corto', 'perfil_nulo', 'mes_nulo', 'cod_activo_nulo', 'banca_nula', 'aba_nulo', 'aba_invalido']
+# Formatos de monto válidos pero sucios que debe leer parsear_aba, aplicados a una parte de las filas limpias
+FORMATOS_ABA = {
+    'miles': lambda x: f"{x:,.2f}".translate(str.maketrans(',.', '.,')),
+    'moneda': lambda x: ' $ ' + f"{x:,.1f}".translate(str.maketrans(',.', '.,')),
+}
+# Las dos filas con columnas corridas del archivo real: una se realinea y otra queda en pendientes_desalineadas
+FILAS_DESALINEADAS = [
+    ['10032184607', '2024', '5', '10', '', 'Renta Variable', '1002', '12615000', '1468', 'PN', '2024'],
+    ['10071747544', '2024', '3', '14', 'FICs', '1007', '369990,35', 'PN', '2024', '3', ''],
+]
+
+
+def _escribir_catalogos(directorio):
+    pd.DataFrame(list(PERFILES.items()), columns=['cod_perfil_riesgo', 'perfil_riesgo']).to_csv(
+        os.path.join(directorio, 'cat_perfil_riesgo.csv'), sep=';', index=False)
+    pd.DataFrame({'cod_activo': ACTIVOS, 'activo': [f"Activo {c}" for c in ACTIVOS]}).to_csv(
+        os.path.join(directorio, 'catalogo_activos.csv'), sep=';', index=False)
+    pd.DataFrame(list(BANCAS.items()), columns=['cod_banca', 'banca']).to_csv(
+        os.path.join(directorio, 'catalogo_banca.csv'), sep=';', index=False)
+
+
+def _bloque_historico(rng, filas, ids, meses, anio_inicio, tasa_errores):
+    cliente = ids[rng.integers(0, len(ids), filas)]
+    periodo = rng.integers(0, meses, filas)
+    anio = (anio_inicio + periodo // 12).astype(str).astype(object)
+    mes = (periodo % 12 + 1).astype(str).astype(object)
+    # ABA con coma decimal, como en el archivo real
+    aba = pd.Series(np.round(rng.uniform(0, 5e6, filas), 2)).map('{:.2f}'.format).str.replace('.', ',', regex=False)
+    df = pd.DataFrame({
+        'id_sistema_cliente': cliente,
+        'ingestion_year': anio,
+        'ingestion_month': mes.copy(),
+        'ingestion_day': rng.integers(1, 29, filas).astype(str).astype(object),
+        'macroactivo': '',
+        'cod_activo': np.array(CODIGOS_HISTORICO, dtype=object)[rng.integers(0, len(CODIGOS_HISTORICO), filas)],
+        'aba': aba.to_numpy(dtype=object),
+        'cod_perfil_riesgo': np.array(list(PERFILES), dtype=object)[rng.integers(0, len(PERFILES), filas)],
+        'cod_banca': np.array(list(BANCAS), dtype=object)[rng.integers(0, len(BANCAS), filas)],
+        'year': anio,
+        'month': mes,
+    })
+
+    sucias = rng.random(filas) < tasa_errores
+    tipo = rng.integers(0, len(ERRORES), filas)
+    columna_nula = {'perfil_nulo': 'cod_perfil_riesgo', 'mes_nulo': 'ingestion_month',
+                    'cod_activo_nulo': 'cod_activo', 'banca_nula': 'cod_banca', 'aba_nulo': 'aba'}
+    for i, error in enumerate(ERRORES):
+        filas_error = sucias & (tipo == i)
+        if error == 'id_corto':
+            df.loc[filas_error, 'id_sistema_cliente'] = df.loc[filas_error, 'id_sistema_cliente'].str[:9]
+        elif error == 'aba_invalido':
+            df.loc[filas_error, 'aba'] = 'N/D'
+        else:
+            df.loc[filas_error, columna_nula[error]] = ''
+
+    formato = rng.integers(0, len(FORMATOS_ABA), filas)
+    con_formato = ~sucias & (rng.random(filas) < tasa_errores)
+    for i, formatear in enumerate(FORMATOS_ABA.values()):
+        filas_formato = con_formato & (formato == i)
+        montos = df.loc[filas_formato, 'aba'].str.replace(',', '.', regex=False).astype(float)
+        df.loc[filas_formato, 'aba'] = montos.map(formatear)
+    return df
+
+
+def generar_datos(directorio, filas=10_000, clientes=None, meses=24, anio_inicio=2023, tasa_errores=0.05,
+                  semilla=0, tamano_bloque=1_000_000):
+    os.makedirs(directorio, exist_ok=True)
+    _escribir_catalogos(directorio)
+    clientes = clientes or max(10, filas // 20)
+    rng = np.random.default_rng(semilla)
+    # IDs de 11 dígitos
+    ids = (10_000_000_000 + rng.choice(89_999_999_999, clientes, replace=False)).astype(str).astype(object)
+    ruta = os.path.join(directorio, 'historico_aba_macroactivos.csv')
+    with open(ruta, 'w', encoding='utf-8', newline='') as archivo:
+        archivo.write(';'.join(COLUMNAS_HISTORICO) + '\n')
+        # Por bloques para no tener los 10M de filas en memoria a la vez
+        for inicio in range(0, filas, tamano_bloque):
+            bloque = _bloque_historico(rng, min(tamano_bloque, filas - inicio), ids, meses, anio_inicio,
+                                       tasa_errores)
+            bloque.to_csv(archivo, sep=';', index=False, header=False)
+        for fila in FILAS_DESALINEADAS:
+            archivo.write(';'.join(fila) + '\n')
+    print(f"🧪 {filas:,} filas sintéticas (+{len(FILAS_DESALINEADAS)} desalineadas) escritas en '{directorio}'")
+    return directorio
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera los CSV de catálogos e histórico con datos sintéticos")
+    parser.add_argument('directorio')
+    parser.add_argument('--filas', type=int, default=10_000)
+    parser.add_argument('--clientes', type=int, default=None)
+    parser.add_argument('--meses', type=int, default=24)
+    parser.add_argument('--anio-inicio', type=int, default=2023)
+    parser.add_argument('--errores', type=float, default=0.05, help="Fracción de filas con un error inyectado")
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+    generar_datos(args.directorio, args.filas, args.clientes, args.meses, args.anio_inicio, args.errores,
+                  args.semilla)
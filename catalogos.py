@@ -0,0 +1,121 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Caché de los tres catálogos: se leen una vez por base y se guardan como diccionarios código → etiqueta.
+# Las consultas no unen el histórico con las tablas de catálogo: lo cruzan con los códigos del diccionario
+# (una lista VALUES) y reciben el número de la etiqueta en vez del texto, que se pone solo sobre el
+# resultado final. Cada vez que el ETL recarga un catálogo cambia la marca de version_catalogos y la caché
+# se vuelve a leer en la siguiente consulta.
+
+# Catálogo, llave y etiqueta de cada dimensión
+CATALOGOS = {
+    'banca': ('cat_banca', 'cod_banca', 'banca'),
+    'perfil_riesgo': ('cat_perfil_riesgo', 'cod_perfil_riesgo', 'perfil_riesgo'),
+    'activo': ('catalogo_activos', 'cod_activo', 'activo'),
+}
+
+# Base → (marca de versión, diccionarios por dimensión)
+_cache = {}
+_candado = threading.Lock()
+
+
+def crear_tabla_version(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS version_catalogos (
+          actualizado_en TIMESTAMP
+        )
+    """)
+    cursor.close()
+
+
+def registrar_version(conn):
+    # La llama el ETL después de recargar catálogos; la marca es el momento de la carga, no un contador,
+    # para que una base recreada no repita una versión que ya esté en caché
+    crear_tabla_version(conn)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM version_catalogos")
+    cursor.execute("INSERT INTO version_catalogos VALUES (clock_timestamp())")
+    conn.commit()
+    cursor.close()
+
+
+def version(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('version_catalogos') IS NOT NULL")
+    marca = None
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT MAX(actualizado_en)::TEXT FROM version_catalogos")
+        marca = cursor.fetchone()[0]
+    cursor.close()
+    return marca
+
+
+def _leer(conn):
+    diccionarios = {}
+    cursor = conn.cursor()
+    for dimension, (catalogo, llave, etiqueta) in CATALOGOS.items():
+        # Las etiquetas se numeran en el orden de la base, así ORDER BY sobre el número da el mismo orden que
+        # sobre el texto. Los códigos repetidos se conservan: el cruce duplica filas igual que el JOIN
+        cursor.execute(f"""
+            SELECT {llave}, DENSE_RANK() OVER (ORDER BY {etiqueta}) - 1, {etiqueta}
+            FROM {catalogo}
+            WHERE {llave} IS NOT NULL AND {etiqueta} IS NOT NULL
+            ORDER BY 2
+        """)
+        filas = cursor.fetchall()
+        etiquetas = {numero: texto for _, numero, texto in filas}
+        diccionarios[dimension] = {
+            'codigos': [codigo for codigo, _, _ in filas],
+            'numeros': [numero for _, numero, _ in filas],
+            'etiquetas': np.array([etiquetas[i] for i in range(len(etiquetas))], dtype=object),
+        }
+    cursor.close()
+    return diccionarios
+
+
+def diccionarios(conn):
+    # Sin tabla de versión (bases anteriores a esta caché) no hay cómo saber si cambió: se lee siempre
+    base = conn.info.dbname
+    marca = version(conn)
+    with _candado:
+        guardado = _cache.get(base)
+        if marca is not None and guardado is not None and guardado[0] == marca:
+            return guardado[1]
+    leidos = _leer(conn)
+    with _candado:
+        _cache[base] = (marca, leidos)
+    return leidos
+
+
+def invalidar():
+    with _candado:
+        _cache.clear()
+
+
+def cruce(diccionarios, dimension, alias, params, etiquetas=None):
+    # Tabla para unir al histórico en lugar del catálogo: alias.llave es el código y alias.etiqueta el número.
+    # Con etiquetas solo quedan sus códigos (para filtrar con JOIN). Va como VALUES y no como unnest de
+    # arreglos porque con la estimación fija de unnest el planificador recorre el histórico una vez por código
+    _, llave, etiqueta = CATALOGOS[dimension]
+    dic = diccionarios[dimension]
+    filas = []
+    for i, (codigo, numero) in enumerate(zip(dic['codigos'], dic['numeros'])):
+        if etiquetas is None or dic['etiquetas'][numero] in etiquetas:
+            params[f'{alias}_codigo_{i}'], params[f'{alias}_numero_{i}'] = codigo, numero
+            filas.append(f"(%({alias}_codigo_{i})s, %({alias}_numero_{i})s)")
+    if not filas:
+        return f"(SELECT NULL::TEXT, NULL::INTEGER WHERE FALSE) AS {alias}({llave}, {etiqueta})"
+    return f"(VALUES {', '.join(filas)}) AS {alias}({llave}, {etiqueta})"
+
+
+def etiquetar(df, diccionarios, columnas, categorias=False):
+    # Cambia los números por las etiquetas; con categorias=True la columna queda como pd.Categorical
+    # (un entero por fila y cada texto una sola vez) en vez de objetos str repetidos
+    for columna in columnas:
+        numeros = pd.to_numeric(df[columna]).fillna(-1).astype(np.int64).to_numpy()
+        valores = pd.Categorical.from_codes(numeros, categories=diccionarios[columna]['etiquetas'])
+        df[columna] = valores if categorias else np.asarray(valores, dtype=object)
+    return df
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# Valores por defecto; se sobrescriben con el archivo de configuración y luego con variables de entorno
+CONFIG_POR_DEFECTO = {
+    'host': 'localhost',
+    'user': 'postgres',
+    'password': 'password',
+    'port': '5432',
+    'database': 'db_bancolombia',
+    'pool_min': 1,
+    'pool_max': 8,
+    # Milisegundos; 0 = sin límite (cargas del ETL)
+    'statement_timeout': 0,
+    'statement_timeout_consultas': 30000,
+}
+
+RUTA_CONFIGURACION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conexion.json')
+
+# Canal LISTEN/NOTIFY por el que el ETL avisa que terminó una carga (lo escucha api_bic.py)
+CANAL_CARGAS = 'bic_carga_terminada'
+
+_pools = {}
+# Pool de origen de cada conexión prestada, por id de la conexión
+_prestadas = {}
+# Función que recibe las filas leídas hasta el momento, por id de la conexión (ver leer_por_lotes)
+_avances = {}
+_candado = threading.Lock()
+
+
+def cargar_configuracion(ruta=None):
+    config = dict(CONFIG_POR_DEFECTO)
+    ruta = ruta or os.environ.get('BIC_DB_CONFIG', RUTA_CONFIGURACION)
+    if os.path.exists(ruta):
+        with open(ruta, encoding='utf-8') as archivo:
+            config.update(json.load(archivo))
+    for clave in config:
+        valor = os.environ.get(f"BIC_DB_{clave.upper()}")
+        if valor is not None:
+            config[clave] = valor
+    for clave in ('pool_min', 'pool_max', 'statement_timeout', 'statement_timeout_consultas'):
+        config[clave] = int(config[clave])
+    return config
+
+
+def _parametros(config, database, statement_timeout):
+    parametros = {
+        'host': config['host'],
+        'user': config['user'],
+        'password': config['password'],
+        'port': config['port'],
+        'database': database or config['database'],
+    }
+    if statement_timeout:
+        parametros['options'] = f"-c statement_timeout={int(statement_timeout)}"
+    return parametros
+
+
+def conectar(database=None, statement_timeout=None, config=None):
+    # Conexión suelta, para tareas administrativas (p. ej. CREATE DATABASE)
+    config = config or cargar_configuracion()
+    if statement_timeout is None:
+        statement_timeout = config['statement_timeout']
+    return psycopg2.connect(**_parametros(config, database, statement_timeout))
+
+
+def obtener_pool(database=None, statement_timeout=None):
+    config = cargar_configuracion()
+    database = database or config['database']
+    if statement_timeout is None:
+        statement_timeout = config['statement_timeout']
+    llave = (database, int(statement_timeout))
+    with _candado:
+        pool = _pools.get(llave)
+        if pool is None or pool.closed:
+            pool = ThreadedConnectionPool(config['pool_min'], config['pool_max'],
+                                          **_parametros(config, database, statement_timeout))
+            _pools[llave] = pool
+    return pool
+
+
+def obtener_conexion(database=None, statement_timeout=None):
+    pool = obtener_pool(database, statement_timeout)
+    conn = pool.getconn()
+    with _candado:
+        _prestadas[id(conn)] = pool
+    return conn
+
+
+def liberar_conexion(conn):
+    # Devuelve la conexión a su pool (la transacción abierta se descarta); si no viene de un pool se cierra
+    with _candado:
+        pool = _prestadas.pop(id(conn), None)
+    if pool is None or pool.closed:
+        conn.close()
+    else:
+        pool.putconn(conn)
+
+
+def conexion_consultas(database=None):
+    # Conexión con tiempo límite por sentencia, pensada para gráficas y servicios de consulta
+    return obtener_conexion(database, cargar_configuracion()['statement_timeout_consultas'])
+
+
+@contextmanager
+def conexion(database=None, statement_timeout=None):
+    conn = obtener_conexion(database, statement_timeout)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        liberar_conexion(conn)
+
+
+def cerrar_pools():
+    with _candado:
+        for pool in _pools.values():
+            if not pool.closed:
+                pool.closeall()
+        _pools.clear()
+        _prestadas.clear()
+
+
+def notificar_carga(conn, id_ejecucion):
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_notify(%s, %s)", (CANAL_CARGAS, str(id_ejecucion)))
+    conn.commit()
+    cursor.close()
+
+
+def registrar_avance(conn, funcion):
+    # Quien lee con esta conexión avisa a 'funcion' tras cada lote; si la función lanza una excepción
+    # la lectura se interrumpe ahí (así se cancela una consulta que ya está entregando filas)
+    _avances[id(conn)] = funcion
+
+
+def quitar_avance(conn):
+    _avances.pop(id(conn), None)
+
+
+def leer_por_lotes(conn, query, params=None, tamano_lote=50000):
+    # Cursor del lado del servidor: las filas llegan por lotes en vez de cargarse todas en el cliente
+    cursor = conn.cursor(name=f"lectura_{id(conn)}_{threading.get_ident()}")
+    cursor.itersize = tamano_lote
+    avance = _avances.get(id(conn))
+    leidas = 0
+    try:
+        cursor.execute(query, params)
+        filas = cursor.fetchmany(tamano_lote)
+        columnas = [c[0] for c in cursor.description]
+        while True:
+            leidas += len(filas)
+            if avance is not None:
+                avance(leidas)
+            yield pd.DataFrame.from_records(filas, columns=columnas, coerce_float=True)
+            filas = cursor.fetchmany(tamano_lote)
+            if not filas:
+                break
+    finally:
+        cursor.close()
+
+
+def leer_dataframe(conn, query, params=None, tamano_lote=50000):
+    return pd.concat(leer_por_lotes(conn, query, params, tamano_lote), ignore_index=True)
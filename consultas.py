@@ -0,0 +1,257 @@
+import pandas as pd
+
+import catalogos
+import conexion
+
+# Catálogo, llave y etiqueta de cada dimensión por la que se agrupa el portafolio. Los catálogos no se unen
+# en SQL: se cruzan con los diccionarios de catalogos.py y la etiqueta se pone sobre el resultado agregado
+DIMENSIONES = {
+    'banca': catalogos.CATALOGOS['banca'],
+    'perfil_riesgo': catalogos.CATALOGOS['perfil_riesgo'],
+}
+
+
+def _fuentes(conn, usar_cubo):
+    # Tablas agregadas que mantiene el ETL (refrescar_cubo); si no existen se consulta el histórico
+    if usar_cubo:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass('cubo_aba_mensual') IS NOT NULL AND to_regclass('cubo_cliente_mensual') IS NOT NULL")
+        usar_cubo = cursor.fetchone()[0]
+        cursor.close()
+    if usar_cubo:
+        return {'aba': 'cubo_aba_mensual', 'cliente': 'cubo_cliente_mensual',
+                'suma': 'SUM(h.aba_suma)', 'promedio': 'SUM(h.aba_suma) / SUM(h.filas)',
+                'year': 'h.year', 'month': 'h.month'}
+    # En el esquema original year/month no son enteros y se convierten; en el tipado se comparan directo,
+    # igual que en el cubo, para usar los índices y descartar particiones
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = 'historico_aba_macroactivos'::regclass AND attname = 'year'
+    """)
+    tipado = cursor.fetchone()[0] == 'smallint'
+    cursor.close()
+    return {'aba': 'historico_aba_macroactivos', 'cliente': 'historico_aba_macroactivos',
+            'suma': 'SUM(h.aba)', 'promedio': 'AVG(h.aba)',
+            'year': 'h.year' if tipado else 'h.year::INTEGER', 'month': 'h.month' if tipado else 'h.month::INTEGER'}
+
+
+def ultimo_periodo(conn, usar_cubo=True):
+    # Primero el periodo que deja el ETL en ultimo_periodo_cargado (refrescar_cubo); sin esa tabla se busca el máximo
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('ultimo_periodo_cargado') IS NOT NULL")
+    fila = None
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT year, month FROM ultimo_periodo_cargado LIMIT 1")
+        fila = cursor.fetchone()
+    if fila is None:
+        fuentes = _fuentes(conn, usar_cubo)
+        cursor.execute(f"""
+            SELECT year, month FROM {fuentes['aba']}
+            WHERE year IS NOT NULL AND month IS NOT NULL
+            ORDER BY year DESC, month DESC
+            LIMIT 1
+        """)
+        fila = cursor.fetchone()
+    cursor.close()
+    return fila
+
+
+def mezcla_ultimo_periodo(conn, dimension, usar_cubo=True, periodo=None):
+    # periodo (year, month) ya resuelto evita repetir ultimo_periodo cuando varias gráficas lo comparten
+    _, llave, etiqueta = DIMENSIONES[dimension]
+    fuentes = _fuentes(conn, usar_cubo)
+    periodo = periodo or ultimo_periodo(conn, usar_cubo)
+    if periodo is None:
+        return pd.DataFrame(columns=[etiqueta, 'macroactivo', 'aba', 'total', 'porcentaje'])
+    diccionarios = catalogos.diccionarios(conn)
+    params = {'year': int(periodo[0]), 'month': int(periodo[1])}
+    query = f"""
+        SELECT c.{etiqueta}, h.macroactivo::TEXT AS macroactivo,
+               {fuentes['suma']}::FLOAT8 AS aba,
+               SUM({fuentes['suma']}) OVER (PARTITION BY c.{etiqueta})::FLOAT8 AS total
+        FROM {fuentes['aba']} h
+        LEFT JOIN {catalogos.cruce(diccionarios, dimension, 'c', params)} ON h.{llave} = c.{llave}
+        WHERE {fuentes['year']} = %(year)s AND {fuentes['month']} = %(month)s
+          AND c.{etiqueta} IS NOT NULL AND h.macroactivo IS NOT NULL
+        GROUP BY c.{etiqueta}, h.macroactivo
+        ORDER BY c.{etiqueta}, h.macroactivo
+    """
+    df = catalogos.etiquetar(conexion.leer_dataframe(conn, query, params), diccionarios, [etiqueta])
+    df['porcentaje'] = df['aba'] / df['total'] * 100
+    return df
+
+
+def _filtros_catalogo(conn, bancas=None, perfiles=None):
+    # JOIN y condiciones para filtrar por etiqueta de banca y de perfil de riesgo; vacíos si no se filtra.
+    # Las etiquetas se traducen a sus códigos con la caché de catálogos y el histórico se cruza con esos códigos
+    joins, condiciones, params = '', '', {}
+    if bancas or perfiles:
+        diccionarios = catalogos.diccionarios(conn)
+    if bancas:
+        joins += f" JOIN {catalogos.cruce(diccionarios, 'banca', 'fb', params, set(bancas))} ON h.cod_banca = fb.cod_banca"
+    if perfiles:
+        joins += (f" JOIN {catalogos.cruce(diccionarios, 'perfil_riesgo', 'fp', params, set(perfiles))}"
+                  " ON h.cod_perfil_riesgo = fp.cod_perfil_riesgo")
+    return joins, condiciones, params
+
+
+def _numero_periodo(fecha):
+    fecha = pd.to_datetime(fecha)
+    return fecha.year * 100 + fecha.month
+
+
+def mezcla_portafolio(conn, dimension, desde=None, hasta=None, bancas=None, perfiles=None, usar_cubo=True):
+    # Como mezcla_ultimo_periodo, pero sobre un rango de meses ('YYYY-MM'; sin rango, el último periodo)
+    # y con filtros por banca y perfil de riesgo
+    _, llave, etiqueta = DIMENSIONES[dimension]
+    fuentes = _fuentes(conn, usar_cubo)
+    if desde is None and hasta is None:
+        periodo = ultimo_periodo(conn, usar_cubo)
+        if periodo is None:
+            return pd.DataFrame(columns=[etiqueta, 'macroactivo', 'aba', 'total', 'porcentaje'])
+        desde = hasta = f"{int(periodo[0])}-{int(periodo[1]):02d}"
+    joins, condiciones, params = _filtros_catalogo(conn, bancas, perfiles)
+    diccionarios = catalogos.diccionarios(conn)
+    params['desde'] = _numero_periodo(desde) if desde else None
+    params['hasta'] = _numero_periodo(hasta) if hasta else None
+    # year * 100 + month sirve igual en el cubo y en los dos esquemas del histórico
+    query = f"""
+        SELECT c.{etiqueta}, h.macroactivo::TEXT AS macroactivo,
+               {fuentes['suma']}::FLOAT8 AS aba,
+               SUM({fuentes['suma']}) OVER (PARTITION BY c.{etiqueta})::FLOAT8 AS total
+        FROM {fuentes['aba']} h
+        LEFT JOIN {catalogos.cruce(diccionarios, dimension, 'c', params)} ON h.{llave} = c.{llave}{joins}
+        WHERE (%(desde)s::INTEGER IS NULL OR h.year::INTEGER * 100 + h.month::INTEGER >= %(desde)s)
+          AND (%(hasta)s::INTEGER IS NULL OR h.year::INTEGER * 100 + h.month::INTEGER <= %(hasta)s)
+          AND c.{etiqueta} IS NOT NULL AND h.macroactivo IS NOT NULL{condiciones}
+        GROUP BY c.{etiqueta}, h.macroactivo
+        ORDER BY c.{etiqueta}, h.macroactivo
+    """
+    df = catalogos.etiquetar(conexion.leer_dataframe(conn, query, params), diccionarios, [etiqueta])
+    df['porcentaje'] = df['aba'] / df['total'] * 100
+    return df
+
+
+def aba_promedio_mensual(conn, fecha_inicio=None, fecha_fin=None, usar_cubo=True, bancas=None, perfiles=None):
+    fuentes = _fuentes(conn, usar_cubo)
+    joins, condiciones, params = _filtros_catalogo(conn, bancas, perfiles)
+    query = f"""
+        SELECT * FROM (
+            SELECT make_date(CAST(h.year AS INTEGER), CAST(h.month AS INTEGER), 1) AS fecha,
+                   ({fuentes['promedio']})::FLOAT8 AS aba
+            FROM {fuentes['aba']} h{joins}
+            WHERE h.year IS NOT NULL AND h.month IS NOT NULL{condiciones}
+            GROUP BY 1
+        ) mensual
+        WHERE (%(desde)s::DATE IS NULL OR fecha >= %(desde)s::DATE)
+          AND (%(hasta)s::DATE IS NULL OR fecha <= %(hasta)s::DATE)
+        ORDER BY fecha
+    """
+    params['desde'] = pd.to_datetime(fecha_inicio).date() if fecha_inicio else None
+    params['hasta'] = pd.to_datetime(fecha_fin).date() if fecha_fin else None
+    df = conexion.leer_dataframe(conn, query, params)
+    df['fecha'] = pd.to_datetime(df['fecha'])
+    return df
+
+
+def top_clientes(conn, top_n=10, periodo=None, bancas=None, macroactivos=None, usar_cubo=True):
+    # Los top_n clientes con mayor ABA total, de mayor a menor. periodo (year, month) limita a un mes;
+    # bancas y macroactivos filtran por etiqueta. PostgreSQL resuelve ORDER BY ... LIMIT con un top-N heapsort
+    fuentes = _fuentes(conn, usar_cubo)
+    joins, condiciones, params = _filtros_catalogo(conn, bancas)
+    if periodo:
+        condiciones += f" AND {fuentes['year']} = %(year)s AND {fuentes['month']} = %(month)s"
+        params.update(year=int(periodo[0]), month=int(periodo[1]))
+    if macroactivos:
+        condiciones += " AND h.macroactivo::TEXT = ANY(%(macroactivos)s)"
+        params['macroactivos'] = list(macroactivos)
+    params['top_n'] = top_n
+    query = f"""
+        SELECT h.id_sistema_cliente, {fuentes['suma']}::FLOAT8 AS aba
+        FROM {fuentes['cliente']} h{joins}
+        WHERE TRUE{condiciones}
+        GROUP BY h.id_sistema_cliente
+        ORDER BY aba DESC NULLS LAST, h.id_sistema_cliente
+        LIMIT %(top_n)s
+    """
+    return conexion.leer_dataframe(conn, query, params)
+
+
+def activos_por_macroactivo(conn, macroactivo, usar_cubo=True):
+    fuentes = _fuentes(conn, usar_cubo)
+    diccionarios = catalogos.diccionarios(conn)
+    params = {'macroactivo': macroactivo}
+    query = f"""
+        SELECT a.activo, {fuentes['suma']}::FLOAT8 AS aba
+        FROM {fuentes['aba']} h
+        LEFT JOIN {catalogos.cruce(diccionarios, 'activo', 'a', params)} ON h.cod_activo = a.cod_activo
+        WHERE h.macroactivo = %(macroactivo)s AND a.activo IS NOT NULL
+        GROUP BY a.activo
+    """
+    return catalogos.etiquetar(conexion.leer_dataframe(conn, query, params), diccionarios, ['activo'])
+
+
+def portafolio_clientes(conn, usar_cubo=True, periodo=None):
+    # Composición de cada cliente en el último periodo, ya agrupada por macroactivo y activo. Es una fila por
+    # cliente y activo: macroactivo y activo quedan como pd.Categorical en vez de un texto por fila
+    fuentes = _fuentes(conn, usar_cubo)
+    periodo = periodo or ultimo_periodo(conn, usar_cubo)
+    if periodo is None:
+        return pd.DataFrame(columns=['id_sistema_cliente', 'macroactivo', 'activo', 'aba'])
+    diccionarios = catalogos.diccionarios(conn)
+    params = {'year': int(periodo[0]), 'month': int(periodo[1])}
+    query = f"""
+        SELECT h.id_sistema_cliente, h.macroactivo::TEXT AS macroactivo, a.activo,
+               {fuentes['suma']}::FLOAT8 AS aba
+        FROM {fuentes['cliente']} h
+        LEFT JOIN {catalogos.cruce(diccionarios, 'activo', 'a', params)} ON h.cod_activo = a.cod_activo
+        WHERE {fuentes['year']} = %(year)s AND {fuentes['month']} = %(month)s
+          AND h.macroactivo IS NOT NULL AND a.activo IS NOT NULL
+        GROUP BY h.id_sistema_cliente, h.macroactivo, a.activo
+        ORDER BY h.id_sistema_cliente
+    """
+    df = catalogos.etiquetar(conexion.leer_dataframe(conn, query, params), diccionarios, ['activo'], categorias=True)
+    df['macroactivo'] = df['macroactivo'].astype('category')
+    return df
+
+
+def eficiencia_carga(conn):
+    # Filas del histórico que entraron a las reglas de calidad y las que quedaron, según la última ejecución del ETL
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('metricas_ejecucion') IS NOT NULL")
+    existe = cursor.fetchone()[0]
+    cursor.close()
+    if not existe:
+        return pd.DataFrame(columns=['id_ejecucion', 'inicio', 'originales', 'conservados'])
+    query = """
+        SELECT id_ejecucion, MAX(inicio) AS inicio,
+               MAX(filas_entrada)::BIGINT AS originales,
+               (MAX(filas_entrada) - SUM(filas_rechazadas))::BIGINT AS conservados
+        FROM metricas_ejecucion
+        WHERE etapa LIKE 'regla:%%'
+          AND id_ejecucion = (
+              SELECT id_ejecucion FROM metricas_ejecucion
+              WHERE etapa LIKE 'regla:%%'
+              ORDER BY inicio DESC
+              LIMIT 1
+          )
+        GROUP BY id_ejecucion
+    """
+    return conexion.leer_dataframe(conn, query, ())
+
+
+def perfil_calidad(conn):
+    # Indicadores de calidad de la última ejecución del ETL que leyó datos (tabla perfil_calidad)
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('perfil_calidad') IS NOT NULL")
+    existe = cursor.fetchone()[0]
+    cursor.close()
+    if not existe:
+        return pd.DataFrame(columns=['id_ejecucion', 'inicio', 'tabla', 'columna', 'indicador', 'valor', 'detalle'])
+    query = """
+        SELECT id_ejecucion, inicio, tabla, columna, indicador, valor, detalle
+        FROM perfil_calidad
+        WHERE id_ejecucion = (SELECT id_ejecucion FROM perfil_calidad ORDER BY inicio DESC LIMIT 1)
+    """
+    return conexion.leer_dataframe(conn, query, ())
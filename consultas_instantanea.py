@@ -0,0 +1,213 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import catalogos
+import conexion
+import consultas
+
+# Mismas funciones que consultas.py sobre la instantánea que deja el ETL (CÓDIGOBIC.exportar_instantanea):
+# el histórico unido a los catálogos y agregado por periodo, cliente, banca, perfil, macroactivo y activo,
+# con un archivo .npy por columna. Los textos van como códigos enteros con su diccionario en otro .npy, y
+# todo se abre con np.load(mmap_mode='r'): no se copia a memoria ni se reconstruye un DataFrame.
+# Las filas están ordenadas por periodo y el manifiesto guarda dónde empieza y termina cada uno, así que
+# una consulta de un mes lee solo ese tramo. Las agregaciones son np.bincount sobre los códigos.
+
+RUTA_INSTANTANEA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instantanea')
+VERSION = 1
+MANIFIESTO = 'manifiesto.json'
+
+# Columna → tipo en disco; las de texto guardan el código y -1 para nulo. year/month nulos también van como -1
+COLUMNAS = {
+    'year': np.int16,
+    'month': np.int16,
+    'id_sistema_cliente': np.int32,
+    'banca': np.int16,
+    'perfil_riesgo': np.int16,
+    'macroactivo': np.int16,
+    'activo': np.int32,
+    'aba_suma': np.float64,
+    'filas': np.int32,
+}
+COLUMNAS_TEXTO = ['id_sistema_cliente', 'banca', 'perfil_riesgo', 'macroactivo', 'activo']
+
+DIMENSIONES = {
+    'banca': 'banca',
+    'perfil_riesgo': 'perfil_riesgo',
+}
+
+# Directorio → ((marca de la carga, versión de catálogos), manifiesto, columnas y diccionarios mapeados); se abre
+# una vez por proceso
+_abiertas = {}
+
+
+def marca_carga(conn):
+    # Momento del último refresco del cubo (refrescar_cubo); cambia con cada carga que modifica datos
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('ultimo_periodo_cargado') IS NOT NULL")
+    marca = None
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT MAX(actualizado_en)::TEXT FROM ultimo_periodo_cargado")
+        marca = cursor.fetchone()[0]
+    cursor.close()
+    return marca
+
+
+def leer_manifiesto(directorio):
+    try:
+        with open(os.path.join(directorio, MANIFIESTO), encoding='utf-8') as archivo:
+            manifiesto = json.load(archivo)
+    except (OSError, ValueError):
+        return None
+    return manifiesto if manifiesto.get('version') == VERSION else None
+
+
+def vigente(directorio, conn):
+    # La instantánea sirve si corresponde a la última carga de la base y a la versión de sus catálogos: una
+    # carga que solo recarga catálogos no cambia la marca, pero sí las etiquetas guardadas como diccionario
+    manifiesto = leer_manifiesto(directorio)
+    return (manifiesto is not None and manifiesto['marca'] is not None and manifiesto['marca'] == marca_carga(conn)
+            and manifiesto.get('catalogos') == catalogos.version(conn))
+
+
+def _abrir(directorio):
+    abierta = _abiertas.get(directorio)
+    manifiesto = leer_manifiesto(directorio)
+    if manifiesto is None:
+        raise FileNotFoundError(f"No hay una instantánea válida en '{directorio}'")
+    if abierta is None or abierta[0] != (manifiesto['marca'], manifiesto.get('catalogos')):
+        columnas = {col: np.load(os.path.join(directorio, f"{col}.npy"), mmap_mode='r') for col in COLUMNAS}
+        diccionarios = {col: np.load(os.path.join(directorio, f"diccionario_{col}.npy"), mmap_mode='r')
+                        for col in COLUMNAS_TEXTO}
+        abierta = ((manifiesto['marca'], manifiesto.get('catalogos')), manifiesto, columnas, diccionarios)
+        _abiertas[directorio] = abierta
+    return abierta[1:]
+
+
+def _codigos(diccionario, etiquetas):
+    return np.flatnonzero(np.isin(diccionario, list(etiquetas)))
+
+
+def _tramo(manifiesto, periodo):
+    # Filas del periodo: un slice sobre los arreglos mapeados, sin recorrer los demás meses
+    inicio, fin = manifiesto['periodos'].get(f"{int(periodo[0])}-{int(periodo[1])}", (0, 0))
+    return slice(inicio, fin)
+
+
+def ultimo_periodo(directorio):
+    # Guardado en el manifiesto al exportar: no se lee ningún arreglo
+    periodo = _abrir(directorio)[0]['ultimo_periodo']
+    return tuple(periodo) if periodo else None
+
+
+def mezcla_ultimo_periodo(directorio, dimension, periodo=None):
+    etiqueta = DIMENSIONES[dimension]
+    manifiesto, columnas, diccionarios = _abrir(directorio)
+    periodo = periodo or ultimo_periodo(directorio)
+    if periodo is None:
+        return pd.DataFrame(columns=[etiqueta, 'macroactivo', 'aba', 'total', 'porcentaje'])
+    tramo = _tramo(manifiesto, periodo)
+    grupo, macro = columnas[etiqueta][tramo], columnas['macroactivo'][tramo]
+    filtro = (grupo >= 0) & (macro >= 0)
+    n_macro = len(diccionarios['macroactivo'])
+    llave = grupo[filtro].astype(np.int64) * n_macro + macro[filtro]
+    presentes = np.flatnonzero(np.bincount(llave))
+    aba = np.bincount(llave, weights=columnas['aba_suma'][tramo][filtro])[presentes]
+    df = pd.DataFrame({
+        etiqueta: diccionarios[etiqueta][presentes // n_macro],
+        'macroactivo': diccionarios['macroactivo'][presentes % n_macro],
+        'aba': aba,
+    }).sort_values([etiqueta, 'macroactivo'], ignore_index=True)
+    df['total'] = df.groupby(etiqueta)['aba'].transform('sum')
+    df['porcentaje'] = df['aba'] / df['total'] * 100
+    return df
+
+
+def aba_promedio_mensual(directorio, fecha_inicio=None, fecha_fin=None):
+    # Un tramo por mes: suma y filas de cada uno, en orden de periodo
+    manifiesto, columnas, _ = _abrir(directorio)
+    tramos = manifiesto['periodos'].items()
+    df = pd.DataFrame({
+        'fecha': pd.to_datetime([f"{periodo}-01" for periodo, _ in tramos]),
+        'aba': [columnas['aba_suma'][inicio:fin].sum() / columnas['filas'][inicio:fin].sum()
+                for _, (inicio, fin) in tramos],
+    })
+    if fecha_inicio:
+        df = df[df['fecha'] >= pd.to_datetime(fecha_inicio)]
+    if fecha_fin:
+        df = df[df['fecha'] <= pd.to_datetime(fecha_fin)]
+    return df.reset_index(drop=True)
+
+
+def top_clientes(directorio, top_n=10, periodo=None, bancas=None, macroactivos=None):
+    manifiesto, columnas, diccionarios = _abrir(directorio)
+    tramo = _tramo(manifiesto, periodo) if periodo else slice(None)
+    clientes = columnas['id_sistema_cliente'][tramo]
+    filtro = clientes >= 0
+    if bancas:
+        filtro &= np.isin(columnas['banca'][tramo], _codigos(diccionarios['banca'], bancas))
+    if macroactivos:
+        filtro &= np.isin(columnas['macroactivo'][tramo], _codigos(diccionarios['macroactivo'], macroactivos))
+    total = len(diccionarios['id_sistema_cliente'])
+    presentes = np.flatnonzero(np.bincount(clientes[filtro], minlength=total))
+    aba = np.bincount(clientes[filtro], weights=columnas['aba_suma'][tramo][filtro], minlength=total)[presentes]
+    if len(aba) > top_n:
+        # argpartition elige el corte sin ordenar a todos; los empates en el corte se conservan para desempatar
+        corte = aba[np.argpartition(-aba, top_n - 1)[top_n - 1]]
+        presentes, aba = presentes[aba >= corte], aba[aba >= corte]
+    df = pd.DataFrame({
+        'id_sistema_cliente': diccionarios['id_sistema_cliente'][presentes],
+        'aba': aba,
+    })
+    return df.sort_values(['aba', 'id_sistema_cliente'], ascending=[False, True], ignore_index=True).head(top_n)
+
+
+def activos_por_macroactivo(directorio, macroactivo):
+    _, columnas, diccionarios = _abrir(directorio)
+    activos = columnas['activo']
+    filtro = np.isin(columnas['macroactivo'], _codigos(diccionarios['macroactivo'], [macroactivo])) & (activos >= 0)
+    presentes = np.flatnonzero(np.bincount(activos[filtro]))
+    aba = np.bincount(activos[filtro], weights=columnas['aba_suma'][filtro])[presentes]
+    return pd.DataFrame({'activo': diccionarios['activo'][presentes], 'aba': aba})
+
+
+def portafolio_clientes(directorio, periodo=None):
+    manifiesto, columnas, diccionarios = _abrir(directorio)
+    periodo = periodo or ultimo_periodo(directorio)
+    if periodo is None:
+        return pd.DataFrame(columns=['id_sistema_cliente', 'macroactivo', 'activo', 'aba'])
+    tramo = _tramo(manifiesto, periodo)
+    macro, activos = columnas['macroactivo'][tramo], columnas['activo'][tramo]
+    filtro = (macro >= 0) & (activos >= 0)
+    n_macro = len(diccionarios['macroactivo'])
+    n_activos = len(diccionarios['activo'])
+    llave = ((columnas['id_sistema_cliente'][tramo][filtro].astype(np.int64) * n_macro + macro[filtro]) * n_activos
+             + activos[filtro])
+    llaves, grupos = np.unique(llave, return_inverse=True)
+    aba = np.bincount(grupos, weights=columnas['aba_suma'][tramo][filtro])
+    df = pd.DataFrame({
+        'id_sistema_cliente': diccionarios['id_sistema_cliente'][llaves // (n_macro * n_activos)],
+        'macroactivo': diccionarios['macroactivo'][llaves // n_activos % n_macro],
+        'activo': diccionarios['activo'][llaves % n_activos],
+        'aba': aba,
+    })
+    return df.sort_values('id_sistema_cliente', kind='stable', ignore_index=True)
+
+
+def _en_base(consulta):
+    conn = conexion.conexion_consultas()
+    try:
+        return consulta(conn)
+    finally:
+        conexion.liberar_conexion(conn)
+
+
+def eficiencia_carga(directorio):
+    # Las métricas y el perfil de calidad de las cargas solo viven en PostgreSQL: estas consultas sí van a la base
+    return _en_base(consultas.eficiencia_carga)
+
+
+def perfil_calidad(directorio):
+    return _en_base(consultas.perfil_calidad)
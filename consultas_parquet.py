@@ -0,0 +1,106 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Mismas funciones que consultas.py, leyendo la copia Parquet del histórico (CÓDIGOBIC.exportar_parquet)
+# en vez de PostgreSQL: el primer argumento es el directorio del dataset en lugar de la conexión.
+# Cada consulta pide solo sus columnas y filtra por partición (year/month) antes de leer.
+
+PARTICIONES = ds.partitioning(pa.schema([('year', pa.int16()), ('month', pa.int16())]), flavor='hive')
+
+DIMENSIONES = {
+    'banca': 'banca',
+    'perfil_riesgo': 'perfil_riesgo',
+}
+
+
+def _dataset(directorio):
+    return ds.dataset(directorio, format='parquet', partitioning=PARTICIONES)
+
+
+def _leer(directorio, columnas, filtro=None):
+    return _dataset(directorio).to_table(columns=columnas, filter=filtro).to_pandas()
+
+
+def ultimo_periodo(directorio):
+    # Se resuelve con las claves de partición, sin leer datos
+    periodos = [ds.get_partition_keys(f.partition_expression) for f in _dataset(directorio).get_fragments()]
+    periodos = [(p['year'], p['month']) for p in periodos if p.get('year') is not None and p.get('month') is not None]
+    return max(periodos) if periodos else None
+
+
+def _filtro_periodo(periodo):
+    return (ds.field('year') == periodo[0]) & (ds.field('month') == periodo[1])
+
+
+def mezcla_ultimo_periodo(directorio, dimension, periodo=None):
+    etiqueta = DIMENSIONES[dimension]
+    periodo = periodo or ultimo_periodo(directorio)
+    if periodo is None:
+        return pd.DataFrame(columns=[etiqueta, 'macroactivo', 'aba', 'total', 'porcentaje'])
+    filtro = _filtro_periodo(periodo) & ds.field(etiqueta).is_valid() & ds.field('macroactivo').is_valid()
+    df = _leer(directorio, [etiqueta, 'macroactivo', 'aba'], filtro)
+    df = (df.groupby([etiqueta, 'macroactivo'], observed=True)['aba'].sum(min_count=1)
+          .reset_index().astype({etiqueta: str, 'macroactivo': str})
+          .sort_values([etiqueta, 'macroactivo'], ignore_index=True))
+    df['total'] = df.groupby(etiqueta)['aba'].transform('sum')
+    df['porcentaje'] = df['aba'] / df['total'] * 100
+    return df
+
+
+def aba_promedio_mensual(directorio, fecha_inicio=None, fecha_fin=None):
+    filtro = ds.field('year').is_valid() & ds.field('month').is_valid()
+    df = _leer(directorio, ['year', 'month', 'aba'], filtro)
+    df = df.groupby(['year', 'month'])['aba'].mean().reset_index()
+    df['fecha'] = pd.to_datetime(dict(year=df['year'], month=df['month'], day=1))
+    if fecha_inicio:
+        df = df[df['fecha'] >= pd.to_datetime(fecha_inicio)]
+    if fecha_fin:
+        df = df[df['fecha'] <= pd.to_datetime(fecha_fin)]
+    return df[['fecha', 'aba']].sort_values('fecha', ignore_index=True)
+
+
+def top_clientes(directorio, top_n=10, periodo=None, bancas=None, macroactivos=None):
+    # Los filtros se aplican al leer (partición y columnas); nlargest elige los top_n sin ordenar a todos los clientes
+    filtro = ds.field('id_sistema_cliente').is_valid()
+    if periodo:
+        filtro &= _filtro_periodo(periodo)
+    if bancas:
+        filtro &= ds.field('banca').isin(list(bancas))
+    if macroactivos:
+        filtro &= ds.field('macroactivo').isin(list(macroactivos))
+    df = _leer(directorio, ['id_sistema_cliente', 'aba'], filtro)
+    df = df.groupby('id_sistema_cliente', observed=True)['aba'].sum(min_count=1).reset_index()
+    df['id_sistema_cliente'] = df['id_sistema_cliente'].astype(str)
+    # keep='all' conserva los empates del corte; se desempatan por cliente igual que consultas.top_clientes
+    df = df.nlargest(top_n, 'aba', keep='all')
+    return df.sort_values(['aba', 'id_sistema_cliente'], ascending=[False, True], ignore_index=True).head(top_n)
+
+
+def activos_por_macroactivo(directorio, macroactivo):
+    filtro = (ds.field('macroactivo') == macroactivo) & ds.field('activo').is_valid()
+    df = _leer(directorio, ['activo', 'aba'], filtro)
+    df = df.groupby('activo', observed=True)['aba'].sum(min_count=1).reset_index()
+    return df.astype({'activo': str})
+
+
+def portafolio_clientes(directorio, periodo=None):
+    periodo = periodo or ultimo_periodo(directorio)
+    if periodo is None:
+        return pd.DataFrame(columns=['id_sistema_cliente', 'macroactivo', 'activo', 'aba'])
+    filtro = _filtro_periodo(periodo) & ds.field('macroactivo').is_valid() & ds.field('activo').is_valid()
+    df = _leer(directorio, ['id_sistema_cliente', 'macroactivo', 'activo', 'aba'], filtro)
+    df = (df.groupby(['id_sistema_cliente', 'macroactivo', 'activo'], observed=True)['aba'].sum(min_count=1)
+          .reset_index())
+    df = df.astype({'id_sistema_cliente': str, 'macroactivo': str, 'activo': str})
+    return df.sort_values('id_sistema_cliente', ignore_index=True)
+
+
+def eficiencia_carga(directorio):
+    # Las métricas de carga solo viven en PostgreSQL (metricas_ejecucion)
+    return pd.DataFrame(columns=['id_ejecucion', 'inicio', 'originales', 'conservados'])
+
+
+def perfil_calidad(directorio):
+    # El perfil de calidad de las cargas solo vive en PostgreSQL (perfil_calidad)
+    return pd.DataFrame(columns=['id_ejecucion', 'inicio', 'tabla', 'columna', 'indicador', 'valor', 'detalle'])
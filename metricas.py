@@ -0,0 +1,130 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Acumulado por (etapa, tabla) de la ejecución en curso; cada proceso lleva el suyo
+CAMPOS = ['llamadas', 'segundos', 'cpu_segundos', 'memoria_pico_mb', 'filas_entrada', 'filas_salida',
+          'filas_rechazadas']
+
+_registro = {}
+_ejecucion = {'id': None, 'inicio': None}
+_candado = threading.Lock()
+
+
+def iniciar_ejecucion():
+    reiniciar()
+    inicio = datetime.now()
+    _ejecucion['id'] = inicio.strftime('%Y%m%d%H%M%S%f')
+    _ejecucion['inicio'] = inicio
+    return _ejecucion['id']
+
+
+def ejecucion():
+    return _ejecucion['id'], _ejecucion['inicio']
+
+
+def reiniciar():
+    with _candado:
+        _registro.clear()
+
+
+def memoria_pico_mb():
+    # Máximo de memoria residente del proceso hasta el momento (bytes en macOS, KB en Linux)
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 2**20 if sys.platform == 'darwin' else pico / 2**10
+
+
+def registrar(etapa, tabla=None, **valores):
+    with _candado:
+        actual = _registro.setdefault((etapa, tabla), dict.fromkeys(CAMPOS))
+        for campo, valor in valores.items():
+            if valor is None:
+                continue
+            if campo == 'memoria_pico_mb':
+                actual[campo] = max(actual[campo] or 0, valor)
+            else:
+                actual[campo] = (actual[campo] or 0) + valor
+
+
+@contextmanager
+def etapa(nombre, tabla=None):
+    # Quien mide llena filas_entrada / filas_salida / filas_rechazadas en el diccionario que recibe
+    contadores = {}
+    inicio = time.perf_counter()
+    inicio_cpu = time.thread_time()
+    try:
+        yield contadores
+    finally:
+        registrar(nombre, tabla, llamadas=1, segundos=time.perf_counter() - inicio,
+                  cpu_segundos=time.thread_time() - inicio_cpu, memoria_pico_mb=memoria_pico_mb(),
+                  **contadores)
+
+
+def exportar():
+    with _candado:
+        return [{'etapa': etapa, 'tabla': tabla, **valores} for (etapa, tabla), valores in _registro.items()]
+
+
+def combinar(filas):
+    # Suma lo medido en otro proceso (p. ej. los trabajadores de la ingesta paralela)
+    for fila in filas:
+        fila = dict(fila)
+        registrar(fila.pop('etapa'), fila.pop('tabla'), **fila)
+
+
+def guardar(conn):
+    filas = exportar()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT INTO metricas_ejecucion (id_ejecucion, inicio, etapa, tabla, llamadas, segundos, cpu_segundos,
+                                        memoria_pico_mb, filas_entrada, filas_salida, filas_rechazadas)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, [(_ejecucion['id'], _ejecucion['inicio'], f['etapa'], f['tabla'], *(f[c] for c in CAMPOS)) for f in filas])
+    conn.commit()
+    cursor.close()
+    print(f"📊 {len(filas)} métrica(s) guardadas en 'metricas_ejecucion' (ejecución {_ejecucion['id']})")
+
+
+def escribir_json(ruta):
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump({'id_ejecucion': _ejecucion['id'],
+                   'inicio': _ejecucion['inicio'].isoformat() if _ejecucion['inicio'] else None,
+                   'etapas': exportar()}, archivo, ensure_ascii=False, indent=2)
+    print(f"📊 Métricas escritas en '{ruta}'")
+
+
+def escribir_prometheus(ruta):
+    # Formato textfile del node_exporter: una serie por campo con etiquetas etapa/tabla
+    lineas = []
+    filas = exportar()
+    for campo in CAMPOS:
+        lineas.append(f"# TYPE bic_etl_{campo} gauge")
+        for fila in filas:
+            if fila[campo] is None:
+                continue
+            etiquetas = f'etapa="{fila["etapa"]}",tabla="{fila["tabla"] or ""}"'
+            lineas.append(f"bic_etl_{campo}{{{etiquetas}}} {fila[campo]}")
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        archivo.write('\n'.join(lineas) + '\n')
+    print(f"📊 Métricas escritas en '{ruta}'")
+
+
+def imprimir_resumen():
+    print("📊 Métricas por etapa:")
+    for fila in exportar():
+        nombre = f"{fila['etapa']} [{fila['tabla']}]" if fila['tabla'] else fila['etapa']
+        filas = f"{fila['filas_entrada'] or 0} → {fila['filas_salida'] or 0}"
+        if fila['filas_rechazadas']:
+            filas += f" ({fila['filas_rechazadas']} a pendientes)"
+        print(f"   {nombre:<50} {fila['segundos'] or 0:8.3f} s | CPU {fila['cpu_segundos'] or 0:8.3f} s | "
+              f"pico {fila['memoria_pico_mb'] or 0:8.1f} MB | filas {filas}")
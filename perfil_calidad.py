@@ -0,0 +1,281 @@
+import json
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Perfil de calidad de cada ejecución del ETL, acumulado bloque a bloque mientras se limpia el CSV (sin
+# releer el archivo ni las tablas pendientes):
+#   - filas y nulos por columna
+#   - cardinalidad: exacta para los códigos y periodos (se cuentan las filas por valor) y con HyperLogLog
+#     para el resto, como el id de cliente
+#   - códigos del histórico que no están en su catálogo, cruzados al guardar con los catálogos ya cargados
+#   - distribución del ABA con un sketch de error relativo (~1 %): cuántiles sin guardar los montos
+#   - filas enviadas a pendientes por cada regla de calidad
+# Todo es combinable: los procesos de la ingesta paralela devuelven su parte y se suma en el principal.
+
+# Columnas con conteo exacto por valor; las que tienen catálogo se validan contra él al guardar
+COLUMNAS_EXACTAS = {
+    'historico_aba_macroactivos': ['macroactivo', 'cod_activo', 'cod_perfil_riesgo', 'cod_banca',
+                                   'ingestion_year', 'ingestion_month', 'ingestion_day', 'year', 'month'],
+    'catalogo_activos': ['cod_activo'],
+    'cat_banca': ['cod_banca'],
+    'cat_perfil_riesgo': ['cod_perfil_riesgo'],
+}
+CATALOGOS = {
+    'cod_activo': ('catalogo_activos', 'cod_activo'),
+    'cod_banca': ('cat_banca', 'cod_banca'),
+    'cod_perfil_riesgo': ('cat_perfil_riesgo', 'cod_perfil_riesgo'),
+}
+# Columnas de preparar_historico que no vienen del archivo
+COLUMNAS_IGNORADAS = ['motivo', 'aba_original']
+# Montos: solo nulos y distribución, no cardinalidad
+COLUMNAS_MONTO = ['aba']
+
+BITS_HLL = 14
+# Base del sketch del ABA: cada cubeta cubre montos que difieren a lo sumo 1 % de su valor representativo
+GAMMA = 1.01 / 0.99
+CUANTILES = [0.01, 0.25, 0.5, 0.75, 0.99]
+# Ejemplos de códigos desconocidos que se guardan por columna (los de más filas)
+MAXIMO_EJEMPLOS = 20
+
+# Tabla → perfil acumulado en este proceso
+_perfiles = {}
+_candado = threading.Lock()
+
+
+def reiniciar():
+    with _candado:
+        _perfiles.clear()
+
+
+def _nuevo():
+    return {'filas': 0, 'nulos': {}, 'valores': {}, 'hll': {}, 'reglas': {},
+            'aba': {'positivos': {}, 'negativos': {}, 'ceros': 0, 'suma': 0.0, 'minimo': None, 'maximo': None}}
+
+
+def _registros_hll(serie):
+    # Cada hash de 64 bits: los primeros BITS_HLL eligen el registro y el resto aporta la posición de su primer 1
+    hashes = pd.util.hash_pandas_object(serie, index=False).to_numpy()
+    indices = (hashes >> np.uint64(64 - BITS_HLL)).astype(np.intp)
+    resto = hashes << np.uint64(BITS_HLL)
+    # Largo en bits por mitades de 32 para que la conversión a float sea exacta
+    alto = (resto >> np.uint64(32)).astype(np.float64)
+    bajo = (resto & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    largo = np.where(alto > 0, np.frexp(alto)[1] + 32, np.frexp(bajo)[1])
+    rangos = np.minimum(65 - largo, 64 - BITS_HLL + 1).astype(np.uint8)
+    registros = np.zeros(1 << BITS_HLL, dtype=np.uint8)
+    np.maximum.at(registros, indices, rangos)
+    return registros
+
+
+def estimar_distintos(registros):
+    m = len(registros)
+    estimado = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.exp2(-registros.astype(np.float64)))
+    ceros = int(np.count_nonzero(registros == 0))
+    if estimado <= 2.5 * m and ceros:
+        # Pocos valores: conteo lineal sobre los registros vacíos
+        estimado = m * math.log(m / ceros)
+    return int(round(estimado))
+
+
+def _sumar_conteos(destino, conteos):
+    for valor, filas in conteos.items():
+        destino[valor] = destino.get(valor, 0) + int(filas)
+
+
+def _sketch(montos):
+    # Cubeta k = ⌈log_γ |x|⌉ con sus filas
+    cubetas, filas = np.unique(np.ceil(np.log(montos) / math.log(GAMMA)).astype(np.int64), return_counts=True)
+    return dict(zip(cubetas.tolist(), filas.tolist()))
+
+
+def _perfilar_aba(aba, montos):
+    montos = pd.to_numeric(montos, errors='coerce').dropna().to_numpy(dtype=np.float64)
+    if not len(montos):
+        return
+    _sumar_conteos(aba['positivos'], _sketch(montos[montos > 0]))
+    _sumar_conteos(aba['negativos'], _sketch(-montos[montos < 0]))
+    aba['ceros'] += int(np.count_nonzero(montos == 0))
+    aba['suma'] += float(montos.sum())
+    aba['minimo'] = min(float(montos.min()), aba['minimo'] if aba['minimo'] is not None else math.inf)
+    aba['maximo'] = max(float(montos.max()), aba['maximo'] if aba['maximo'] is not None else -math.inf)
+
+
+def perfilar(tabla, df):
+    # Un bloque ya leído (y, en el histórico, con el ABA convertido a número)
+    exactas = COLUMNAS_EXACTAS.get(tabla, [])
+    nulos, valores, hll = {}, {}, {}
+    # Una pasada por columna: value_counts ya trae los nulos y la máscara de nulos se reusa para el HLL
+    for col in df.columns:
+        if col in COLUMNAS_IGNORADAS:
+            continue
+        if col in exactas:
+            conteos = df[col].value_counts(dropna=False)
+            nulos[col] = int(conteos[conteos.index.isna()].sum())
+            valores[col] = conteos[conteos.index.notna()]
+        else:
+            vacios = df[col].isna()
+            nulos[col] = int(vacios.sum())
+            if col not in COLUMNAS_MONTO:
+                hll[col] = _registros_hll(df[col][~vacios])
+    with _candado:
+        perfil = _perfiles.setdefault(tabla, _nuevo())
+        perfil['filas'] += len(df)
+        _sumar_conteos(perfil['nulos'], nulos)
+        for col, conteos in valores.items():
+            _sumar_conteos(perfil['valores'].setdefault(col, {}), {str(v): n for v, n in conteos.items()})
+        for col, registros in hll.items():
+            actuales = perfil['hll'].get(col)
+            perfil['hll'][col] = registros if actuales is None else np.maximum(actuales, registros)
+        if tabla == 'historico_aba_macroactivos' and 'aba' in df.columns:
+            _perfilar_aba(perfil['aba'], df['aba'])
+
+
+def contar_reglas(tabla, conteos):
+    with _candado:
+        _sumar_conteos(_perfiles.setdefault(tabla, _nuevo())['reglas'], conteos)
+
+
+def exportar():
+    with _candado:
+        return {tabla: perfil for tabla, perfil in _perfiles.items()}
+
+
+def combinar(perfiles):
+    # Suma lo perfilado en otro proceso (p. ej. los trabajadores de la ingesta paralela)
+    with _candado:
+        for tabla, otro in perfiles.items():
+            perfil = _perfiles.setdefault(tabla, _nuevo())
+            perfil['filas'] += otro['filas']
+            _sumar_conteos(perfil['nulos'], otro['nulos'])
+            _sumar_conteos(perfil['reglas'], otro['reglas'])
+            for col, conteos in otro['valores'].items():
+                _sumar_conteos(perfil['valores'].setdefault(col, {}), conteos)
+            for col, registros in otro['hll'].items():
+                actuales = perfil['hll'].get(col)
+                perfil['hll'][col] = registros if actuales is None else np.maximum(actuales, registros)
+            aba, otra = perfil['aba'], otro['aba']
+            _sumar_conteos(aba['positivos'], otra['positivos'])
+            _sumar_conteos(aba['negativos'], otra['negativos'])
+            aba['ceros'] += otra['ceros']
+            aba['suma'] += otra['suma']
+            for campo, funcion in (('minimo', min), ('maximo', max)):
+                extremos = [v for v in (aba[campo], otra[campo]) if v is not None]
+                aba[campo] = funcion(extremos) if extremos else None
+
+
+def _representativo(cubeta):
+    return 2 * GAMMA ** cubeta / (GAMMA + 1)
+
+
+def _distribucion(sketch):
+    # (monto representativo, filas) de menor a mayor
+    negativos = [(-_representativo(int(k)), n) for k, n in sorted(sketch['negativos'].items(),
+                                                                    key=lambda c: -int(c[0]))]
+    ceros = [(0.0, sketch['ceros'])] if sketch['ceros'] else []
+    positivos = [(_representativo(int(k)), n) for k, n in sorted(sketch['positivos'].items(), key=lambda c: int(c[0]))]
+    return negativos + ceros + positivos
+
+
+def cuantiles(sketch, probabilidades=CUANTILES):
+    distribucion = _distribucion(sketch)
+    total = sum(n for _, n in distribucion)
+    resultado = {}
+    if not total:
+        return resultado
+    montos = np.array([monto for monto, _ in distribucion])
+    acumulado = np.cumsum([n for _, n in distribucion])
+    for p in probabilidades:
+        resultado[p] = float(montos[np.searchsorted(acumulado, p * (total - 1), side='right')])
+    return resultado
+
+
+def histograma_aba(detalle):
+    # Filas por orden de magnitud del ABA (10^k ≤ |aba| < 10^(k+1)) a partir del sketch guardado en JSON
+    sketch = json.loads(detalle) if isinstance(detalle, str) else detalle
+    df = pd.DataFrame(_distribucion(sketch), columns=['monto', 'filas'])
+    if df.empty:
+        return pd.DataFrame(columns=['rango', 'filas'])
+    magnitud = np.floor(np.log10(df['monto'].abs().replace(0, np.nan))).fillna(0).astype(int)
+    # Negativos de mayor a menor magnitud, luego el cero y los positivos de menor a mayor
+    df['orden'] = np.sign(df['monto']).astype(int) * (magnitud + 1000)
+    df['rango'] = [f"{'-' if orden < 0 else ''}1e{m}" if orden else '0' for orden, m in zip(df['orden'], magnitud)]
+    return df.groupby(['orden', 'rango'])['filas'].sum().reset_index().drop(columns='orden')
+
+
+def _codigos_catalogo(conn, tabla, columna):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT TRIM({columna}) FROM {tabla} WHERE {columna} IS NOT NULL")
+    codigos = {fila[0] for fila in cursor.fetchall()}
+    cursor.close()
+    return codigos
+
+
+def indicadores(conn):
+    # Filas (tabla, columna, indicador, valor, detalle) del perfil acumulado
+    filas = []
+    catalogos = {}
+    for tabla, perfil in exportar().items():
+        if not perfil['filas'] and not perfil['reglas']:
+            continue
+        filas.append((tabla, None, 'filas', perfil['filas'], None))
+        for col, nulos in perfil['nulos'].items():
+            filas.append((tabla, col, 'nulos', nulos, None))
+        for col, conteos in perfil['valores'].items():
+            filas.append((tabla, col, 'distintos', len(conteos), 'exacto'))
+        for col, registros in perfil['hll'].items():
+            filas.append((tabla, col, 'distintos', estimar_distintos(registros), 'hyperloglog'))
+        for nombre, rechazadas in perfil['reglas'].items():
+            indicador = 'filas_realineadas' if nombre == 'realineada' else f"regla:{nombre}"
+            filas.append((tabla, None, indicador, rechazadas, None))
+
+        if tabla == 'historico_aba_macroactivos':
+            for col, (catalogo, columna) in CATALOGOS.items():
+                if col not in perfil['valores']:
+                    continue
+                if catalogo not in catalogos:
+                    catalogos[catalogo] = _codigos_catalogo(conn, catalogo, columna)
+                desconocidos = {v: n for v, n in perfil['valores'][col].items()
+                                if v.strip() not in catalogos[catalogo]}
+                ejemplos = dict(sorted(desconocidos.items(), key=lambda c: -c[1])[:MAXIMO_EJEMPLOS])
+                filas.append((tabla, col, 'codigos_desconocidos', len(desconocidos),
+                              json.dumps(ejemplos, ensure_ascii=False)))
+                filas.append((tabla, col, 'filas_codigo_desconocido', sum(desconocidos.values()), catalogo))
+
+            aba = perfil['aba']
+            leidos = sum(aba['positivos'].values()) + sum(aba['negativos'].values()) + aba['ceros']
+            if leidos:
+                for p, monto in cuantiles(aba).items():
+                    filas.append((tabla, 'aba', f"p{round(p * 100):02d}", monto, None))
+                filas += [
+                    (tabla, 'aba', 'minimo', aba['minimo'], None),
+                    (tabla, 'aba', 'maximo', aba['maximo'], None),
+                    (tabla, 'aba', 'media', aba['suma'] / leidos, None),
+                    (tabla, 'aba', 'ceros', aba['ceros'], None),
+                    (tabla, 'aba', 'negativos', sum(aba['negativos'].values()), None),
+                    (tabla, 'aba', 'sketch', leidos, json.dumps(aba, sort_keys=True)),
+                ]
+    return filas
+
+
+def guardar(conn, id_ejecucion, inicio):
+    filas = indicadores(conn)
+    if not filas:
+        print("🔬 Sin filas leídas en esta ejecución: no hay perfil de calidad que guardar")
+        return 0
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT INTO perfil_calidad (id_ejecucion, inicio, tabla, columna, indicador, valor, detalle)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, [(id_ejecucion, inicio, *fila) for fila in filas])
+    conn.commit()
+    cursor.close()
+    for tabla, col, indicador, valor, detalle in filas:
+        if indicador == 'codigos_desconocidos' and valor:
+            filas_col = next(f[3] for f in filas if f[:3] == (tabla, col, 'filas_codigo_desconocido'))
+            ejemplos = ', '.join(list(json.loads(detalle))[:5])
+            print(f"⚠️ '{col}': {valor} código(s) que no están en el catálogo ({filas_col} fila(s)): {ejemplos}")
+    print(f"🔬 Perfil de calidad guardado en 'perfil_calidad': {len(filas)} indicador(es) (ejecución {id_ejecucion})")
+    return len(filas)